@@ -0,0 +1,600 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2026 RoadrunnerWMC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import json
+import os
+from pathlib import Path
+import re
+from typing import Any
+
+
+NINJA_FILE = Path('build.ninja')
+NINJA_LOG_NAME = '.ninja_log'
+CW_WRAPPER_TIMINGS_NAME = 'cw_wrapper_timings.jsonl'
+
+# Edge bindings that may contain a short, human-readable name for the
+# step, in order of preference
+LABEL_BINDINGS = ['out_filename', 'out_shortname', 'outxml_filename']
+
+# Rough descriptions of where each rule comes from, for the report
+RULE_ORIGINS = {
+    'mwcc': 'C++ compile',
+    'mwasm': 'assembly',
+    'mwpch': 'precompiled header',
+    'kmdynamic': 'Kamek link',
+    'kmlink': 'Kamek link (all versions)',
+    'kmstatic': 'loader link',
+    'credits': 'credits',
+    'riixml': 'Riivolution XML',
+    'configure': 'build.ninja regeneration',
+}
+
+ninja_variable = re.compile(r'\$(?:\{([\w.-]+)\}|([\w-]+))')
+
+
+########################################################################
+############################# Ninja files ##############################
+########################################################################
+
+
+class NinjaEdge:
+    """
+    One "build" statement from a Ninja file
+    """
+    rule: str
+    outputs: list[str]
+    inputs: list[str]  # explicit, implicit and order-only
+    explicit_inputs: list[str]
+    bindings: dict[str, str]
+    ninja_file: Path
+
+    def __init__(self, rule: str, outputs: list[str], inputs: list[str], explicit_inputs: list[str], bindings: dict[str, str], ninja_file: Path):
+        super().__init__()
+        self.rule = rule
+        self.outputs = outputs
+        self.inputs = inputs
+        self.explicit_inputs = explicit_inputs
+        self.bindings = bindings
+        self.ninja_file = ninja_file
+
+    def label(self) -> str:
+        """
+        A short name for this edge
+        """
+        for key in LABEL_BINDINGS:
+            if self.bindings.get(key):
+                return self.bindings[key]
+        return os.path.basename(self.outputs[0])
+
+
+def canonicalize_path(path: str) -> str:
+    """
+    Canonicalize a path the same way Ninja does (lexically, without
+    touching the filesystem)
+    """
+    return os.path.normpath(path) if path else path
+
+
+def expand_ninja_string(text: str, scope: dict[str, str]) -> str:
+    """
+    Expand variables and escapes in a Ninja string
+    """
+    out = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c != '$':
+            out.append(c)
+            i += 1
+            continue
+
+        nxt = text[i + 1 : i + 2]
+        if nxt in ('$', ' ', ':'):
+            out.append(nxt)
+            i += 2
+        elif nxt == '\n':
+            i += 2
+            while i < len(text) and text[i] == ' ':
+                i += 1
+        else:
+            match = ninja_variable.match(text, i)
+            if match is None:
+                raise ValueError(f'bad $-escape in {text!r}')
+            out.append(scope.get(match[1] or match[2], ''))
+            i = match.end()
+
+    return ''.join(out)
+
+
+def split_ninja_paths(text: str) -> list[str]:
+    """
+    Split the unexpanded path list from a "build" line at unescaped
+    spaces (keeping "|" and "||" as separate items)
+    """
+    items = []
+    current = ''
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == '$' and i + 1 < len(text):
+            current += text[i : i + 2]
+            i += 2
+            continue
+        if c == ' ':
+            if current:
+                items.append(current)
+            current = ''
+        else:
+            current += c
+        i += 1
+    if current:
+        items.append(current)
+    return items
+
+
+def find_unescaped_colon(text: str) -> int:
+    """
+    Find the colon that separates outputs from the rule name in a
+    "build" line
+    """
+    i = 0
+    while i < len(text):
+        if text[i] == '$':
+            i += 2
+        elif text[i] == ':':
+            return i
+        else:
+            i += 1
+    raise ValueError(f'"build" line with no colon: {text!r}')
+
+
+def read_ninja_lines(path: Path) -> list[str]:
+    """
+    Read a Ninja file as a list of logical lines ("$" line continuations
+    joined), with comments and blank lines removed
+    """
+    text = path.read_text(encoding='utf-8')
+    text = re.sub(r'\$\n[ ]*', '', text.replace('\r\n', '\n'))
+    return [line for line in text.split('\n') if line.strip() and not line.lstrip().startswith('#')]
+
+
+def parse_ninja_file(path: Path, scope: dict[str, str] | None = None, edges: list[NinjaEdge] | None = None) -> list[NinjaEdge]:
+    """
+    Parse a Ninja file (and any files it includes) into a list of edges.
+    Only as much of the syntax as is needed to find each edge's rule,
+    outputs and inputs is supported.
+    """
+    if scope is None:
+        scope = {}
+    if edges is None:
+        edges = []
+
+    lines = read_ninja_lines(path)
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+
+        # Collect the indented binding lines that follow this one
+        block = {}
+        while i < len(lines) and lines[i][0] in ' \t':
+            key, _, value = lines[i].strip().partition('=')
+            block[key.strip()] = value.strip()
+            i += 1
+
+        keyword, _, rest = line.partition(' ')
+        rest = rest.strip()
+
+        if keyword == 'build':
+            colon = find_unescaped_colon(rest)
+            outs = split_ninja_paths(rest[:colon])
+            rule, *ins = split_ninja_paths(rest[colon + 1 :])
+
+            explicit_ins = []
+            for item in ins:
+                if item in ('|', '||', '|@'):
+                    break
+                explicit_ins.append(item)
+
+            bindings = {k: expand_ninja_string(v, scope) for k, v in block.items()}
+            expand_path = lambda p: canonicalize_path(expand_ninja_string(p, scope))
+            edges.append(NinjaEdge(
+                rule,
+                [expand_path(p) for p in outs if p != '|'],
+                [expand_path(p) for p in ins if p not in ('|', '||', '|@')],
+                [expand_path(p) for p in explicit_ins],
+                bindings,
+                path))
+
+        elif keyword in ('rule', 'pool', 'default'):
+            pass
+
+        elif keyword == 'subninja':
+            parse_ninja_file(Path(expand_ninja_string(rest, scope)), dict(scope), edges)
+
+        elif keyword == 'include':
+            parse_ninja_file(Path(expand_ninja_string(rest, scope)), scope, edges)
+
+        else:
+            key, sep, value = line.partition('=')
+            if not sep:
+                raise ValueError(f'{path}: unrecognized line {line!r}')
+            scope[key.strip()] = expand_ninja_string(value.strip(), scope)
+
+    return edges
+
+
+def read_top_level_variable(path: Path, name: str) -> str | None:
+    """
+    Read a single top-level variable from a Ninja file (without
+    following subninjas)
+    """
+    scope = {}
+    for line in read_ninja_lines(path):
+        if line[0] in ' \t' or line.split(' ', 1)[0] in ('build', 'rule', 'pool', 'default', 'subninja', 'include'):
+            continue
+        key, sep, value = line.partition('=')
+        if sep:
+            scope[key.strip()] = expand_ninja_string(value.strip(), scope)
+    return scope.get(name)
+
+
+########################################################################
+############################## Ninja log ###############################
+########################################################################
+
+
+class BuildStep:
+    """
+    One command that Ninja ran in the last build, and the edge it came
+    from
+    """
+    start: float  # seconds since the start of the build
+    end: float
+    outputs: list[str]
+    edge: NinjaEdge | None
+    cw_timings: dict[str, Any] | None
+
+    def __init__(self, start: float, end: float, outputs: list[str]):
+        super().__init__()
+        self.start = start
+        self.end = end
+        self.outputs = outputs
+        self.edge = None
+        self.cw_timings = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    @property
+    def rule(self) -> str:
+        return self.edge.rule if self.edge is not None else '(unknown)'
+
+    def label(self) -> str:
+        return self.edge.label() if self.edge is not None else os.path.basename(self.outputs[0])
+
+
+def read_last_build(log_path: Path) -> list[BuildStep]:
+    """
+    Read the steps run during the most recent build from a .ninja_log
+    file
+    """
+    lines = log_path.read_text(encoding='utf-8').splitlines()
+    if not lines or not lines[0].startswith('# ninja log v'):
+        raise ValueError(f"{log_path} doesn't look like a Ninja log")
+
+    # Entries are appended as each command finishes, so a decrease in
+    # end times means that a new build started
+    entries = {}
+    last_end = 0
+    for line in lines[1:]:
+        fields = line.split('\t')
+        if len(fields) < 5:
+            continue
+        start, end, _, output, command_hash = fields[:5]
+        start, end = int(start), int(end)
+        if end < last_end:
+            entries = {}
+        last_end = end
+        entries[output] = (start, end, command_hash)
+
+    # Commands with multiple outputs have one entry per output
+    steps = {}
+    for output, key in entries.items():
+        if key in steps:
+            steps[key].outputs.append(canonicalize_path(output))
+        else:
+            steps[key] = BuildStep(key[0] / 1000, key[1] / 1000, [canonicalize_path(output)])
+
+    return sorted(steps.values(), key=lambda s: (s.start, s.end))
+
+
+def read_cw_wrapper_timings(path: Path) -> dict[str, dict[str, Any]]:
+    """
+    Read a cw_wrapper.py timing log, and return the most recent record
+    for each output file
+    """
+    records = {}
+    for line in path.read_text(encoding='utf-8').splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get('output'):
+            records[canonicalize_path(record['output'])] = record
+    return records
+
+
+########################################################################
+############################### Analysis ###############################
+########################################################################
+
+
+def find_critical_path(steps: list[BuildStep]) -> list[BuildStep]:
+    """
+    Find the chain of dependent steps with the largest total duration
+    """
+    producer = {}
+    for step in steps:
+        for output in step.outputs:
+            producer[output] = step
+        if step.edge is not None:
+            for output in step.edge.outputs:
+                producer[output] = step
+
+    # Every dependency finishes before its dependents start, so
+    # processing in order of end time visits dependencies first
+    best = {}  # {id(step): (total duration, previous step)}
+    for step in sorted(steps, key=lambda s: s.end):
+        prev = None
+        prev_total = 0
+        if step.edge is not None:
+            for input in step.edge.inputs:
+                dep = producer.get(input)
+                if dep is None or dep is step or id(dep) not in best:
+                    continue
+                if best[id(dep)][0] > prev_total:
+                    prev, prev_total = dep, best[id(dep)][0]
+        best[id(step)] = (prev_total + step.duration, prev)
+
+    if not best:
+        return []
+
+    by_id = {id(s): s for s in steps}
+    step = by_id[max(best, key=lambda k: best[k][0])]
+    path = []
+    while step is not None:
+        path.append(step)
+        step = best[id(step)][1]
+    return path[::-1]
+
+
+def assign_lanes(steps: list[BuildStep]) -> dict[int, int]:
+    """
+    Assign steps to "lanes" (rows in the trace viewer) so that steps in
+    the same lane never overlap. Returns {id(step): lane}.
+    """
+    lane_ends = []
+    lanes = {}
+    for step in sorted(steps, key=lambda s: s.start):
+        for lane, end in enumerate(lane_ends):
+            if end <= step.start:
+                break
+        else:
+            lane = len(lane_ends)
+            lane_ends.append(0)
+        lane_ends[lane] = step.end
+        lanes[id(step)] = lane
+    return lanes
+
+
+def make_trace(steps: list[BuildStep], critical_path: list[BuildStep]) -> dict[str, Any]:
+    """
+    Create a Chrome trace ("Trace Event Format") object
+    """
+    critical = {id(s) for s in critical_path}
+    lanes = assign_lanes(steps)
+
+    events = []
+    for step in steps:
+        args = {'rule': step.rule, 'outputs': step.outputs}
+        if step.edge is not None:
+            args['ninja_file'] = str(step.edge.ninja_file)
+        if step.cw_timings is not None:
+            args['cache'] = step.cw_timings.get('cache')
+            args['server'] = step.cw_timings.get('server')
+
+        event = {
+            'name': step.label(),
+            'cat': step.rule,
+            'ph': 'X',
+            'ts': step.start * 1e6,
+            'dur': step.duration * 1e6,
+            'pid': 1,
+            'tid': lanes[id(step)],
+            'args': args,
+        }
+        if id(step) in critical:
+            event['cname'] = 'terrible'
+            args['critical_path'] = True
+        events.append(event)
+
+        # cw_wrapper.py's phases run one after another, so show them
+        # as nested slices starting at the beginning of the step
+        if step.cw_timings is not None:
+            t = step.start
+            for phase, seconds in step.cw_timings.get('phases', {}).items():
+                seconds = min(seconds, step.end - t)
+                if seconds <= 0:
+                    break
+                events.append({
+                    'name': phase,
+                    'cat': 'cw_wrapper',
+                    'ph': 'X',
+                    'ts': t * 1e6,
+                    'dur': seconds * 1e6,
+                    'pid': 1,
+                    'tid': lanes[id(step)],
+                })
+                t += seconds
+
+    events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'ninja'}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def format_seconds(seconds: float) -> str:
+    return f'{seconds:8.2f}s'
+
+
+def print_report(steps: list[BuildStep], critical_path: list[BuildStep], jobs: int, top: int) -> None:
+    """
+    Print a human-readable summary of the build
+    """
+    # (avoiding division by zero if everything took 0 ms)
+    wall = max(max(s.end for s in steps) - min(s.start for s in steps), 0.001)
+    total = max(sum(s.duration for s in steps), 0.001)
+    parallelism = total / wall
+
+    print(f'Steps run:            {len(steps)}')
+    print(f'Wall time:           {format_seconds(wall)}')
+    print(f'Total step time:     {format_seconds(total)}')
+    print(f'Average parallelism:  {parallelism:.2f} (of {jobs} jobs: {parallelism / jobs:.0%} efficient)')
+    if critical_path:
+        critical_total = sum(s.duration for s in critical_path)
+        print(f'Critical path:       {format_seconds(critical_total)} ({critical_total / wall:.0%} of wall time)')
+
+    print()
+    print('Per rule:')
+    per_rule = {}
+    for step in steps:
+        per_rule.setdefault(step.rule, []).append(step.duration)
+    for rule, durations in sorted(per_rule.items(), key=lambda kv: -sum(kv[1])):
+        origin = RULE_ORIGINS.get(rule, '')
+        print(f'  {rule:12} {origin:20} {len(durations):5} steps {format_seconds(sum(durations))} total'
+              f' {format_seconds(max(durations))} max  {sum(durations) / total:6.1%}')
+
+    print()
+    print('Critical path:')
+    for step in critical_path:
+        print(f'  {format_seconds(step.start)} +{step.duration:7.2f}s  {step.rule:12} {step.label()}')
+
+    print()
+    print(f'Slowest {top} steps:')
+    for step in sorted(steps, key=lambda s: -s.duration)[:top]:
+        print(f'  {format_seconds(step.duration)}  {step.rule:12} {step.label()}')
+
+    timed = [s for s in steps if s.cw_timings is not None]
+    if timed:
+        print()
+        print(f'cw_wrapper.py phases ({len(timed)} steps):')
+        phases = {}
+        caches = {}
+        for step in timed:
+            for phase, seconds in step.cw_timings.get('phases', {}).items():
+                phases[phase] = phases.get(phase, 0) + seconds
+            cache = step.cw_timings.get('cache') or 'off'
+            caches[cache] = caches.get(cache, 0) + 1
+        for phase, seconds in phases.items():
+            print(f'  {phase:14} {format_seconds(seconds)}')
+        print('  object cache: ' + ', '.join(f'{n} {k}' for k, n in sorted(caches.items())))
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Main function
+    """
+    parser = argparse.ArgumentParser(
+        description='Analyze the most recent Ninja build (run this from the same directory as Ninja):'
+            ' which steps took the longest, which chain of dependent steps bounded the total build time, and'
+            ' how well the build was parallelized. Can also export a trace to view in chrome://tracing.')
+
+    parser.add_argument('--ninja-file', type=Path, default=NINJA_FILE,
+        help=f'Ninja file that was built (default: {NINJA_FILE})')
+    parser.add_argument('--log', type=Path,
+        help=f'Ninja log file (default: {NINJA_LOG_NAME} in the Ninja file\'s $builddir)')
+    parser.add_argument('--cw-timings', type=Path, action='append',
+        help=f'cw_wrapper.py timing log to read (default: {CW_WRAPPER_TIMINGS_NAME} in any $builddir, if it exists;'
+             ' can be specified multiple times)')
+    parser.add_argument('--trace', type=Path, metavar='FILE',
+        help='write a chrome://tracing-compatible JSON trace to this file')
+    parser.add_argument('-j', '--jobs', type=int,
+        help='number of parallel jobs the build was run with (default: the number of CPUs + 2, like Ninja)')
+    parser.add_argument('--top', type=int, default=10,
+        help='how many of the slowest steps to list (default: 10)')
+
+    args = parser.parse_args(argv)
+
+    edges = parse_ninja_file(args.ninja_file)
+    edges_by_output = {}
+    for edge in edges:
+        for output in edge.outputs:
+            edges_by_output[output] = edge
+
+    log_path = args.log
+    if log_path is None:
+        builddir = read_top_level_variable(args.ninja_file, 'builddir')
+        log_path = Path(builddir or '.') / NINJA_LOG_NAME
+
+    steps = read_last_build(log_path)
+    if not steps:
+        raise ValueError(f'No build steps found in {log_path}')
+
+    for step in steps:
+        for output in step.outputs:
+            if output in edges_by_output:
+                step.edge = edges_by_output[output]
+                break
+
+    # Attach cw_wrapper.py timing records, if there are any
+    timing_files = args.cw_timings
+    if timing_files is None:
+        timing_files = set()
+        for ninja_file in {args.ninja_file, *(edge.ninja_file for edge in edges)}:
+            builddir = read_top_level_variable(ninja_file, 'builddir')
+            if builddir:
+                timing_files.add(Path(builddir) / CW_WRAPPER_TIMINGS_NAME)
+        timing_files = sorted(p for p in timing_files if p.is_file())
+
+    cw_timings = {}
+    for path in timing_files:
+        cw_timings.update(read_cw_wrapper_timings(path))
+    for step in steps:
+        for output in step.outputs:
+            if output in cw_timings:
+                step.cw_timings = cw_timings[output]
+                break
+
+    critical_path = find_critical_path(steps)
+    print_report(steps, critical_path, args.jobs or (os.cpu_count() or 1) + 2, args.top)
+
+    if args.trace is not None:
+        args.trace.write_text(json.dumps(make_trace(steps, critical_path)), encoding='utf-8')
+        print()
+        print(f'Wrote trace to {args.trace}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2026 RoadrunnerWMC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import argparse
+from array import array
+import bisect
+import hashlib
+import os
+from pathlib import Path
+import re
+import struct
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+COMPILED_SUFFIX = '.compiled'
+COMPILED_MAGIC = b'KAMC'
+COMPILED_FORMAT_VERSION = 1
+COMPILED_HEADER = struct.Struct('<4sIQQ32sI')
+
+MAX_ADDRESS = 0xFFFFFFFF
+
+# Interval list: parallel lists of (inclusive) range starts, range ends,
+# and the delta to add to addresses in each range
+Intervals = Tuple[List[int], List[int], List[int]]
+
+
+address_map_version_header_line = re.compile(
+    r'\[(\w+)\]'  # '[', one or more word chars (captured), ']'
+)
+address_map_extend_line = re.compile(
+    r'extend\s+(\w+)'
+)
+address_map_mapping_line = re.compile(
+    r'([0-9a-fA-F]+)'         # range start
+    r'\s*-\s*'                # '-'
+    r'([0-9a-fA-F]+|\*)'      # range end, or '*' for "the end of memory"
+    r'\s*:\s*'                # ':'
+    r'([+-]?)\s*(0x[0-9a-fA-F]+|\d+)'  # delta
+)
+
+
+class AddressMapVersion:
+    """
+    One game version in an address map. `starts`, `ends` and `deltas`
+    are a flattened interval table mapping addresses from the root
+    version of the "extend" chain directly to this version. Intervals
+    are sorted and non-overlapping; addresses outside all of them can't
+    be ported to this version.
+    """
+    name: str
+    base: Optional[str]
+    starts: array
+    ends: array
+    deltas: array
+
+    def __init__(self, name: str, base: Optional[str], starts: Iterable[int], ends: Iterable[int], deltas: Iterable[int]):
+        super().__init__()
+        self.name = name
+        self.base = base
+        self.starts = array('I', starts)
+        self.ends = array('I', ends)
+        self.deltas = array('q', deltas)
+        self._inverse = None
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def translate(self, address: int) -> Optional[int]:
+        """
+        Translate an address from the root version to this one
+        """
+        return lookup_interval(self.starts, self.ends, self.deltas, address)
+
+    def translate_many(self, addresses: Iterable[int]) -> List[Optional[int]]:
+        """
+        Translate any number of addresses from the root version to this
+        one. This walks the table once, instead of searching it once per
+        address.
+        """
+        return lookup_intervals_bulk(self.starts, self.ends, self.deltas, addresses)
+
+    def untranslate(self, address: int) -> Optional[int]:
+        """
+        Translate an address from this version back to the root version
+        """
+        if self._inverse is None:
+            self._inverse = invert_intervals((self.starts, self.ends, self.deltas))
+        return lookup_interval(*self._inverse, address)
+
+    def untranslate_many(self, addresses: Iterable[int]) -> List[Optional[int]]:
+        """
+        Translate any number of addresses from this version back to the
+        root version
+        """
+        if self._inverse is None:
+            self._inverse = invert_intervals((self.starts, self.ends, self.deltas))
+        return lookup_intervals_bulk(*self._inverse, addresses)
+
+
+def lookup_interval(starts, ends, deltas, address: int) -> Optional[int]:
+    """
+    Apply an interval table to a single address, in O(log n) time
+    """
+    i = bisect.bisect_right(starts, address) - 1
+    if i >= 0 and address <= ends[i]:
+        return address + deltas[i]
+    return None
+
+
+def lookup_intervals_bulk(starts, ends, deltas, addresses: Iterable[int]) -> List[Optional[int]]:
+    """
+    Apply an interval table to many addresses at once, by sorting them
+    and walking the table in step
+    """
+    addresses = list(addresses)
+    results = [None] * len(addresses)
+
+    i = 0
+    count = len(starts)
+    for j in sorted(range(len(addresses)), key=addresses.__getitem__):
+        address = addresses[j]
+        while i < count and ends[i] < address:
+            i += 1
+        if i == count:
+            break
+        if starts[i] <= address:
+            results[j] = address + deltas[i]
+
+    return results
+
+
+def add_first_match(intervals: Intervals, start: int, end: int, delta: int) -> None:
+    """
+    Add an interval to a sorted, non-overlapping interval table, but
+    only the parts of it that aren't already covered (since the first
+    matching line in an address map takes precedence)
+    """
+    starts, ends, deltas = intervals
+
+    i = bisect.bisect_right(starts, start) - 1
+    if i >= 0 and ends[i] >= start:
+        # Overlaps the previous interval
+        start = ends[i] + 1
+    i += 1
+
+    while start <= end:
+        if i < len(starts) and starts[i] <= end:
+            # Part of the new interval runs into the next existing one
+            if start < starts[i]:
+                starts.insert(i, start)
+                ends.insert(i, starts[i + 1] - 1)
+                deltas.insert(i, delta)
+                i += 1
+            start = ends[i] + 1
+            i += 1
+        else:
+            starts.insert(i, start)
+            ends.insert(i, end)
+            deltas.insert(i, delta)
+            break
+
+
+def merge_adjacent(intervals: Intervals) -> Intervals:
+    """
+    Merge touching intervals that have the same delta
+    """
+    new_starts, new_ends, new_deltas = [], [], []
+    for start, end, delta in zip(*intervals):
+        if new_starts and new_ends[-1] + 1 == start and new_deltas[-1] == delta:
+            new_ends[-1] = end
+        else:
+            new_starts.append(start)
+            new_ends.append(end)
+            new_deltas.append(delta)
+    return new_starts, new_ends, new_deltas
+
+
+def compose_intervals(base: Intervals, own: Intervals) -> Intervals:
+    """
+    Compose two interval tables: `base` maps root addresses to the base
+    version, and `own` maps base version addresses to this version.
+    Returns a table mapping root addresses directly to this version.
+    """
+    own_starts, own_ends, own_deltas = own
+    starts, ends, deltas = [], [], []
+
+    for start, end, delta in zip(*base):
+        # The part of the base version's address space this covers
+        img_start, img_end = start + delta, end + delta
+
+        i = max(0, bisect.bisect_right(own_starts, img_start) - 1)
+        while i < len(own_starts) and own_starts[i] <= img_end:
+            lo = max(img_start, own_starts[i])
+            hi = min(img_end, own_ends[i])
+            if lo <= hi:
+                starts.append(lo - delta)
+                ends.append(hi - delta)
+                deltas.append(delta + own_deltas[i])
+            i += 1
+
+    return merge_adjacent((starts, ends, deltas))
+
+
+def invert_intervals(intervals: Intervals) -> Intervals:
+    """
+    Invert an interval table. If several ranges map to the same
+    addresses, the one with the lowest source address wins.
+    """
+    inverse = ([], [], [])
+    for start, end, delta in sorted(zip(*intervals), key=lambda t: t[0] + t[2]):
+        add_first_match(inverse, start + delta, end + delta, -delta)
+    return merge_adjacent(inverse)
+
+
+class AddressMap:
+    """
+    A parsed Kamek address map ("versions file"), with every version's
+    "extend" chain flattened into a single interval table.
+
+    Note that unmapped address ranges are considered non-portable,
+    rather than implicitly +0x0.
+    """
+    versions: Dict[str, AddressMapVersion]
+
+    def __init__(self, versions: Dict[str, AddressMapVersion]):
+        super().__init__()
+        self.versions = versions
+
+    @property
+    def version_names(self) -> List[str]:
+        return list(self.versions)
+
+    def root_of(self, version: str) -> str:
+        """
+        Get the name of the root version of a version's "extend" chain
+        """
+        while self.versions[version].base is not None:
+            version = self.versions[version].base
+        return version
+
+    def translate(self, address: int, version: str) -> Optional[int]:
+        """
+        Translate an address from the root version to the specified
+        version, or return None if it can't be ported
+        """
+        return self.versions[version].translate(address)
+
+    def translate_many(self, addresses: Iterable[int], version: str) -> List[Optional[int]]:
+        """
+        Translate many addresses from the root version to the specified
+        version (None for any that can't be ported)
+        """
+        return self.versions[version].translate_many(addresses)
+
+    def port(self, address: int, from_version: str, to_version: str) -> Optional[int]:
+        """
+        Port an address from any version to any other version (with the
+        same root), or return None if it can't be done
+        """
+        root_address = self.versions[from_version].untranslate(address)
+        if root_address is None:
+            return None
+        return self.versions[to_version].translate(root_address)
+
+    def port_many(self, addresses: Iterable[int], from_version: str, to_version: str) -> List[Optional[int]]:
+        """
+        Port many addresses from any version to any other version (None
+        for any that can't be ported)
+        """
+        root_addresses = self.versions[from_version].untranslate_many(addresses)
+        valid = [a for a in root_addresses if a is not None]
+        translated = iter(self.versions[to_version].translate_many(valid))
+        return [None if a is None else next(translated) for a in root_addresses]
+
+    @classmethod
+    def from_text(cls, text: str, filename: str = 'address map') -> 'AddressMap':
+        """
+        Parse an address map from a string
+        """
+        # {version: (base, own intervals)}, in order
+        parsed = {}
+        current = None
+
+        for i, line in enumerate(text.splitlines()):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+
+            if match := address_map_version_header_line.fullmatch(line):
+                current = match[1]
+                if current in parsed:
+                    raise ValueError(f'{filename}, line {i+1}: version "{current}" is defined twice')
+                parsed[current] = [None, ([], [], [])]
+
+            elif current is None:
+                raise ValueError(f'{filename}, line {i+1}: expected a version header, got {line!r}')
+
+            elif match := address_map_extend_line.fullmatch(line):
+                if match[1] not in parsed:
+                    raise ValueError(f'{filename}, line {i+1}: unknown base version "{match[1]}"')
+                parsed[current][0] = match[1]
+
+            elif match := address_map_mapping_line.fullmatch(line):
+                start = int(match[1], 16)
+                end = MAX_ADDRESS if match[2] == '*' else int(match[2], 16)
+                delta = int(match[4], 0)
+                if match[3] == '-':
+                    delta = -delta
+                if end < start:
+                    raise ValueError(f'{filename}, line {i+1}: range end is before range start')
+                add_first_match(parsed[current][1], start, end, delta)
+
+            else:
+                raise ValueError(f"{filename}, line {i+1}: couldn't parse {line!r}")
+
+        # Bases must always be defined before the versions extending
+        # them, so we can flatten them in order
+        flattened = {}
+        versions = {}
+        for name, (base, own) in parsed.items():
+            if base is None:
+                flattened[name] = merge_adjacent(own)
+            else:
+                flattened[name] = compose_intervals(flattened[base], own)
+            versions[name] = AddressMapVersion(name, base, *flattened[name])
+
+        return cls(versions)
+
+    def to_bytes(self, source_stat: os.stat_result, source_hash: bytes) -> bytes:
+        """
+        Serialize to the compiled binary format
+        """
+        data = bytearray(COMPILED_HEADER.pack(
+            COMPILED_MAGIC,
+            COMPILED_FORMAT_VERSION,
+            source_stat.st_mtime_ns,
+            source_stat.st_size,
+            source_hash,
+            len(self.versions)))
+
+        for version in self.versions.values():
+            name = version.name.encode('utf-8')
+            base = (version.base or '').encode('utf-8')
+            data += struct.pack('<H', len(name)) + name
+            data += struct.pack('<H', len(base)) + base
+            data += struct.pack('<I', len(version))
+            for arr in [array('I', version.starts), array('I', version.ends), array('q', version.deltas)]:
+                if sys.byteorder == 'big':
+                    arr.byteswap()
+                data += arr.tobytes()
+
+        return bytes(data)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'AddressMap':
+        """
+        Deserialize from the compiled binary format
+        """
+        _, _, _, _, _, num_versions = COMPILED_HEADER.unpack_from(data)
+        offs = COMPILED_HEADER.size
+
+        def read_str() -> str:
+            nonlocal offs
+            length, = struct.unpack_from('<H', data, offs)
+            s = data[offs + 2 : offs + 2 + length].decode('utf-8')
+            offs += 2 + length
+            return s
+
+        def read_array(typecode: str, count: int) -> array:
+            nonlocal offs
+            arr = array(typecode)
+            arr.frombytes(data[offs : offs + count * arr.itemsize])
+            if sys.byteorder == 'big':
+                arr.byteswap()
+            offs += count * arr.itemsize
+            return arr
+
+        versions = {}
+        for _ in range(num_versions):
+            name = read_str()
+            base = read_str() or None
+            count, = struct.unpack_from('<I', data, offs)
+            offs += 4
+            starts = read_array('I', count)
+            ends = read_array('I', count)
+            deltas = read_array('q', count)
+            versions[name] = AddressMapVersion(name, base, starts, ends, deltas)
+
+        return cls(versions)
+
+    @classmethod
+    def load(cls, path: Path, use_compiled: bool = True) -> 'AddressMap':
+        """
+        Load an address map from a file. If `use_compiled` is True, a
+        compiled copy is kept next to it (with COMPILED_SUFFIX appended
+        to the filename), and used instead whenever it's up to date.
+        """
+        compiled_path = path.with_name(path.name + COMPILED_SUFFIX)
+        st = path.stat()
+
+        source_text = None
+        source_hash = None
+
+        if use_compiled:
+            try:
+                compiled = compiled_path.read_bytes()
+                magic, version, mtime_ns, size, compiled_hash, _ = COMPILED_HEADER.unpack_from(compiled)
+            except (OSError, struct.error):
+                compiled = None
+
+            if compiled is not None and magic == COMPILED_MAGIC and version == COMPILED_FORMAT_VERSION:
+                if (mtime_ns, size) == (st.st_mtime_ns, st.st_size):
+                    return cls.from_bytes(compiled)
+
+                # The timestamp changed, but maybe the contents didn't.
+                # If so, update the header with the new timestamp, so
+                # that the next load doesn't need to check again.
+                source_bytes = path.read_bytes()
+                source_hash = hashlib.sha256(source_bytes).digest()
+                if source_hash == compiled_hash:
+                    self = cls.from_bytes(compiled)
+                    cls.write_compiled(compiled_path,
+                        self.to_bytes(st, source_hash)[:COMPILED_HEADER.size] + compiled[COMPILED_HEADER.size:])
+                    return self
+                source_text = source_bytes.decode('utf-8')
+
+        if source_text is None:
+            source_bytes = path.read_bytes()
+            source_hash = hashlib.sha256(source_bytes).digest()
+            source_text = source_bytes.decode('utf-8')
+
+        self = cls.from_text(source_text, path.name)
+
+        if use_compiled:
+            cls.write_compiled(compiled_path, self.to_bytes(st, source_hash))
+
+        return self
+
+    @staticmethod
+    def write_compiled(compiled_path: Path, data: bytes) -> None:
+        """
+        Atomically write a compiled address map file. Errors are ignored,
+        since it's only an optimization.
+        """
+        try:
+            temp_path = compiled_path.with_name(f'{compiled_path.name}.{os.getpid()}.tmp')
+            temp_path.write_bytes(data)
+            os.replace(temp_path, compiled_path)
+        except OSError:
+            # Not a big deal; we'll just parse the text again next time
+            pass
+
+
+def main(argv=None) -> None:
+    """
+    Main function
+    """
+    parser = argparse.ArgumentParser(
+        description='Port addresses between game versions using a Kamek address map.')
+
+    parser.add_argument('address_map', type=Path,
+        help='address map file (address-map.txt or versions.txt)')
+    parser.add_argument('--from', dest='from_version', metavar='VERSION',
+        help='version the addresses are for (default: the root version)')
+    parser.add_argument('--to', dest='to_version', metavar='VERSION', action='append',
+        help='version to port the addresses to (can be specified multiple times; default: all versions)')
+    parser.add_argument('addresses', nargs='*', metavar='ADDRESS',
+        help='addresses to port, in hex')
+
+    args = parser.parse_intermixed_args(argv)
+
+    amap = AddressMap.load(args.address_map)
+    to_versions = args.to_version or amap.version_names
+    from_version = args.from_version or amap.root_of(to_versions[0])
+
+    for v in [from_version, *to_versions]:
+        if v not in amap.versions:
+            raise ValueError(f'Unknown version: "{v}" (expected one of {amap.version_names})')
+
+    addresses = [int(a, 16) for a in args.addresses]
+    results = {v: amap.port_many(addresses, from_version, v) for v in to_versions}
+
+    print(' '.join([f'{from_version:>8}', *(f'{v:>8}' for v in to_versions)]))
+    for i, address in enumerate(addresses):
+        cells = [f'{address:08x}']
+        for v in to_versions:
+            result = results[v][i]
+            cells.append('       -' if result is None else f'{result:08x}')
+        print(' '.join(cells))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2026 RoadrunnerWMC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import cw_cache
+
+
+# Bump this whenever the cache layout or key computation changes, so
+# that old entries can't be mistaken for new ones
+CACHE_VERSION = 2
+
+DEFAULT_MAX_SIZE = 1024 ** 3  # 1 GiB
+DEFAULT_MAX_AGE_DAYS = 30
+
+META_FILE_NAME = 'meta.json'
+
+
+def files_equal(a: Path, b: Path) -> bool:
+    """
+    Check if two files have the same contents
+    """
+    try:
+        if a.stat().st_size != b.stat().st_size:
+            return False
+        return a.read_bytes() == b.read_bytes()
+    except OSError:
+        return False
+
+
+def copy_file_atomic(src: Path, dst: Path) -> None:
+    """
+    Copy a file such that concurrent readers never see `dst`
+    half-written
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=dst.name, dir=dst.parent)
+    os.close(fd)
+    try:
+        shutil.copyfile(src, temp_path)
+        os.replace(temp_path, dst)
+    except OSError:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+class ArtifactCache:
+    """
+    A content-addressed cache of whole build steps' outputs (Kamekfiles,
+    patched assets, etc.), which can be shared between machines (e.g.
+    on a network drive).
+
+    Each entry is keyed by the command line (with input and output paths
+    replaced by placeholders, so that it doesn't matter where the build
+    directory is) and the contents of every input file, which should
+    include the tools themselves. Unlike cw_cache.py, the complete list
+    of inputs is known up front, so no dependency manifests are needed.
+
+    Some inputs are themselves JSON files listing other paths (e.g.
+    kamek_link.py's link manifest); the same placeholders are applied
+    to the strings in those before they're hashed. Paths within "base
+    directories" (e.g. the build directory) are made relative to them.
+    """
+    cache_dir: Path
+    max_size: int
+    max_age: Optional[float]
+
+    def __init__(self, cache_dir: Path, max_size: int = DEFAULT_MAX_SIZE, max_age_days: Optional[float] = DEFAULT_MAX_AGE_DAYS):
+        super().__init__()
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age_days * 24 * 60 * 60 if max_age_days is not None else None
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / 'entries' / key[:2] / key
+
+    def record_stat(self, field: str) -> None:
+        """
+        Record a hit, miss, etc., and clean up the cache if it's time to
+        (see cw_cache.append_stat())
+        """
+        if cw_cache.append_stat(self.cache_dir, field) and cw_cache.compact_stats(self.cache_dir):
+            self.cleanup()
+
+    def read_stats(self) -> Dict[str, int]:
+        return cw_cache.read_stats(self.cache_dir)
+
+    def compute_key(self, command: List[str], inputs: List[Path], outputs: List[Path],
+            base_dirs: Sequence[Path] = (), manifests: Sequence[Path] = ()) -> Optional[str]:
+        """
+        Compute the cache key for a command, or return None if it can't
+        be cached (because an input is missing or isn't a file, or a
+        manifest isn't valid JSON)
+        """
+        # Both as given and as absolute paths, since manifests may use
+        # either. Longest paths first, so that a path that's a prefix of
+        # another one doesn't clobber it.
+        placeholders = []
+        for i, path in enumerate(inputs):
+            placeholders.append((str(path), f'<input {i}>'))
+            placeholders.append((os.path.abspath(path), f'<input {i}>'))
+        for i, path in enumerate(outputs):
+            placeholders.append((str(path), f'<output {i}>'))
+            placeholders.append((os.path.abspath(path), f'<output {i}>'))
+        for i, path in enumerate(base_dirs):
+            placeholders.append((os.path.abspath(path), f'<base {i}>'))
+        placeholders.sort(key=lambda p: len(p[0]), reverse=True)
+
+        def normalize(value):
+            if isinstance(value, str):
+                for path_str, placeholder in placeholders:
+                    value = value.replace(path_str, placeholder)
+                return value
+            elif isinstance(value, list):
+                return [normalize(v) for v in value]
+            elif isinstance(value, dict):
+                return {normalize(k): normalize(v) for k, v in value.items()}
+            return value
+
+        key_args = []
+        for arg in command:
+            if arg == sys.executable:
+                # Different machines' Python installations are likely to
+                # be in different places
+                key_args.append('<python>')
+                continue
+            key_args.append(normalize(arg))
+
+        h = hashlib.sha256()
+        h.update(json.dumps([CACHE_VERSION, key_args, len(outputs)]).encode('utf-8'))
+        for path in inputs:
+            try:
+                if path in manifests:
+                    contents = normalize(json.loads(path.read_text(encoding='utf-8')))
+                    h.update(hashlib.sha256(json.dumps(contents, sort_keys=True).encode('utf-8')).digest())
+                else:
+                    h.update(bytes.fromhex(cw_cache.hash_file(path)))
+            except (OSError, ValueError):
+                return None
+        return h.hexdigest()
+
+    def restore(self, key: str, outputs: List[Path]) -> bool:
+        """
+        If there's an entry for this key, put its files in place and
+        return True. Outputs that already have the right contents aren't
+        touched, so that Ninja's "restat" still works.
+        """
+        entry = self.entry_path(key)
+        try:
+            meta = json.loads((entry / META_FILE_NAME).read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return False
+
+        present = meta.get('present')
+        if not isinstance(present, list) or len(present) != len(outputs):
+            return False
+
+        try:
+            for i, (output, is_present) in enumerate(zip(outputs, present)):
+                if not is_present:
+                    # The command deleted (or didn't create) this output
+                    output.unlink(missing_ok=True)
+                elif not files_equal(entry / str(i), output):
+                    copy_file_atomic(entry / str(i), output)
+        except OSError:
+            # Probably evicted by another process while we were reading it
+            return False
+
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return True
+
+    def store(self, key: str, outputs: List[Path]) -> None:
+        """
+        Add the outputs of a successful command to the cache
+        """
+        entry = self.entry_path(key)
+        if entry.is_dir():
+            return
+
+        # Assemble the entry in a temporary directory next to where it
+        # goes, and then move it into place all at once, so that
+        # concurrent readers (or other machines) never see a partial one
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        temp_dir = Path(tempfile.mkdtemp(prefix=f'{key}.', dir=entry.parent))
+        try:
+            present = []
+            for i, output in enumerate(outputs):
+                present.append(output.is_file())
+                if present[-1]:
+                    shutil.copyfile(output, temp_dir / str(i))
+            (temp_dir / META_FILE_NAME).write_text(json.dumps({'present': present}), encoding='utf-8')
+            os.rename(temp_dir, entry)
+        except OSError:
+            # (Including if another process stored the same entry first)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def iter_entries(self) -> Iterator[Tuple[float, int, Path]]:
+        """
+        Iterate over all entries, as (last-used time, size, path) tuples
+        """
+        entries_dir = self.cache_dir / 'entries'
+        if not entries_dir.is_dir():
+            return
+        for subdir in os.scandir(entries_dir):
+            if not subdir.is_dir():
+                continue
+            for e in os.scandir(subdir.path):
+                try:
+                    st = e.stat()
+                    size = sum(f.stat().st_size for f in os.scandir(e.path))
+                except OSError:
+                    continue
+                yield st.st_mtime, size, Path(e.path)
+
+    def total_size(self) -> int:
+        return sum(size for _, size, _ in self.iter_entries())
+
+    def cleanup(self, max_size: Optional[int] = None, max_age: Optional[float] = None) -> None:
+        """
+        Delete entries that haven't been used in more than `max_age`
+        seconds, and then, if the cache is still bigger than `max_size`
+        bytes, the least-recently-used ones until it's down to 90% of
+        that (defaults: the cache's configured limits)
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if max_age is None:
+            max_age = self.max_age
+
+        now = time.time()
+        entries = []
+        total = 0
+        for mtime, size, path in self.iter_entries():
+            if max_age is not None and now - mtime > max_age:
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            entries.append((mtime, size, path))
+            total += size
+
+        if total <= max_size:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= max_size * 0.9:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self) -> None:
+        shutil.rmtree(self.cache_dir / 'entries', ignore_errors=True)
+
+    def run(self, command: List[str], inputs: List[Path], outputs: List[Path],
+            base_dirs: Sequence[Path] = (), manifests: Sequence[Path] = ()) -> int:
+        """
+        Run a command through the cache, and return its exit code
+        """
+        key = self.compute_key(command, inputs, outputs, base_dirs, manifests)
+        if key is None:
+            self.record_stat('uncacheable')
+            return subprocess.run(command).returncode
+
+        if self.restore(key, outputs):
+            self.record_stat('hit')
+            return 0
+
+        self.record_stat('miss')
+        returncode = subprocess.run(command).returncode
+        if returncode == 0:
+            self.store(key, outputs)
+        return returncode
+
+
+def run_main(argv: List[str]) -> None:
+    """
+    Main function when used as a launcher (with "--")
+    """
+    split = argv.index('--')
+    command = argv[split + 1:]
+
+    parser = argparse.ArgumentParser(
+        usage='%(prog)s --cache-dir DIR [options] --inputs FILE... --outputs FILE... -- COMMAND...',
+        description='Run a build command, or restore its outputs from the artifact cache if it has been run with the same inputs before.')
+
+    parser.add_argument('--cache-dir', type=Path, required=True,
+        help='cache directory')
+    parser.add_argument('--max-size', default=str(DEFAULT_MAX_SIZE),
+        help='maximum cache size, e.g. "500M" or "2G" (default: 1G)')
+    parser.add_argument('--max-age', type=float, metavar='DAYS', default=DEFAULT_MAX_AGE_DAYS,
+        help=f'evict entries that haven\'t been used in this many days (default: {DEFAULT_MAX_AGE_DAYS})')
+    parser.add_argument('--inputs', type=Path, nargs='*', default=[],
+        help='every file the command reads, including the tools themselves')
+    parser.add_argument('--outputs', type=Path, nargs='+', required=True,
+        help='every file the command writes')
+    parser.add_argument('--manifests', type=Path, nargs='*', default=[],
+        help='inputs that are JSON files containing paths, which are normalized like the command line before hashing')
+    parser.add_argument('--base-dir', type=Path, action='append', default=[],
+        help='a directory (e.g. the build directory) whose location shouldn\'t affect the cache key; can be specified multiple times')
+
+    args = parser.parse_args(argv[:split])
+    if not command:
+        parser.error('no command given after "--"')
+
+    cache = ArtifactCache(args.cache_dir, cw_cache.parse_size(args.max_size), args.max_age)
+    returncode = cache.run(command, args.inputs, args.outputs, args.base_dir, args.manifests)
+
+    if returncode != 0:
+        sys.exit(returncode)
+
+
+def main(argv=None) -> None:
+    """
+    Main function
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if '--' in argv:
+        run_main(argv)
+        return
+
+    parser = argparse.ArgumentParser(
+        description='Manage an artifact cache. To run a command through the cache, use'
+        ' "%(prog)s --cache-dir DIR --inputs FILE... --outputs FILE... -- COMMAND...".')
+
+    parser.add_argument('cache_dir', type=Path,
+        help='cache directory')
+    parser.add_argument('--show-stats', action='store_true',
+        help='show cache statistics')
+    parser.add_argument('--zero-stats', action='store_true',
+        help='reset the statistics')
+    parser.add_argument('--cleanup', metavar='SIZE',
+        help='evict least-recently-used entries until the cache is under this size (e.g. "500M")')
+    parser.add_argument('--max-age', type=float, metavar='DAYS',
+        help='evict entries that haven\'t been used in this many days')
+    parser.add_argument('--clear', action='store_true',
+        help='delete all cached entries')
+
+    args = parser.parse_args(argv)
+    cache = ArtifactCache(args.cache_dir)
+
+    if args.clear:
+        cache.clear()
+    if args.cleanup or args.max_age is not None:
+        cache.cleanup(
+            cw_cache.parse_size(args.cleanup) if args.cleanup else float('inf'),
+            args.max_age * 24 * 60 * 60 if args.max_age is not None else float('inf'))
+    if args.zero_stats:
+        cw_cache.zero_stats(args.cache_dir)
+
+    if args.show_stats or not (args.clear or args.cleanup or args.max_age is not None or args.zero_stats):
+        cw_cache.print_stats(args.cache_dir, cache.total_size())
+
+
+if __name__ == '__main__':
+    main()
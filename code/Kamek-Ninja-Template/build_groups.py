@@ -0,0 +1,614 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2026 RoadrunnerWMC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import hashlib
+import json
+import operator
+from pathlib import Path
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import address_map
+
+
+# Any 32-bit hex literal in this range is assumed to be a game address
+MIN_GAME_ADDRESS = 0x80000000
+
+MAX_INCLUDE_DEPTH = 64
+
+
+comments_and_literals = re.compile(
+    r'//[^\n]*'                     # line comment
+    r'|/\*.*?\*/'                   # block comment
+    r'|"(?:\\.|[^"\\\n])*"'         # string literal
+    r"|'(?:\\.|[^'\\\n])*'",        # char literal
+    re.DOTALL)
+directive_line = re.compile(r'\s*#\s*(\w*)\s*(.*?)\s*')
+define_body = re.compile(r'([A-Za-z_]\w*)(\([^)]*\))?\s*(.*)')
+include_target = re.compile(r'"([^"]+)"|<([^>]+)>')
+identifier = re.compile(r'[A-Za-z_]\w*')
+address_literal = re.compile(r'\b0[xX]([0-9a-fA-F]{8})\b')
+expression_token = re.compile(
+    r'\s*(?:'
+    r'(0[xX][0-9a-fA-F]+|\d+)[uUlL]*'  # number (suffixes are ignored)
+    r'|([A-Za-z_]\w*)'                  # identifier
+    r'|(<<|>>|<=|>=|==|!=|&&|\|\||[-+*/%<>!~&|^?:(),])'  # operator
+    r')')
+
+
+def c_div(a: int, b: int) -> int:
+    if b == 0:
+        raise ValueError('division by zero in #if')
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def c_mod(a: int, b: int) -> int:
+    return a - b * c_div(a, b)
+
+
+# {operator: (precedence, function)}
+BINARY_OPERATORS: Dict[str, Tuple[int, Callable[[int, int], int]]] = {
+    '*': (10, operator.mul),
+    '/': (10, c_div),
+    '%': (10, c_mod),
+    '+': (9, operator.add),
+    '-': (9, operator.sub),
+    '<<': (8, operator.lshift),
+    '>>': (8, operator.rshift),
+    '<': (7, lambda a, b: int(a < b)),
+    '>': (7, lambda a, b: int(a > b)),
+    '<=': (7, lambda a, b: int(a <= b)),
+    '>=': (7, lambda a, b: int(a >= b)),
+    '==': (6, lambda a, b: int(a == b)),
+    '!=': (6, lambda a, b: int(a != b)),
+    '&': (5, operator.and_),
+    '^': (4, operator.xor),
+    '|': (3, operator.or_),
+    '&&': (2, lambda a, b: int(bool(a and b))),
+    '||': (1, lambda a, b: int(bool(a or b))),
+}
+
+
+class Macro:
+    """
+    A preprocessor macro definition
+    """
+    name: str
+    params: Optional[str]  # None for object-like macros
+    body: str
+
+    def __init__(self, name: str, params: Optional[str], body: str):
+        super().__init__()
+        self.name = name
+        self.params = params
+        self.body = body
+
+
+def tokenize_expression(text: str) -> List[str]:
+    """
+    Split a preprocessor expression into tokens
+    """
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = expression_token.match(text, pos)
+        if match is None or match.end() == pos:
+            raise ValueError(f"can't parse preprocessor expression {text!r}")
+        tokens.append(match[1] or match[2] or match[3])
+        pos = match.end()
+    return tokens
+
+
+def expand_expression(tokens: List[str], macros: Dict[str, Macro], hidden: frozenset = frozenset()) -> List[str]:
+    """
+    Replace "defined" operators and macros in a tokenized #if
+    expression, following the usual C rules (identifiers left over
+    afterwards are 0)
+    """
+    out = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == 'defined':
+            if tokens[i + 1 : i + 2] == ['(']:
+                if tokens[i + 3 : i + 4] != [')']:
+                    raise ValueError('malformed "defined" operator')
+                name = tokens[i + 2]
+                i += 4
+            else:
+                name = tokens[i + 1]
+                i += 2
+            out.append('1' if name in macros else '0')
+            continue
+
+        if identifier.fullmatch(token):
+            macro = macros.get(token)
+            if macro is not None and token not in hidden:
+                if macro.params is not None:
+                    raise ValueError(f'function-like macro "{token}" used in #if')
+                out.extend(expand_expression(tokenize_expression(macro.body), macros, hidden | {token}))
+            else:
+                out.append('1' if token == 'true' else '0')
+        else:
+            out.append(token)
+        i += 1
+
+    return out
+
+
+class ExpressionParser:
+    """
+    Evaluates an expanded #if expression
+    """
+    tokens: List[str]
+    pos: int
+
+    def __init__(self, tokens: List[str]):
+        super().__init__()
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self) -> str:
+        token = self.peek()
+        if token is None:
+            raise ValueError('unexpected end of #if expression')
+        self.pos += 1
+        return token
+
+    def evaluate(self) -> int:
+        value = self.ternary()
+        if self.pos != len(self.tokens):
+            raise ValueError(f'unexpected "{self.tokens[self.pos]}" in #if expression')
+        return value
+
+    def ternary(self) -> int:
+        condition = self.binary(1)
+        if self.peek() != '?':
+            return condition
+        self.pos += 1
+        if_true = self.ternary()
+        if self.next() != ':':
+            raise ValueError('expected ":" in #if expression')
+        if_false = self.ternary()
+        return if_true if condition else if_false
+
+    def binary(self, min_precedence: int) -> int:
+        lhs = self.unary()
+        while (op := self.peek()) in BINARY_OPERATORS and BINARY_OPERATORS[op][0] >= min_precedence:
+            precedence, func = BINARY_OPERATORS[op]
+            self.pos += 1
+            lhs = func(lhs, self.binary(precedence + 1))
+        return lhs
+
+    def unary(self) -> int:
+        token = self.next()
+        if token == '(':
+            value = self.ternary()
+            if self.next() != ')':
+                raise ValueError('expected ")" in #if expression')
+            return value
+        elif token == '!':
+            return int(not self.unary())
+        elif token == '~':
+            return ~self.unary()
+        elif token == '-':
+            return -self.unary()
+        elif token == '+':
+            return self.unary()
+        elif token[0].isdigit():
+            if token[:2].lower() == '0x':
+                return int(token, 16)
+            elif len(token) > 1 and token[0] == '0':
+                return int(token, 8)
+            else:
+                return int(token)
+        raise ValueError(f'unexpected "{token}" in #if expression')
+
+
+def evaluate_condition(text: str, macros: Dict[str, Macro]) -> bool:
+    """
+    Evaluate the expression from an #if or #elif line
+    """
+    return bool(ExpressionParser(expand_expression(tokenize_expression(text), macros)).evaluate())
+
+
+def split_logical_lines(text: str) -> List[str]:
+    """
+    Strip comments from a source file (but not comment-like text in
+    string literals), and join lines ending with backslashes. Returns
+    one entry per physical line (lines that were joined onto previous
+    ones become empty).
+    """
+    def replace(match: re.Match) -> str:
+        s = match[0]
+        if s.startswith('/*'):
+            return ' ' + '\n' * s.count('\n')
+        elif s.startswith('//'):
+            return ' '
+        else:
+            return s
+
+    lines = comments_and_literals.sub(replace, text).split('\n')
+
+    i = 0
+    while i < len(lines):
+        j = i
+        while lines[i].endswith('\\') and j + 1 < len(lines):
+            j += 1
+            lines[i] = lines[i][:-1] + lines[j]
+            lines[j] = ''
+        i = j + 1
+
+    return lines
+
+
+class PreprocessResult:
+    """
+    What a TU looks like after preprocessing for one particular set of
+    defines
+    """
+    # Hash of all active lines in the TU and all headers it includes.
+    # If this matches between two sets of defines, so will the compiled
+    # code.
+    signature: str
+    # Whether the TU itself has anything other than preprocessor
+    # directives left over
+    has_content: bool
+    # Hard-coded game addresses in the TU
+    addresses: Set[int]
+    # Identifiers used in the TU
+    identifiers: Set[str]
+
+    def __init__(self, signature: str, has_content: bool, addresses: Set[int], identifiers: Set[str]):
+        super().__init__()
+        self.signature = signature
+        self.has_content = has_content
+        self.addresses = addresses
+        self.identifiers = identifiers
+
+
+class SourcePreprocessor:
+    """
+    A minimal C preprocessor, which only evaluates conditionals (#if,
+    #ifdef, etc.), #define / #undef, and #include. It doesn't produce
+    any output, just enough information to tell which builds of a TU
+    will be identical.
+    """
+    include_dirs: List[Path]
+    _lines_cache: Dict[Path, List[str]]
+
+    def __init__(self, include_dirs: List[Path]):
+        super().__init__()
+        self.include_dirs = include_dirs
+        self._lines_cache = {}
+
+    def read_lines(self, path: Path) -> List[str]:
+        lines = self._lines_cache.get(path)
+        if lines is None:
+            lines = split_logical_lines(path.read_text(encoding='utf-8', errors='replace'))
+            self._lines_cache[path] = lines
+        return lines
+
+    def files_read(self) -> List[Path]:
+        """
+        List all files that have been read so far
+        """
+        return list(self._lines_cache)
+
+    def find_include(self, current_file: Path, name: str, is_local: bool) -> Optional[Path]:
+        """
+        Find the file an #include refers to, or return None if it
+        can't be found
+        """
+        search_dirs = self.include_dirs
+        if is_local:
+            search_dirs = [current_file.parent, *search_dirs]
+        for d in search_dirs:
+            path = d / name
+            if path.is_file():
+                return path
+        return None
+
+    def run(self, source_file: Path, defines: Dict[str, str]) -> PreprocessResult:
+        """
+        Preprocess a source file with a particular set of command-line
+        defines
+        """
+        macros = {name: Macro(name, None, value) for name, value in defines.items()}
+        hasher = hashlib.sha256()
+        used_identifiers = set()
+
+        has_content = False
+        addresses = set()
+        identifiers = set()
+
+        def process(path: Path, depth: int) -> None:
+            nonlocal has_content
+
+            if depth > MAX_INCLUDE_DEPTH:
+                raise ValueError(f'{source_file.name}: #include nested too deeply (at {path.name})')
+
+            hasher.update(f'\0{path}\0'.encode('utf-8'))
+            is_main = (depth == 0)
+
+            # Stack of (parent active, some branch already taken, this branch active)
+            stack: List[Tuple[bool, bool, bool]] = []
+            active = True
+
+            for line_num, line in enumerate(self.read_lines(path)):
+                directive = directive_line.fullmatch(line)
+                where = f'{path.name}, line {line_num + 1}'
+
+                if directive is None:
+                    if not active or not line.strip():
+                        continue
+                    hasher.update(line.encode('utf-8') + b'\n')
+                    line_identifiers = set(identifier.findall(line))
+                    used_identifiers.update(line_identifiers)
+                    if is_main:
+                        has_content = True
+                        identifiers.update(line_identifiers)
+                        for match in address_literal.finditer(line):
+                            address = int(match[1], 16)
+                            if address >= MIN_GAME_ADDRESS:
+                                addresses.add(address)
+                    continue
+
+                name, arg = directive[1], directive[2]
+                try:
+                    if name in ('if', 'ifdef', 'ifndef'):
+                        if not active:
+                            taken = True  # so that no branch is ever taken
+                            cond = False
+                        elif name == 'if':
+                            cond = evaluate_condition(arg, macros)
+                            taken = cond
+                        else:
+                            cond = (arg.split()[0] in macros) == (name == 'ifdef')
+                            taken = cond
+                        stack.append((active, taken, cond))
+                        active = active and cond
+
+                    elif name == 'elif':
+                        if not stack:
+                            raise ValueError('#elif without #if')
+                        parent_active, taken, _ = stack.pop()
+                        cond = (not taken) and parent_active and evaluate_condition(arg, macros)
+                        stack.append((parent_active, taken or cond, cond))
+                        active = parent_active and cond
+
+                    elif name == 'else':
+                        if not stack:
+                            raise ValueError('#else without #if')
+                        parent_active, taken, _ = stack.pop()
+                        stack.append((parent_active, True, not taken))
+                        active = parent_active and not taken
+
+                    elif name == 'endif':
+                        if not stack:
+                            raise ValueError('#endif without #if')
+                        active = stack.pop()[0]
+
+                    elif not active:
+                        continue
+
+                    elif name == 'define':
+                        match = define_body.fullmatch(arg)
+                        if match is None:
+                            raise ValueError(f'malformed #define: {arg!r}')
+                        macros[match[1]] = Macro(match[1], match[2], match[3])
+
+                    elif name == 'undef':
+                        macros.pop(arg.split()[0], None)
+
+                    elif name == 'include':
+                        match = include_target.match(arg)
+                        if match is None:
+                            raise ValueError(f'unsupported #include: {arg!r}')
+                        hasher.update(line.encode('utf-8') + b'\n')
+                        include_path = self.find_include(path, match[1] or match[2], match[1] is not None)
+                        if include_path is not None:
+                            process(include_path, depth + 1)
+
+                    else:
+                        # #pragma, #error, etc.
+                        hasher.update(line.encode('utf-8') + b'\n')
+
+                except (ValueError, IndexError) as e:
+                    raise ValueError(f'{where}: {e}') from None
+
+            if stack:
+                raise ValueError(f'{path.name}: unterminated #if')
+
+        process(source_file, 0)
+
+        # Macros only matter where they're actually expanded, so instead
+        # of hashing #define lines, hash the (final) definitions of all
+        # macros that the active code uses, directly or indirectly
+        used_macros = set()
+        pending = list(used_identifiers)
+        while pending:
+            name = pending.pop()
+            if name in used_macros or name not in macros:
+                continue
+            used_macros.add(name)
+            pending.extend(identifier.findall(macros[name].body))
+        for name in sorted(used_macros):
+            macro = macros[name]
+            hasher.update(f'\0{name}{macro.params or ""}={macro.body}'.encode('utf-8'))
+
+        return PreprocessResult(hasher.hexdigest(), has_content, addresses, identifiers)
+
+
+def read_externals(path: Path) -> Dict[str, int]:
+    """
+    Read a Kamek externals file into a {symbol: address} dict
+    """
+    externals = {}
+    for line in path.read_text(encoding='utf-8').splitlines():
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        symbol, sep, value = line.partition('=')
+        if not sep:
+            raise ValueError(f'{path.name}: malformed line {line!r}')
+        externals[symbol.strip()] = int(value.strip(), 16)
+    return externals
+
+
+def parse_define_flags(flags: Iterable[str]) -> Dict[str, str]:
+    """
+    Collect the macros defined by a list of compiler flags ("-DNAME" or
+    "-DNAME=VALUE")
+    """
+    defines = {}
+    for flag in flags:
+        if flag.startswith('-D') and len(flag) > 2:
+            name, sep, value = flag[2:].partition('=')
+            defines[name] = value if sep else '1'
+    return defines
+
+
+class BuildGroupInferrer:
+    """
+    Works out which game versions can share a single static build of a
+    TU.
+
+    Two versions can share a build if the TU preprocesses identically
+    for both of them. Versions for which the TU preprocesses to nothing
+    at all are left out entirely. Finally, the hard-coded addresses and
+    externals the TU references are checked against the address map;
+    versions they can't be ported to are left out too, since Kamek
+    wouldn't be able to link them.
+    """
+    preprocessor: SourcePreprocessor
+    game_versions: List[str]
+    version_define: str
+    base_defines: Dict[str, str]
+    # Additional defines for specific game versions
+    version_defines: Dict[str, Dict[str, str]]
+    amap: Optional[address_map.AddressMap]
+    externals: Dict[str, int]
+    warnings: List[str]
+
+    def __init__(self,
+            include_dirs: List[Path],
+            game_versions: List[str],
+            version_define: str,
+            base_defines: Dict[str, str],
+            amap: Optional[address_map.AddressMap] = None,
+            externals: Optional[Dict[str, int]] = None,
+            version_defines: Optional[Dict[str, Dict[str, str]]] = None):
+        super().__init__()
+        self.preprocessor = SourcePreprocessor(include_dirs)
+        self.game_versions = game_versions
+        self.version_define = version_define
+        self.base_defines = base_defines
+        self.version_defines = version_defines or {}
+        self.amap = amap
+        self.externals = externals or {}
+        self.warnings = []
+
+    def analyze(self, source_file: Path) -> Dict[str, PreprocessResult]:
+        """
+        Preprocess a TU once for every game version
+        """
+        results = {}
+        for version in self.game_versions:
+            defines = dict(self.base_defines)
+            defines.update(self.version_defines.get(version, {}))
+            defines[self.version_define.format(version=version)] = '1'
+            results[version] = self.preprocessor.run(source_file, defines)
+        return results
+
+    def unportable_versions(self, result: PreprocessResult, versions: Iterable[str]) -> Set[str]:
+        """
+        Find the versions that some address referenced by a TU can't be
+        ported to
+        """
+        if self.amap is None:
+            return set()
+
+        addresses = set(result.addresses)
+        for symbol in result.identifiers & self.externals.keys():
+            addresses.add(self.externals[symbol])
+        addresses = sorted(addresses)
+
+        bad = set()
+        for version in versions:
+            if version not in self.amap.versions:
+                continue
+            if None in self.amap.translate_many(addresses, version):
+                bad.add(version)
+        return bad
+
+    def infer(self, source_file: Path) -> Dict[str, Set[str]]:
+        """
+        Work out the minimal set of build groups for a TU, in the same
+        {leader: {members}} format as "builds" in .json files. The
+        leader of each group is its first version in address-map order.
+        """
+        results = self.analyze(source_file)
+
+        # {signature: [versions]}, in order
+        by_signature = {}
+        for version in self.game_versions:
+            if results[version].has_content:
+                by_signature.setdefault(results[version].signature, []).append(version)
+
+        groups = {}
+        for versions in by_signature.values():
+            bad = self.unportable_versions(results[versions[0]], versions)
+            if bad:
+                self.warnings.append(
+                    f'{source_file.name}: not building for {", ".join(v for v in versions if v in bad)},'
+                    f' since it references addresses that can\'t be ported there')
+            versions = [v for v in versions if v not in bad]
+            if versions:
+                groups[versions[0]] = set(versions)
+
+        return groups
+
+    def check(self, source_file: Path, builds: Dict[str, Set[str]]) -> List[str]:
+        """
+        Compare hand-written build groups against the inferred ones,
+        and return suggestions for any that could be merged
+        """
+        inferred = self.infer(source_file)
+        if len(inferred) >= len(builds):
+            return []
+
+        proposal = json.dumps({
+            leader: [v for v in self.game_versions if v in group]
+            for leader, group in inferred.items()})
+        return [
+            f'{source_file.name}: {len(builds)} build groups could be reduced to {len(inferred)}'
+            f' ("builds": {proposal}, or just "builds": "auto")'
+        ]
@@ -23,20 +23,48 @@
 # SOFTWARE.
 
 import argparse
+import hashlib
 import json
+import os
 from pathlib import Path
-import re
 import sys
-from typing import Any, Dict, List, Optional, Set
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+import address_map
+import build_groups
+import kamek_link
+import macro_usage
 
 
 MWCCEPPC_NAME = 'mwcceppc.exe'
 MWASMEPPC_NAME = 'mwasmeppc.exe'
 CW_WRAPPER_SCRIPT_NAME = 'cw_wrapper.py'
+CW_SERVER_SCRIPT_NAME = 'cw_server.py'
+CW_CACHE_SCRIPT_NAME = 'cw_cache.py'
+ARTIFACT_CACHE_SCRIPT_NAME = 'artifact_cache.py'
+KAMEK_LINK_SCRIPT_NAME = 'kamek_link.py'
 
 DEFAULT_BUILD_DIR_NAME = '_build'
 DEFAULT_OUTPUT_DIR_NAME = 'bin'
 
+SOURCE_FILE_SUFFIXES = ['.cpp', '.s']
+
+TU_INDEX_FILE_NAME = 'tu_index.json'
+TU_INDEX_VERSION = 1
+
+UNITY_DIR_NAME = 'unity'
+
+MACRO_USAGE_FILE_NAME = 'macro_usage.json'
+
+LINK_MODES = ['per-version', 'single']
+LINK_MANIFEST_FILE_NAME = 'kamek_link.json'
+LINK_STATE_FILE_NAME = 'kamek_link_state.json'
+
+PCH_DIR_NAME = 'pch'
+# CodeWarrior treats .pch++ files as C++ headers to be precompiled
+PCH_SOURCE_FILE_NAME = 'prefix.pch++'
+
 DYNAMIC_GAME_VERSION_NAME = 'DYNAMIC'
 GAME_VERSION_PREPROC_FLAG_DYNAMIC = 'IS_GAME_VERSION_DYNAMIC'
 GAME_VERSION_PREPROC_FLAG = 'IS_GAME_VERSION_{version}_COMPATIBLE'
@@ -50,6 +78,70 @@ def ninja_escape(thing: Any) -> str:
     return str(thing).replace('$', '$$').replace(':', '$:').replace(' ', '$ ')
 
 
+class Variant:
+    """
+    One of several configurations to build the project in, each with
+    its own additional compiler flags and output directory
+    """
+    # None for the implicit variant used when there's no variants file
+    name: Optional[str]
+    output_dir: Path
+    cflags: List[str]
+
+    def __init__(self, name: Optional[str], output_dir: Path, cflags: List[str]):
+        self.name = name
+        self.output_dir = output_dir
+        self.cflags = cflags
+
+    @classmethod
+    def load_all(cls, path: Path) -> List['Variant']:
+        """
+        Load a variants file, which maps variant names to objects like
+        {"output_dir": "...", "cflags": ["-DFOO", ...]}. Relative output
+        directories are relative to the file.
+        """
+        with path.open(encoding='utf-8') as f:
+            j = json.load(f)
+
+        if not isinstance(j, dict) or not j:
+            raise ValueError(f'{path.name}: expected an object with at least one variant')
+
+        variants = []
+        for name, info in j.items():
+            if not name or any(c in name for c in '/\\$: '):
+                raise ValueError(f'{path.name}: illegal variant name "{name}"')
+            if 'output_dir' not in info:
+                raise ValueError(f'{path.name}: variant "{name}" has no "output_dir"')
+            cflags = info.get('cflags', [])
+            if not isinstance(cflags, list) or not all(isinstance(f, str) for f in cflags):
+                raise ValueError(f'{path.name}: "cflags" for variant "{name}" must be a list of strings')
+
+            variants.append(cls(name, (path.parent / info['output_dir']).resolve(), cflags))
+
+        return variants
+
+
+def load_version_cflags(path: Path) -> Dict[str, List[str]]:
+    """
+    Load a .json file mapping game versions to lists of additional
+    compiler flags
+    """
+    with path.open(encoding='utf-8') as f:
+        j = json.load(f)
+
+    if not isinstance(j, dict):
+        raise ValueError(f'{path.name}: expected an object mapping game versions to lists of flags')
+
+    version_cflags = {}
+    for version, flags in j.items():
+        if not isinstance(flags, list) or not all(isinstance(f, str) for f in flags):
+            raise ValueError(f'{path.name}: flags for "{version}" must be a list of strings')
+        # (Versions that aren't in the address map are simply never
+        # used)
+        version_cflags[version] = flags
+    return version_cflags
+
+
 class Config:
     """
     Contains configuration options provided by the user
@@ -61,6 +153,22 @@ class Config:
     output_dir: Path
     select_versions: Optional[List[str]]
     extra_cflags: List[str]
+    cw_server: Optional[Path]
+    object_cache_dir: Optional[Path]
+    object_cache_max_size: Optional[str]
+    artifact_cache_dir: Optional[Path]
+    artifact_cache_max_size: Optional[str]
+    check_build_groups: bool
+    unity: Optional[int]
+    pch_headers: List[str]
+    link_mode: str
+    scoped_define_prefixes: List[str]
+    variants: List[Variant]
+    # {game version: [additional flags]}
+    version_cflags: Dict[str, List[str]]
+    # Files and directories that the generated Ninja file depends on
+    # (filled in by make_ninja_file())
+    input_files: Set[Path]
 
     @staticmethod
     def create_arg_parser(*args, **kwargs) -> None:
@@ -77,6 +185,8 @@ class Config:
             help='Kamek folder, containing the Kamek binary ("Kamek.exe" or "Kamek") and the k_stdlib directory')
         deps_group.add_argument('--cw', type=Path, metavar='CODEWARRIOR', required=True,
             help=f'CodeWarrior folder, containing {MWCCEPPC_NAME}, {MWASMEPPC_NAME}, and license.dat, at minimum')
+        deps_group.add_argument('--cw-server', type=Path, metavar='SOCKET',
+            help=f'run CodeWarrior through a {CW_SERVER_SCRIPT_NAME} instance listening on this Unix socket, when it\'s running')
 
         proj_group = parser.add_argument_group('Project location')
         proj_group.add_argument('--project-dir', type=Path, metavar='PROJECT',
@@ -91,24 +201,99 @@ class Config:
         out_group.add_argument('--output-dir', type=Path, metavar='OUT',
             help=f'output directory to put Kamekfiles in'
                  f' (default: <project dir>/{DEFAULT_OUTPUT_DIR_NAME})')
+        out_group.add_argument('--version-cflags-file', type=Path, metavar='FILE',
+            help='.json file mapping game versions to lists of additional compiler flags for them.'
+                 ' Static builds get the flags that all versions in their build group have in common,'
+                 ' and "builds": "auto" takes them into account.')
+        out_group.add_argument('--variants-file', type=Path, metavar='FILE',
+            help='build several variants of the project with different additional compiler flags, each into its own output'
+                 ' directory, as described by this .json file (see readme_docs.md). Object files that come out the same'
+                 ' in multiple variants are only compiled once.')
+
+        perf_group = parser.add_argument_group('Build performance options')
+        perf_group.add_argument('--object-cache', type=Path, metavar='DIR',
+            help=f'cache compiled objects in this directory, and reuse them when the same source file, headers and flags'
+                 f' are compiled again (see {CW_CACHE_SCRIPT_NAME})')
+        perf_group.add_argument('--object-cache-max-size', metavar='SIZE',
+            help='maximum object cache size, e.g. "500M" or "2G" (default: 1G)')
+        perf_group.add_argument('--artifact-cache', type=Path, metavar='DIR',
+            help=f'cache linked Kamekfiles in this directory (which can be shared between machines), and reuse them when'
+                 f' the same objects are linked again (see {ARTIFACT_CACHE_SCRIPT_NAME})')
+        perf_group.add_argument('--artifact-cache-max-size', metavar='SIZE',
+            help='maximum artifact cache size, e.g. "500M" or "2G" (default: 1G)')
+        perf_group.add_argument('--unity', type=int, metavar='N',
+            help='combine C++ files that are built for the same game versions into at most N "unity" files each,'
+                 ' which are much faster to compile than the files individually')
+        perf_group.add_argument('--pch-header', metavar='HEADER', action='append',
+            help='precompile this header (named as it would be #included) once per game version, and prefix it to every C++ file'
+                 ' (can be specified multiple times)')
+        perf_group.add_argument('--link-mode', choices=LINK_MODES, default=LINK_MODES[0],
+            help='"per-version" runs Kamek once per game version; "single" links all versions with one build edge,'
+                 f' which uses {KAMEK_LINK_SCRIPT_NAME} to only relink versions whose inputs changed, and links'
+                 ' versions with identical inputs together (default: per-version)')
+        perf_group.add_argument('--scoped-define-prefix', metavar='PREFIX', action='append',
+            help='only pass additional -D arguments for macros starting with PREFIX to the files that reference them'
+                 ' (directly or through included headers), so that changing one doesn\'t rebuild everything'
+                 ' (can be specified multiple times)')
+        perf_group.add_argument('--check-build-groups', action='store_true',
+            help='report .json files whose "builds" groups could be merged to compile fewer objects')
 
         return parser
 
     @classmethod
-    def from_args(cls, args: argparse.Namespace, extra_args: List[str]) -> None:
+    def create(cls,
+            kamek_dir: Path,
+            cw_dir: Path,
+            project_dir: Optional[Path] = None,
+            select_versions: Optional[List[str]] = None,
+            build_dir: Optional[Path] = None,
+            output_dir: Optional[Path] = None,
+            extra_cflags: Optional[List[str]] = None,
+            cw_server: Optional[Path] = None,
+            object_cache_dir: Optional[Path] = None,
+            object_cache_max_size: Optional[str] = None,
+            artifact_cache_dir: Optional[Path] = None,
+            artifact_cache_max_size: Optional[str] = None,
+            check_build_groups: bool = False,
+            unity: Optional[int] = None,
+            pch_headers: Optional[List[str]] = None,
+            link_mode: str = LINK_MODES[0],
+            scoped_define_prefixes: Optional[List[str]] = None,
+            variants: Optional[List[Variant]] = None,
+            version_cflags: Optional[Dict[str, List[str]]] = None) -> 'Config':
         """
-        Construct a Config instance from the CLI arguments
+        Construct a Config instance directly. The arguments correspond
+        to the CLI options, for use from other Python scripts.
         """
-        project_dir = args.project_dir or Path.cwd()
+        project_dir = project_dir or Path.cwd()
 
         self = cls()
-        self.kamek_dir = args.kamek.resolve()
-        self.cw_dir = args.cw.resolve()
+        self.kamek_dir = kamek_dir.resolve()
+        self.cw_dir = cw_dir.resolve()
         self.project_dir = project_dir.resolve()
-        self.select_versions = args.select_version or None
-        self.build_dir = (args.build_dir or project_dir / DEFAULT_BUILD_DIR_NAME).resolve()
-        self.output_dir = (args.output_dir or project_dir / DEFAULT_OUTPUT_DIR_NAME).resolve()
-        self.extra_cflags = extra_args
+        self.select_versions = select_versions or None
+        self.build_dir = (build_dir or project_dir / DEFAULT_BUILD_DIR_NAME).resolve()
+        self.output_dir = (output_dir or project_dir / DEFAULT_OUTPUT_DIR_NAME).resolve()
+        self.extra_cflags = extra_cflags or []
+        self.cw_server = cw_server.resolve() if cw_server else None
+        self.object_cache_dir = object_cache_dir.resolve() if object_cache_dir else None
+        self.object_cache_max_size = object_cache_max_size
+        self.artifact_cache_dir = artifact_cache_dir.resolve() if artifact_cache_dir else None
+        self.artifact_cache_max_size = artifact_cache_max_size
+        self.check_build_groups = check_build_groups
+        self.unity = unity
+        self.pch_headers = pch_headers or []
+        self.link_mode = link_mode
+        self.scoped_define_prefixes = scoped_define_prefixes or []
+        self.variants = variants or [Variant(None, self.output_dir, [])]
+        self.version_cflags = version_cflags or {}
+        self.input_files = set()
+
+        if self.link_mode not in LINK_MODES:
+            raise ValueError(f'Unknown link mode: "{self.link_mode}" (expected one of {LINK_MODES})')
+
+        if self.unity is not None and self.unity < 1:
+            raise ValueError(f'--unity must be at least 1 (got {self.unity})')
 
         if self.select_versions is not None:
             # Quick sanity check
@@ -118,6 +303,30 @@ class Config:
 
         return self
 
+    @classmethod
+    def from_args(cls, args: argparse.Namespace, extra_args: List[str]) -> 'Config':
+        """
+        Construct a Config instance from the CLI arguments
+        """
+        return cls.create(args.kamek, args.cw,
+            project_dir=args.project_dir,
+            select_versions=args.select_version,
+            build_dir=args.build_dir,
+            output_dir=args.output_dir,
+            extra_cflags=extra_args,
+            cw_server=args.cw_server,
+            object_cache_dir=args.object_cache,
+            object_cache_max_size=args.object_cache_max_size,
+            artifact_cache_dir=args.artifact_cache,
+            artifact_cache_max_size=args.artifact_cache_max_size,
+            check_build_groups=args.check_build_groups,
+            unity=args.unity,
+            pch_headers=args.pch_header,
+            link_mode=args.link_mode,
+            scoped_define_prefixes=args.scoped_define_prefix,
+            variants=Variant.load_all(args.variants_file) if args.variants_file is not None else None,
+            version_cflags=load_version_cflags(args.version_cflags_file) if args.version_cflags_file is not None else None)
+
     @property
     def kamek_exe(self) -> Path:
         if sys.platform == 'win32':
@@ -168,39 +377,237 @@ class Config:
     def ninja_file(self) -> Path:
         return self.project_dir / 'build.ninja'
 
-    _version_names_list = None
+    _address_map = None
+    def get_address_map(self) -> Optional[address_map.AddressMap]:
+        if self._address_map is None and self.have_address_map_txt():
+            self._address_map = address_map.AddressMap.load(self.address_map_txt)
+        return self._address_map
+
     def get_version_names_list(self) -> List[str]:
-        if self._version_names_list is None:
-            if self.have_address_map_txt():
-                self._version_names_list = \
-                    get_version_names_list_from_address_map(
-                        self.address_map_txt)
-            else:
-                self._version_names_list = []
-        return list(self._version_names_list)
+        amap = self.get_address_map()
+        if amap is None:
+            return []
+        return amap.version_names
+
+    def make_build_group_inferrer(self) -> build_groups.BuildGroupInferrer:
+        externals = None
+        if self.have_externals_txt():
+            externals = build_groups.read_externals(self.externals_txt)
+
+        return build_groups.BuildGroupInferrer(
+            [self.include_dir, self.k_stdlib_dir],
+            self.get_version_names_list(),
+            GAME_VERSION_PREPROC_FLAG,
+            build_groups.parse_define_flags(self.extra_cflags),
+            self.get_address_map(),
+            externals,
+            {v: build_groups.parse_define_flags(f) for v, f in self.version_cflags.items()})
+
+    def version_cflags_for(self, versions: Optional[Iterable[str]]) -> List[str]:
+        """
+        Get the additional flags that all of the specified game versions
+        have in common (none, for dynamic builds)
+        """
+        if versions is None:
+            return []
+        common = None
+        for version in versions:
+            flags = self.version_cflags.get(version, [])
+            common = list(flags) if common is None else [f for f in common if f in flags]
+        return common or []
 
 
-def get_version_names_list_from_address_map(path: Path) -> List[str]:
+def write_file_if_changed(path: Path, data: str) -> bool:
+    """
+    Write a text file, unless it already exists with exactly this
+    content (so that its timestamp is left alone). Returns True if the
+    file was written.
     """
-    Read an address map file and extract the names of all game versions
-    it defines, in order.
+    try:
+        if path.read_text(encoding='utf-8') == data:
+            return False
+    except (OSError, ValueError):
+        pass
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=path.name, dir=path.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+    return True
+
+
+class SourceTreeIndex:
     """
-    address_map_version_header_line = re.compile(
-        r'^'          # start of string
-        r'\s*'        # optional whitespace
-        r'\[(\w+)\]'  # '[', one or more word chars (captured), ']'
-        r'.*'         # additional stuff (e.g. comments); we don't care
-                      # much anymore at this point
-        r'$'          # end of string
-    )
+    Index of the source files and .json files in the source directory,
+    which can be saved to the build directory and reused next time.
 
-    versions = []
-    for line in path.read_text(encoding='utf-8').splitlines():
-        match = address_map_version_header_line.fullmatch(line)
-        if match:
-            versions.append(match[1])
+    Directory listings are only re-read for directories whose mtime has
+    changed (which happens when files are added, removed or renamed),
+    and .json files are only re-parsed if their contents have changed.
+    """
+    src_dir: Path
+    index_file: Optional[Path]
+    # {"relative/dir": {"mtime": ..., "dirs": [...], "sources": [...], "jsons": [...]}, ...}
+    dirs: Dict[str, dict]
+    # {"relative/file.json": {"mtime": ..., "size": ..., "hash": ..., "data": {...}}, ...}
+    jsons: Dict[str, dict]
+    dirty: bool
+
+    def __init__(self, src_dir: Path, index_file: Optional[Path] = None):
+        super().__init__()
+        self.src_dir = src_dir
+        self.index_file = index_file
+        self.dirs = {}
+        self.jsons = {}
+        self.dirty = False
+
+        if index_file is not None:
+            try:
+                j = json.loads(index_file.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                j = {}
+            if j.get('version') == TU_INDEX_VERSION and j.get('src_dir') == str(src_dir):
+                self.dirs = j['dirs']
+                self.jsons = j['jsons']
+
+    def save(self) -> None:
+        """
+        Save the index to the index file, if anything changed
+        """
+        if self.index_file is None or not self.dirty:
+            return
+
+        write_file_if_changed(self.index_file, json.dumps({
+            'version': TU_INDEX_VERSION,
+            'src_dir': str(self.src_dir),
+            'dirs': self.dirs,
+            'jsons': self.jsons,
+        }))
+        self.dirty = False
+
+    def scan(self) -> None:
+        """
+        Bring the index up to date with the source directory
+        """
+        seen_dirs = set()
+        seen_jsons = set()
+
+        def scan_dir(rel_dir: str) -> None:
+            seen_dirs.add(rel_dir)
+            abs_dir = self.src_dir / rel_dir
+            mtime = os.stat(abs_dir).st_mtime_ns
+
+            entry = self.dirs.get(rel_dir)
+            if entry is None or entry['mtime'] != mtime:
+                entry = {'mtime': mtime, 'dirs': [], 'sources': [], 'jsons': []}
+                for e in sorted(os.scandir(abs_dir), key=lambda e: e.name):
+                    if e.is_dir():
+                        entry['dirs'].append(e.name)
+                    elif e.is_file():
+                        suffix = os.path.splitext(e.name)[1].lower()
+                        if suffix in SOURCE_FILE_SUFFIXES:
+                            entry['sources'].append(e.name)
+                        elif e.name.endswith('.json'):
+                            entry['jsons'].append(e.name)
+                self.dirs[rel_dir] = entry
+                self.dirty = True
+
+            for name in entry['jsons']:
+                rel_json = f'{rel_dir}/{name}' if rel_dir else name
+                seen_jsons.add(rel_json)
+                self.refresh_json(rel_json)
+
+            for name in entry['dirs']:
+                scan_dir(f'{rel_dir}/{name}' if rel_dir else name)
+
+        scan_dir('')
+
+        # Forget about anything that was deleted
+        for rel_dir in set(self.dirs) - seen_dirs:
+            del self.dirs[rel_dir]
+            self.dirty = True
+        for rel_json in set(self.jsons) - seen_jsons:
+            del self.jsons[rel_json]
+            self.dirty = True
+
+    def refresh_json(self, rel_json: str) -> None:
+        """
+        Re-read a .json file if it might have changed
+        """
+        path = self.src_dir / rel_json
+        st = path.stat()
+
+        entry = self.jsons.get(rel_json)
+        if entry is not None and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            return
 
-    return versions
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        if entry is None or entry['hash'] != digest:
+            entry = {'hash': digest, 'data': json.loads(data.decode('utf-8'))}
+        entry['mtime'] = st.st_mtime_ns
+        entry['size'] = st.st_size
+
+        self.jsons[rel_json] = entry
+        self.dirty = True
+
+    def iter_source_files(self) -> Iterator[Path]:
+        """
+        Iterate over all source files, sorted by path, with all .cpp
+        files first, then all .s files
+        """
+        for suffix in SOURCE_FILE_SUFFIXES:
+            files = []
+            for rel_dir, entry in self.dirs.items():
+                for name in entry['sources']:
+                    if os.path.splitext(name)[1].lower() == suffix:
+                        files.append(self.src_dir / rel_dir / name)
+            yield from sorted(files)
+
+    def iter_input_paths(self) -> Iterator[Path]:
+        """
+        Iterate over the directories and .json files that the index was
+        built from, which will need to be re-scanned if they change
+        """
+        for rel_dir in self.dirs:
+            yield self.src_dir / rel_dir if rel_dir else self.src_dir
+        for rel_json in self.jsons:
+            yield self.src_dir / rel_json
+
+    def relative_key(self, path: Path) -> Optional[str]:
+        """
+        Convert an absolute path to the relative path string used as a
+        key in the index, or None if it's outside the source directory
+        """
+        try:
+            return path.relative_to(self.src_dir).as_posix()
+        except ValueError:
+            return None
+
+    def has_json(self, path: Path) -> bool:
+        """
+        Check if a .json file exists (using the index, if possible)
+        """
+        key = self.relative_key(path)
+        if key is None or key == '.':
+            return path.is_file()
+        return key in self.jsons
+
+    def load_json(self, path: Path) -> Any:
+        """
+        Load a .json file (using the index, if possible)
+        """
+        key = self.relative_key(path)
+        if key in self.jsons:
+            return self.jsons[key]['data']
+        with path.open(encoding='utf-8') as f:
+            return json.load(f)
 
 
 class TranslationUnit:
@@ -210,24 +617,32 @@ class TranslationUnit:
     source_file: Path
 
     use_static_version_builds: bool
+    # True if the .json file says "builds": "auto", in which case
+    # static_version_builds is filled in later by infer_builds()
+    infer_static_version_builds: bool
     # {"compile_for_this_version": {"for", "these", "build", "versions"}, ...}
     static_version_builds: Dict[str, Set[str]]
+    # False if the .json file says "unity": false
+    allow_unity: bool
 
-    def __init__(self, src_root_dir: Path, source_file: Path, game_versions: List[str]) -> 'TranslationUnit':
+    def __init__(self, src_root_dir: Path, source_file: Path, game_versions: List[str], index: Optional[SourceTreeIndex] = None) -> 'TranslationUnit':
         """
         Create a TranslationUnit from a .cpp file path, including
-        checking for the existence of a corresponding .json file
+        checking for the existence of a corresponding .json file.
+        If an index is provided, it's used instead of the filesystem.
         """
         super().__init__()
         self.source_file = source_file
         self.use_static_version_builds = False
+        self.infer_static_version_builds = False
         self.static_version_builds = {}
+        self.allow_unity = True
 
         inspect_path = source_file
         while True:
             json_path = inspect_path.with_suffix('.json')
-            if json_path.is_file():
-                self.read_config(json_path, game_versions)
+            if index.has_json(json_path) if index is not None else json_path.is_file():
+                self.read_config(json_path, game_versions, index)
                 return
 
             if inspect_path == src_root_dir or inspect_path == inspect_path.parent:
@@ -238,22 +653,36 @@ class TranslationUnit:
     def is_cpp(self) -> bool:
         return self.source_file.suffix.lower() == '.cpp'
 
-    def read_config(self, path: Path, game_versions: List[str]) -> None:
+    def read_config(self, path: Path, game_versions: List[str], index: Optional[SourceTreeIndex] = None) -> None:
         """
         Read additional config data from an optional .json file
         """
-        if not path.is_file():
-            return
-        with path.open(encoding='utf-8') as f:
-            j = json.load(f)
+        if index is not None:
+            if not index.has_json(path):
+                return
+            j = index.load_json(path)
+        else:
+            if not path.is_file():
+                return
+            with path.open(encoding='utf-8') as f:
+                j = json.load(f)
 
         if 'json_version' not in j:
             raise ValueError(f'{path.name}: json_version not found')
         elif j['json_version'] != 1:
             raise ValueError(f'{path.name}: unsupported json_version ({j["json_version"]})')
 
+        self.allow_unity = bool(j.get('unity', True))
+
         builds_list = j.get('builds')
-        if builds_list:
+        if builds_list == 'auto':
+            self.use_static_version_builds = True
+            self.infer_static_version_builds = True
+
+        elif isinstance(builds_list, str):
+            raise ValueError(f'{path.name}: "builds" must be an object or "auto" (got "{builds_list}")')
+
+        elif builds_list:
             self.use_static_version_builds = True
             self.static_version_builds = {k: set(v) for k, v in builds_list.items()}
 
@@ -271,10 +700,39 @@ class TranslationUnit:
                         raise ValueError(f'{path.name}: "{member}" is present in multiple build groups')
                 already_seen |= group
 
+    def infer_builds(self, inferrer: build_groups.BuildGroupInferrer) -> None:
+        """
+        Fill in static_version_builds for "builds": "auto"
+        """
+        self.static_version_builds = inferrer.infer(self.source_file)
+
+    def build_configuration(self) -> tuple:
+        """
+        Return a hashable value that's equal for any two TUs that are
+        built for exactly the same game versions
+        """
+        if not self.use_static_version_builds:
+            return (DYNAMIC_GAME_VERSION_NAME,)
+        return tuple(sorted((leader, tuple(sorted(group))) for leader, group in self.static_version_builds.items()))
+
+    def display_name(self, config: Config) -> Path:
+        """
+        Short version of the source file path, for Ninja's output
+        """
+        return self.source_file.relative_to(config.src_dir)
+
+    def object_file_stem(self, config: Config) -> Path:
+        """
+        The path that .o file paths for this TU are based on
+        """
+        return config.build_dir / self.source_file.relative_to(config.src_dir)
+
     def iter_builds(self, config: Config):
         """
         Iterator over the .o files that need to be built for this TU.
-        Yields (preprocessor flag, .o filepath) pairs.
+        Yields (preprocessor flag, .o filepath, game versions) tuples,
+        where the game versions are the set the .o file will be used
+        for, or None for a dynamic build.
         """
         if self.use_static_version_builds:
             versions_to_build_for = set()
@@ -292,10 +750,12 @@ class TranslationUnit:
                             versions_to_build_for.add(leader)
 
             for version in versions_to_build_for:
-                yield GAME_VERSION_PREPROC_FLAG.format(version=version), self.o_file_for_version(version, config)
+                yield (GAME_VERSION_PREPROC_FLAG.format(version=version),
+                    self.o_file_for_version(version, config),
+                    self.static_version_builds[version])
 
         else:
-            yield GAME_VERSION_PREPROC_FLAG_DYNAMIC, self.o_file_for_version(DYNAMIC_GAME_VERSION_NAME, config)
+            yield GAME_VERSION_PREPROC_FLAG_DYNAMIC, self.o_file_for_version(DYNAMIC_GAME_VERSION_NAME, config), None
 
     def o_file_for_version(self, version: str, config: Config) -> Optional[str]:
         """
@@ -314,7 +774,81 @@ class TranslationUnit:
             # We can use just ".o" instead of ".dynamic.o"
             suffix = '.o'
 
-        return config.build_dir / self.source_file.relative_to(config.src_dir).with_suffix(suffix)
+        return self.object_file_stem(config).with_suffix(suffix)
+
+
+class UnityUnit(TranslationUnit):
+    """
+    A generated .cpp file that #includes several other .cpp files, so
+    they can all be compiled at once (a "unity" or "jumbo" build)
+    """
+    tus: List[TranslationUnit]
+
+    def __init__(self, source_file: Path, tus: List[TranslationUnit]) -> 'UnityUnit':
+        # Not calling TranslationUnit.__init__(), since there's no .json
+        # file to read
+        self.source_file = source_file
+        self.tus = tus
+        self.use_static_version_builds = tus[0].use_static_version_builds
+        self.infer_static_version_builds = False
+        self.static_version_builds = tus[0].static_version_builds
+        self.allow_unity = False
+
+    def is_cpp(self) -> bool:
+        return True
+
+    def display_name(self, config: Config) -> Path:
+        return self.source_file.relative_to(config.build_dir)
+
+    def object_file_stem(self, config: Config) -> Path:
+        return self.source_file
+
+    def make_source(self, config: Config) -> str:
+        """
+        Create the contents of the unity file
+        """
+        lines = ['// Generated by configure.py -- do not edit']
+        for tu in self.tus:
+            lines.append(f'#include "{tu.source_file.relative_to(config.src_dir).as_posix()}"')
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def make_unity_units(config: Config, tus: List[TranslationUnit]) -> List[TranslationUnit]:
+    """
+    Combine C++ TUs with identical build configurations into unity
+    files (config.unity per configuration, at most), and write them to
+    the build directory. Returns the new list of TUs to build.
+    """
+    # {build configuration: [TUs]}, in order
+    by_config = {}
+    others = []
+    for tu in tus:
+        if tu.is_cpp() and tu.allow_unity and not (tu.use_static_version_builds and not tu.static_version_builds):
+            by_config.setdefault(tu.build_configuration(), []).append(tu)
+        else:
+            others.append(tu)
+
+    unity_dir = config.build_dir / UNITY_DIR_NAME
+    units = []
+    for build_config, config_tus in by_config.items():
+        if build_config == (DYNAMIC_GAME_VERSION_NAME,):
+            name = 'dynamic'
+        else:
+            name = 'static_' + hashlib.sha256(repr(build_config).encode('utf-8')).hexdigest()[:8]
+
+        # (ceiling division, and no point in making 1-TU unity files)
+        chunk_size = max(2, -(-len(config_tus) // config.unity))
+        for i in range(0, len(config_tus), chunk_size):
+            chunk = config_tus[i : i + chunk_size]
+            if len(chunk) == 1:
+                units.append(chunk[0])
+                continue
+            unit = UnityUnit(unity_dir / f'{name}_{i // chunk_size}.cpp', chunk)
+            write_file_if_changed(unit.source_file, unit.make_source(config))
+            units.append(unit)
+
+    return units + others
 
 
 def make_ninja_file(config: Config) -> str:
@@ -322,11 +856,79 @@ def make_ninja_file(config: Config) -> str:
     Make the overall Ninja file
     """
 
-    # Find all TUs, and read any configs
+    # Find all TUs, and read any configs. The index saved from the last
+    # run lets us skip re-reading unchanged directories and .json files.
+    index = SourceTreeIndex(config.src_dir, config.build_dir / TU_INDEX_FILE_NAME)
+    index.scan()
     tus = []
-    for glob in ['**/*.cpp', '**/*.s']:
-        for fp in sorted(config.src_dir.glob(glob, case_sensitive=False)):
-            tus.append(TranslationUnit(config.src_dir, fp, config.get_version_names_list()))
+    for fp in index.iter_source_files():
+        tus.append(TranslationUnit(config.src_dir, fp, config.get_version_names_list(), index))
+    index.save()
+
+    # Work out build groups for TUs that ask for it, and check the
+    # hand-written ones if requested
+    inferrer = None
+    for tu in tus:
+        if not tu.infer_static_version_builds and not (config.check_build_groups and tu.use_static_version_builds):
+            continue
+        if inferrer is None:
+            inferrer = config.make_build_group_inferrer()
+
+        if tu.infer_static_version_builds:
+            tu.infer_builds(inferrer)
+        else:
+            inferrer.warnings.extend(inferrer.check(tu.source_file, tu.static_version_builds))
+
+    if inferrer is not None:
+        for warning in inferrer.warnings:
+            print(f'WARNING: {warning}', file=sys.stderr)
+
+    if config.unity is not None:
+        tus = make_unity_units(config, tus)
+
+    # Defines that should only be passed to the files that use them
+    scanner = None
+    if config.scoped_define_prefixes:
+        scanner = macro_usage.MacroUsageScanner(
+            [config.include_dir, config.k_stdlib_dir],
+            config.scoped_define_prefixes,
+            config.build_dir / MACRO_USAGE_FILE_NAME)
+
+    def is_scoped(flag: str) -> bool:
+        return scanner is not None and scanner.is_scoped(flag)
+
+    global_cflags = [f for f in config.extra_cflags if not is_scoped(f)]
+
+    # {variant name: (flags for every C++ file, scoped flags)}
+    variant_cflags = {}
+    for variant in config.variants:
+        variant_cflags[variant.name] = (
+            [f for f in variant.cflags if not is_scoped(f)],
+            [f for f in config.extra_cflags + variant.cflags if is_scoped(f)])
+
+    def cflags_for(source_files: List[Path], variant: Variant, versions: Optional[Set[str]]) -> List[str]:
+        unscoped, scoped = variant_cflags[variant.name]
+        unscoped, scoped = list(unscoped), list(scoped)
+        for f in config.version_cflags_for(versions):
+            if is_scoped(f):
+                if f not in scoped:
+                    scoped.append(f)
+            elif f not in unscoped:
+                unscoped.append(f)
+        if scanner is not None:
+            scoped = scanner.flags_for(source_files, scoped)
+        return unscoped + scoped
+
+    # When building multiple variants (or with per-version flags), object
+    # files are named after the flags they're compiled with, so that
+    # variants where a file comes out the same share a single build edge
+    # for it
+    use_flags_suffixes = (len(config.variants) > 1 or config.variants[0].name is not None or bool(config.version_cflags))
+
+    def flags_suffix(flags: List[str]) -> str:
+        if not use_flags_suffixes or not flags:
+            return ''
+        return '.' + hashlib.sha256('\n'.join(flags).encode('utf-8')).hexdigest()[:8]
 
     use_addrmap = config.have_address_map_txt()
     use_externals = config.have_externals_txt()
@@ -341,8 +943,15 @@ def make_ninja_file(config: Config) -> str:
     lines.append(f'mwcceppc = {ninja_escape(config.mwcceppc_exe)}')
     lines.append(f'mwasmeppc = {ninja_escape(config.mwasmeppc_exe)}')
     cw_wrapper = Path(__file__).parent / CW_WRAPPER_SCRIPT_NAME
-    lines.append(f"cc = {ninja_escape(sys.executable)} {quote}{ninja_escape(cw_wrapper)}{quote} {quote}$mwcceppc{quote}")
-    lines.append(f"as = {ninja_escape(sys.executable)} {quote}{ninja_escape(cw_wrapper)}{quote} {quote}$mwasmeppc{quote}")
+    cw_wrapper_cmd = f"{ninja_escape(sys.executable)} {quote}{ninja_escape(cw_wrapper)}{quote} --build-dir {quote}$builddir{quote}"
+    if config.cw_server is not None:
+        cw_wrapper_cmd += f" --server {quote}{ninja_escape(config.cw_server)}{quote}"
+    if config.object_cache_dir is not None:
+        cw_wrapper_cmd += f" --cache-dir {quote}{ninja_escape(config.object_cache_dir)}{quote}"
+        if config.object_cache_max_size is not None:
+            cw_wrapper_cmd += f" --cache-max-size {ninja_escape(config.object_cache_max_size)}"
+    lines.append(f"cc = {cw_wrapper_cmd} {quote}$mwcceppc{quote}")
+    lines.append(f"as = {cw_wrapper_cmd} {quote}$mwasmeppc{quote}")
     lines.append(f'kamek = {ninja_escape(config.kamek_exe)}')
     lines.append(f'kstdlib = {ninja_escape(config.k_stdlib_dir)}')
     if use_addrmap:
@@ -350,6 +959,9 @@ def make_ninja_file(config: Config) -> str:
     if use_externals:
         lines.append(f'externals = {ninja_escape(config.externals_txt)}')
     lines.append(f'includedir = {ninja_escape(config.include_dir)}')
+    if config.pch_headers:
+        lines.append(f'pchdir = {ninja_escape(config.build_dir / PCH_DIR_NAME)}')
+    lines.append(f'srcdir = {ninja_escape(config.src_dir)}')
     lines.append(f'')
 
     dumb_constant = ' $\n  '  # backslashes aren't allowed in f-strings
@@ -370,7 +982,7 @@ cflags = $
   -rostr $
   -sdata 0 $
   -sdata2 0 $
-  -RTTI off{(dumb_constant + ' '.join(config.extra_cflags)) if config.extra_cflags else ''}
+  -RTTI off{(dumb_constant + ' '.join(global_cflags)) if global_cflags else ''}
 
 asflags = $shared_flags
 
@@ -385,26 +997,223 @@ rule mwasm
   description = {config.mwasmeppc_exe.name} -o $out_filename $in_filename
 """.strip('\n'))
 
-    # Add "mwcc" and "mwasm" edges for all (.cpp or .s) -> .o files
+    # Add "mwpch" edges to precompile the prefix header once for each
+    # set of game version defines that multiple C++ files are compiled
+    # with (for just one file, it wouldn't save anything). The edges are
+    # added when they're first needed, since the flags can depend on the
+    # variant and the build group.
+    pch_preproc_flags = set()
+    # Edge outputs that have already been added, since variants can
+    # share them
+    built_files = set()
+    if config.pch_headers:
+        pch_source = config.build_dir / PCH_DIR_NAME / PCH_SOURCE_FILE_NAME
+        write_file_if_changed(pch_source, '\n'.join([
+            '// Generated by configure.py -- do not edit',
+            *(f'#include "{header}"' for header in config.pch_headers),
+            '']))
+
+        lines.append(f"""
+rule mwpch
+  command = $cc $cflags -precompile $out -MDfile $out.d $in
+  depfile = $out.d
+  description = {config.mwcceppc_exe.name} -precompile $out_filename
+""")
+
+        flag_counts = {}
+        for tu in tus:
+            if tu.is_cpp():
+                for preproc_flag, _, _ in tu.iter_builds(config):
+                    flag_counts[preproc_flag] = flag_counts.get(preproc_flag, 0) + 1
+
+        pch_preproc_flags = {f for f, count in flag_counts.items() if count > 1}
+
+    def pch_file_for(preproc_flag: str, variant: Variant, versions: Optional[Set[str]]) -> Optional[str]:
+        if preproc_flag not in pch_preproc_flags:
+            return None
+
+        pch_cflags = cflags_for([pch_source], variant, versions)
+        pch_name = f'{preproc_flag}{flags_suffix(pch_cflags)}.mch'
+        pch_file = f'$pchdir/{pch_name}'
+        if pch_file not in built_files:
+            built_files.add(pch_file)
+            lines.append(f'build {pch_file}: mwpch $pchdir/{ninja_escape(PCH_SOURCE_FILE_NAME)}')
+            lines.append(f'  cflags = $cflags{"".join(f" {ninja_escape(f)}" for f in pch_cflags)} -D{preproc_flag}')
+            lines.append(f'  out_filename = {PCH_DIR_NAME}/{pch_name}')
+            lines.append('')
+        return pch_file
+
+    # Add "mwcc" and "mwasm" edges for all (.cpp or .s) -> .o files.
+    # {(TU, variant name, .o file path without variant suffix): .o file path}
+    variant_o_files = {}
     lines.append('')
     for tu in tus:
-        for preproc_flag, o_file in tu.iter_builds(config):
-            if tu.is_cpp():
-                lines.append(f'build {ninja_escape(o_file)}: mwcc {ninja_escape(tu.source_file)}')
-                lines.append(f'  cflags = $cflags -D{preproc_flag}')
+        for variant in config.variants:
+            for preproc_flag, o_file, versions in tu.iter_builds(config):
+                if tu.is_cpp():
+                    pch_file = pch_file_for(preproc_flag, variant, versions)
+
+                    # The precompiled header counts as being included by
+                    # every file, for the purposes of scoped defines
+                    source_files = [t.source_file for t in tu.tus] if isinstance(tu, UnityUnit) else [tu.source_file]
+                    if pch_file is not None:
+                        source_files.append(pch_source)
+
+                    edge_cflags = cflags_for(source_files, variant, versions)
+                else:
+                    edge_cflags = []
+
+                variant_o_file = o_file.with_suffix(flags_suffix(edge_cflags) + o_file.suffix)
+                variant_o_files[tu, variant.name, o_file] = variant_o_file
+                if variant_o_file in built_files:
+                    continue
+                built_files.add(variant_o_file)
+
+                if tu.is_cpp():
+                    cflags = '$cflags' + ''.join(f' {ninja_escape(f)}' for f in edge_cflags)
+                    if isinstance(tu, UnityUnit):
+                        # Unity files #include source files relative to srcdir
+                        cflags += f' -i {quote}$srcdir{quote}'
+                    if pch_file is not None:
+                        cflags += f' -prefix {quote}{pch_file}{quote}'
+                        lines.append(f'build {ninja_escape(variant_o_file)}: mwcc {ninja_escape(tu.source_file)} | {pch_file}')
+                    else:
+                        lines.append(f'build {ninja_escape(variant_o_file)}: mwcc {ninja_escape(tu.source_file)}')
+                    lines.append(f'  cflags = {cflags} -D{preproc_flag}')
+                else:
+                    lines.append(f'build {ninja_escape(variant_o_file)}: mwasm {ninja_escape(tu.source_file)}')
+                    lines.append(f'  asflags = $asflags -D{preproc_flag}')
+                lines.append(f'  out_filename = {ninja_escape(variant_o_file.relative_to(config.build_dir))}')
+                lines.append(f'  in_filename = {ninja_escape(tu.display_name(config))}')
+                lines.append('')
+
+    if scanner is not None:
+        scanner.save()
+
+    # Keep track of everything that went into this Ninja file, so that
+    # the caller can regenerate it when any of it changes
+    config.input_files.update(Path(__file__).parent.glob('*.py'))
+    config.input_files.update(index.iter_input_paths())
+    if use_addrmap:
+        config.input_files.add(config.address_map_txt)
+    if use_externals:
+        config.input_files.add(config.externals_txt)
+    if inferrer is not None:
+        config.input_files.update(inferrer.preprocessor.files_read())
+    if scanner is not None:
+        config.input_files.update(scanner.scanned_files)
+    # (Files that this script generated itself don't count)
+    config.input_files = {p for p in config.input_files if config.build_dir not in p.parents}
+
+    output_versions = config.select_versions or config.get_version_names_list()
+
+    implicit_deps = []
+    if use_addrmap:
+        implicit_deps.append('$addrmap')
+    if use_externals:
+        implicit_deps.append('$externals')
+
+    def with_artifact_cache(command: str, inputs: List[str], manifests: Optional[List[str]] = None) -> str:
+        """
+        Wrap a link command with the artifact cache, if enabled.
+        `manifests` lists inputs that are JSON files containing paths.
+        """
+        if config.artifact_cache_dir is None:
+            return command
+        artifact_cache = Path(__file__).parent / ARTIFACT_CACHE_SCRIPT_NAME
+        launcher = f"{ninja_escape(sys.executable)} {quote}{ninja_escape(artifact_cache)}{quote}"
+        launcher += f" --cache-dir {quote}{ninja_escape(config.artifact_cache_dir)}{quote}"
+        if config.artifact_cache_max_size is not None:
+            launcher += f" --max-size {ninja_escape(config.artifact_cache_max_size)}"
+        # Paths within these directories are made relative to them in
+        # the cache key, so that it matches across checkouts and machines
+        for base_dir in [config.project_dir, config.build_dir, config.output_dir]:
+            launcher += f" --base-dir {quote}{ninja_escape(base_dir)}{quote}"
+        launcher += f" --inputs {' '.join(inputs)} --outputs $out"
+        if manifests:
+            launcher += f" --manifests {' '.join(manifests)}"
+        return launcher + ' -- ' + command
+
+    def objs_for_version(version: str, variant: Variant) -> List[Path]:
+        objs = []
+        for tu in tus:
+            o_file = tu.o_file_for_version(version, config)
+            if o_file:
+                objs.append(variant_o_files[tu, variant.name, o_file])
+        return objs
+
+    def variant_out_dir(variant: Variant) -> str:
+        if variant.name is None:
+            return '$outdir'
+        return ninja_escape(variant.output_dir)
+
+    def variant_file_name(file_name: str, variant: Variant) -> str:
+        if variant.name is None:
+            return file_name
+        stem, ext = os.path.splitext(file_name)
+        return f'{stem}.{variant.name}{ext}'
+
+    if config.link_mode == 'single':
+        # Link all versions with one edge. The driver script checks
+        # which versions actually need relinking, and only rewrites
+        # outputs that changed (hence "restat").
+        kamek_link_script = Path(__file__).parent / KAMEK_LINK_SCRIPT_NAME
+        rule_command = f"{ninja_escape(sys.executable)} {quote}{ninja_escape(kamek_link_script)}{quote} {quote}$in_manifest{quote} {quote}$statefile{quote}"
+        # (The state file is only an optimization for kamek_link.py
+        # itself, so it doesn't need to be cached)
+        rule_command = with_artifact_cache(rule_command,
+            ['$in', f'{quote}$in_manifest{quote}', f'{quote}{ninja_escape(kamek_link_script)}{quote}', f'{quote}$kamek{quote}',
+             *(f'{quote}{d}{quote}' for d in implicit_deps)],
+            [f'{quote}$in_manifest{quote}'])
+        lines.append(f"""
+rule kmlink
+  command = {rule_command}
+  description = {ninja_escape(config.kamek_exe.name)} -> $out_filename
+  restat = 1
+""")
+
+        for variant in config.variants:
+            versions_objs = {}
+            for version in output_versions:
+                versions_objs[version] = objs_for_version(version, variant)
+
+            manifest_path = config.build_dir / variant_file_name(LINK_MANIFEST_FILE_NAME, variant)
+            write_file_if_changed(manifest_path, kamek_link.make_manifest_json(
+                config.kamek_exe,
+                config.address_map_txt if use_addrmap else None,
+                config.externals_txt if use_externals else None,
+                variant.output_dir,
+                versions_objs))
+
+            all_objs = []
+            for objs in versions_objs.values():
+                for o in objs:
+                    if o not in all_objs:
+                        all_objs.append(o)
+
+            out_dir = variant_out_dir(variant)
+            lines.append(f'build {" ".join(f"{out_dir}/{v}.bin" for v in output_versions)}: kmlink'
+                + ''.join(f' {ninja_escape(o)}' for o in all_objs)
+                + f' | {ninja_escape(manifest_path)} {ninja_escape(kamek_link_script)}'
+                + ''.join(f' {d}' for d in implicit_deps))
+            lines.append(f'  in_manifest = {ninja_escape(manifest_path)}')
+            lines.append(f'  statefile = {ninja_escape(config.build_dir / variant_file_name(LINK_STATE_FILE_NAME, variant))}')
+            if variant.name is None:
+                lines.append(f'  out_filename = {len(output_versions)} versions')
             else:
-                lines.append(f'build {ninja_escape(o_file)}: mwasm {ninja_escape(tu.source_file)}')
-                lines.append(f'  asflags = $asflags -D{preproc_flag}')
-            lines.append(f'  out_filename = {ninja_escape(o_file.relative_to(config.build_dir))}')
-            lines.append(f'  in_filename = {ninja_escape(tu.source_file.relative_to(config.src_dir))}')
+                lines.append(f'  out_filename = {len(output_versions)} versions ({variant.name})')
             lines.append('')
 
+        return '\n'.join(lines)
+
     rule_command = f"{quote}$kamek{quote} $in -quiet -dynamic"
     if use_addrmap:
         rule_command += f" {quote}-versions=$addrmap{quote}"
     if use_externals:
         rule_command += f" {quote}-externals=$externals{quote}"
     rule_command += " -output-kamek=$out -select-version=$selectversion"
+    rule_command = with_artifact_cache(rule_command,
+        ['$in', f'{quote}$kamek{quote}', *(f'{quote}{d}{quote}' for d in implicit_deps)])
 
     lines.append(f"""
 rule kmdynamic
@@ -415,30 +1224,38 @@ rule kmdynamic
     # Add "km" edges for all .o -> .bin files
     # TODO: how do you handle the case where a version ends up with zero
     # .o files? *do* I even need to handle that?
-    output_versions = config.select_versions or config.get_version_names_list()
-    for version in output_versions:
-        lines.append(f'build $outdir/{version}.bin: kmdynamic')
+    for variant in config.variants:
+        for version in output_versions:
+            lines.append(f'build {variant_out_dir(variant)}/{version}.bin: kmdynamic')
 
-        for tu in tus:
-            o_file = tu.o_file_for_version(version, config)
-            if o_file:
+            for o_file in objs_for_version(version, variant):
                 lines[-1] += f' {ninja_escape(o_file)}'
 
-        implicit_deps = []
-        if use_addrmap:
-            implicit_deps.append('$addrmap')
-        if use_externals:
-            implicit_deps.append('$externals')
-        if implicit_deps:
-            lines[-1] += f' | {" ".join(implicit_deps)}'
+            if implicit_deps:
+                lines[-1] += f' | {" ".join(implicit_deps)}'
 
-        lines.append(f'  selectversion = {version}')
-        lines.append(f'  out_filename = {version}.bin')
-        lines.append('')
+            lines.append(f'  selectversion = {version}')
+            if variant.name is None:
+                lines.append(f'  out_filename = {version}.bin')
+            else:
+                lines.append(f'  out_filename = {variant.name}/{version}.bin')
+            lines.append('')
 
     return '\n'.join(lines)
 
 
+def configure(config: Config) -> str:
+    """
+    Create the Ninja file for a Config and write it to
+    config.ninja_file, and return its contents. This is the entry point
+    for other Python scripts that import this one, instead of running it
+    as a separate process.
+    """
+    txt = make_ninja_file(config)
+    config.ninja_file.write_text(txt, encoding='utf-8')
+    return txt
+
+
 def main(argv=None) -> None:
     """
     Main function
@@ -451,9 +1268,7 @@ def main(argv=None) -> None:
     args, extra_args = parser.parse_known_args(argv)
     config = Config.from_args(args, extra_args)
 
-    txt = make_ninja_file(config)
-    ninja_fp = config.ninja_file
-    ninja_fp.write_text(txt, encoding='utf-8')
+    configure(config)
 
 
 if __name__ == '__main__':
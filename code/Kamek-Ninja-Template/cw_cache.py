@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2026 RoadrunnerWMC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+# Bump this whenever the cache layout or key computation changes, so
+# that old entries can't be mistaken for new ones
+CACHE_VERSION = 1
+
+DEFAULT_MAX_SIZE = 1024 ** 3  # 1 GiB
+
+# Arguments whose following argument is the path of an output file
+ARGS_INDICATING_OUTPUTS = {'-o', '-Mfile', '-MMfile', '-MDfile', '-MMDfile'}
+# Arguments whose following argument is the path of an input file that
+# CodeWarrior won't list in the depfile
+ARGS_INDICATING_EXTRA_INPUTS = {'-include', '-prefix'}
+# Arguments that make the compile too unusual to cache
+UNCACHEABLE_ARGS = {'-E', '-EP', '-P', '-S', '-precompile', '-make', '-M', '-MM'}
+
+MANIFEST_MAX_ENTRIES = 16
+
+STATS_FILE_NAME = 'stats.log'
+STATS_TOTALS_FILE_NAME = 'stats.json'
+STATS_FIELDS = ['hit', 'miss', 'uncacheable']
+
+# Like ccache, instead of checking the cache size after every change
+# (which would mean scanning the whole cache directory every time),
+# it's cleaned up periodically: whenever the stats log (one line per
+# lookup) grows past this size, it's compacted into the totals file and
+# the cache is cleaned up
+CLEANUP_INTERVAL_BYTES = 4096
+
+
+def parse_size(s: str) -> int:
+    """
+    Parse a size string like "500M" or "2G" into a number of bytes
+    """
+    s = s.strip().upper()
+    multiplier = 1
+    for suffix, value in [('K', 1024), ('M', 1024 ** 2), ('G', 1024 ** 3)]:
+        if s.endswith(suffix):
+            s = s[:-1]
+            multiplier = value
+            break
+    return int(float(s) * multiplier)
+
+
+def hash_file(path: Path) -> str:
+    """
+    Return the SHA-256 hex digest of a file's contents
+    """
+    with path.open('rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """
+    Write a file such that concurrent readers never see it half-written
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=path.name, dir=path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+def append_stat(cache_dir: Path, field: str) -> bool:
+    """
+    Record a hit, miss, etc. in a cache directory's stats log. Lines are
+    appended, rather than rewriting a counter, so that concurrent
+    processes don't clobber each other's updates. Returns True if it's
+    time for a periodic cleanup (see CLEANUP_INTERVAL_BYTES).
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with (cache_dir / STATS_FILE_NAME).open('a', encoding='utf-8') as f:
+        f.write(f'{field}\n')
+        return f.tell() >= CLEANUP_INTERVAL_BYTES
+
+
+def read_stats_totals(cache_dir: Path) -> Dict[str, int]:
+    """
+    Read a cache directory's compacted statistics
+    """
+    stats = {field: 0 for field in STATS_FIELDS}
+    try:
+        totals = json.loads((cache_dir / STATS_TOTALS_FILE_NAME).read_text(encoding='utf-8'))
+        for field in STATS_FIELDS:
+            stats[field] += int(totals.get(field, 0))
+    except (OSError, ValueError, AttributeError):
+        pass
+    return stats
+
+
+def count_stats_log(log_file: Path, stats: Dict[str, int]) -> None:
+    """
+    Add the lines of a stats log to `stats`
+    """
+    try:
+        with log_file.open(encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line in stats:
+                    stats[line] += 1
+    except OSError:
+        pass
+
+
+def read_stats(cache_dir: Path) -> Dict[str, int]:
+    """
+    Read a cache directory's statistics (compacted totals plus the
+    current stats log)
+    """
+    stats = read_stats_totals(cache_dir)
+    count_stats_log(cache_dir / STATS_FILE_NAME, stats)
+    return stats
+
+
+def compact_stats(cache_dir: Path) -> bool:
+    """
+    Fold a cache directory's stats log into its totals file. Returns
+    False if another process got to it first, in which case it should
+    also be the one to clean up the cache.
+    """
+    log_file = cache_dir / STATS_FILE_NAME
+    # Moving the log out of the way first means that only one process
+    # compacts it, and new lines go to a new log in the meantime
+    compacting_file = cache_dir / f'{STATS_FILE_NAME}.{os.getpid()}'
+    try:
+        os.replace(log_file, compacting_file)
+    except OSError:
+        return False
+
+    # (Lines appended by other processes in the instant before the log
+    # was moved may be missed, which is fine for statistics)
+    stats = read_stats_totals(cache_dir)
+    count_stats_log(compacting_file, stats)
+    atomic_write_bytes(cache_dir / STATS_TOTALS_FILE_NAME, json.dumps(stats).encode('utf-8'))
+    compacting_file.unlink(missing_ok=True)
+    return True
+
+
+def zero_stats(cache_dir: Path) -> None:
+    for name in [STATS_FILE_NAME, STATS_TOTALS_FILE_NAME]:
+        (cache_dir / name).unlink(missing_ok=True)
+
+
+def print_stats(cache_dir: Path, total_size: int) -> None:
+    """
+    Print a cache directory's statistics, and the given total size of
+    its contents
+    """
+    stats = read_stats(cache_dir)
+    lookups = stats['hit'] + stats['miss']
+    print(f'Cache directory: {cache_dir}')
+    print(f'Hits:            {stats["hit"]}')
+    print(f'Misses:          {stats["miss"]}')
+    if lookups:
+        print(f'Hit rate:        {stats["hit"] / lookups:.1%}')
+    print(f'Uncacheable:     {stats["uncacheable"]}')
+    print(f'Size:            {total_size / 1024 ** 2:.1f} MiB')
+
+
+class CacheJob:
+    """
+    One cacheable compiler invocation
+    """
+    cache: 'ObjectCache'
+    base_key: str
+    source_file: Path
+    output_file: Path
+    depfile: Path
+    _file_hashes: Dict[str, Optional[str]]
+
+    def __init__(self, cache: 'ObjectCache', base_key: str, source_file: Path, output_file: Path, depfile: Path):
+        super().__init__()
+        self.cache = cache
+        self.base_key = base_key
+        self.source_file = source_file
+        self.output_file = output_file
+        self.depfile = depfile
+        self._file_hashes = {}
+
+    def hash_dependency(self, path_str: str) -> Optional[str]:
+        """
+        Hash a dependency file, returning None if it doesn't exist
+        """
+        if path_str not in self._file_hashes:
+            try:
+                self._file_hashes[path_str] = hash_file(Path(path_str))
+            except OSError:
+                self._file_hashes[path_str] = None
+        return self._file_hashes[path_str]
+
+    def lookup(self) -> Optional[Tuple[Path, List[str]]]:
+        """
+        Look for a cached result whose dependencies all still match.
+        Returns (cached .o path, dependency list) or None.
+        """
+        manifest = self.cache.read_manifest(self.base_key)
+        for entry in manifest:
+            if all(self.hash_dependency(p) == h for p, h in entry['deps'].items()):
+                obj = self.cache.object_path(entry['result'])
+                if obj.is_file():
+                    return obj, entry['dep_list']
+        return None
+
+    def restore(self) -> Optional[List[str]]:
+        """
+        If there's a cached result, copy its .o to the output path and
+        return its dependency list (for writing the depfile). Otherwise,
+        return None.
+        """
+        result = self.lookup()
+        if result is None:
+            self.cache.record_stat('miss')
+            return None
+
+        obj, dep_list = result
+        self.output_file.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(obj, self.output_file)
+        self.cache.touch(obj)
+        self.cache.record_stat('hit')
+        return dep_list
+
+    def store(self, dep_list: List[str]) -> None:
+        """
+        Add the freshly compiled .o to the cache. `dep_list` is the
+        complete list of dependencies from the (host-format) depfile.
+        """
+        # The source file is already covered by the base key
+        deps = {}
+        for dep in dep_list:
+            if Path(dep) == self.source_file:
+                continue
+            h = self.hash_dependency(dep)
+            if h is None:
+                # Can't verify this dependency later, so don't cache
+                return
+            deps[dep] = h
+
+        result_key = hashlib.sha256(
+            json.dumps([self.base_key, sorted(deps.items())]).encode('utf-8')
+        ).hexdigest()
+
+        atomic_write_bytes(self.cache.object_path(result_key), self.output_file.read_bytes())
+
+        manifest = self.cache.read_manifest(self.base_key)
+        manifest = [e for e in manifest if e['result'] != result_key]
+        manifest.insert(0, {'deps': deps, 'dep_list': dep_list, 'result': result_key})
+        self.cache.write_manifest(self.base_key, manifest[:MANIFEST_MAX_ENTRIES])
+
+
+class ObjectCache:
+    """
+    A content-addressed cache of CodeWarrior output files.
+
+    Cache keys work similarly to ccache's "direct mode": preprocessing
+    would require starting Wine, which is exactly what the cache is
+    trying to avoid, so instead of hashing the preprocessed source, we
+    hash the source file, compiler, and flags, and then also check the
+    contents of every header the source file included the last time it
+    was compiled (from its depfile).
+    """
+    cache_dir: Path
+    max_size: int
+
+    def __init__(self, cache_dir: Path, max_size: int = DEFAULT_MAX_SIZE):
+        super().__init__()
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def object_path(self, key: str) -> Path:
+        return self.cache_dir / 'objects' / key[:2] / f'{key}.o'
+
+    def manifest_path(self, key: str) -> Path:
+        return self.cache_dir / 'manifests' / key[:2] / f'{key}.json'
+
+    def read_manifest(self, key: str) -> list:
+        try:
+            return json.loads(self.manifest_path(key).read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return []
+
+    def write_manifest(self, key: str, manifest: list) -> None:
+        atomic_write_bytes(self.manifest_path(key), json.dumps(manifest).encode('utf-8'))
+
+    def touch(self, path: Path) -> None:
+        """
+        Mark a cache file as recently used
+        """
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def record_stat(self, field: str) -> None:
+        """
+        Record a hit, miss, etc., and clean up the cache if it's time to
+        """
+        if append_stat(self.cache_dir, field) and compact_stats(self.cache_dir):
+            self.cleanup()
+
+    def read_stats(self) -> Dict[str, int]:
+        return read_stats(self.cache_dir)
+
+    def iter_objects(self) -> Iterator[os.DirEntry]:
+        """
+        Iterate over all cached object files
+        """
+        objects_dir = self.cache_dir / 'objects'
+        if not objects_dir.is_dir():
+            return
+        for subdir in os.scandir(objects_dir):
+            if subdir.is_dir():
+                yield from os.scandir(subdir.path)
+
+    def iter_manifests(self) -> Iterator[os.DirEntry]:
+        """
+        Iterate over all manifest files
+        """
+        manifests_dir = self.cache_dir / 'manifests'
+        if not manifests_dir.is_dir():
+            return
+        for subdir in os.scandir(manifests_dir):
+            if subdir.is_dir():
+                yield from os.scandir(subdir.path)
+
+    def total_size(self) -> int:
+        return sum(e.stat().st_size for e in self.iter_objects())
+
+    def cleanup(self, max_size: Optional[int] = None) -> None:
+        """
+        If the cache is bigger than `max_size` bytes (default: the
+        cache's configured limit), delete the least-recently-used
+        objects until it's down to 90% of that
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        entries = []
+        total = 0
+        for e in self.iter_objects():
+            try:
+                st = e.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, e.path))
+            total += st.st_size
+
+        if total <= max_size:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= max_size * 0.9:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+        self.prune_manifests()
+
+    def prune_manifests(self) -> None:
+        """
+        Remove manifest entries whose objects have been evicted, and
+        manifests with no entries left
+        """
+        for e in self.iter_manifests():
+            path = Path(e.path)
+            try:
+                manifest = json.loads(path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+
+            pruned = [entry for entry in manifest if self.object_path(entry['result']).is_file()]
+            try:
+                if not pruned:
+                    path.unlink()
+                elif len(pruned) != len(manifest):
+                    atomic_write_bytes(path, json.dumps(pruned).encode('utf-8'))
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        for subdir in ['objects', 'manifests']:
+            shutil.rmtree(self.cache_dir / subdir, ignore_errors=True)
+
+    def prepare(self, cw_exe: Path, cw_args: List[str]) -> Optional[CacheJob]:
+        """
+        Check if a CodeWarrior invocation (with host paths) is cacheable,
+        and if so, compute its base key and return a CacheJob for it
+        """
+        source_file = output_file = depfile = None
+        key_args = []
+        extra_inputs = []
+
+        for i, arg in enumerate(cw_args):
+            prev_arg = cw_args[i - 1] if i > 0 else None
+
+            if arg in UNCACHEABLE_ARGS:
+                break
+
+            if prev_arg in ARGS_INDICATING_OUTPUTS:
+                # Output paths don't affect the output contents, so keep
+                # them out of the key
+                if prev_arg == '-o':
+                    output_file = Path(arg)
+                else:
+                    depfile = Path(arg)
+                key_args.append('<output>')
+
+            elif prev_arg in ARGS_INDICATING_EXTRA_INPUTS:
+                extra_inputs.append(Path(arg))
+                key_args.append(arg)
+
+            elif not arg.startswith('-') and Path(arg).is_file():
+                if source_file is not None:
+                    # Multiple source files
+                    break
+                source_file = Path(arg)
+                key_args.append('<source>')
+
+            else:
+                key_args.append(arg)
+
+        else:
+            if '-c' in cw_args and None not in (source_file, output_file, depfile):
+                h = hashlib.sha256()
+                h.update(json.dumps([CACHE_VERSION, key_args]).encode('utf-8'))
+                for path in [cw_exe, source_file, *extra_inputs]:
+                    h.update(bytes.fromhex(hash_file(path)))
+
+                return CacheJob(self, h.hexdigest(), source_file.absolute(), output_file, depfile)
+
+        self.record_stat('uncacheable')
+        return None
+
+
+def main(argv=None) -> None:
+    """
+    Main function
+    """
+    parser = argparse.ArgumentParser(
+        description='Manage the CodeWarrior object cache used by cw_wrapper.py.')
+
+    parser.add_argument('cache_dir', type=Path,
+        help='cache directory')
+    parser.add_argument('--show-stats', action='store_true',
+        help='show cache statistics')
+    parser.add_argument('--zero-stats', action='store_true',
+        help='reset the statistics')
+    parser.add_argument('--cleanup', metavar='SIZE',
+        help='evict least-recently-used objects until the cache is under this size (e.g. "500M")')
+    parser.add_argument('--clear', action='store_true',
+        help='delete all cached objects')
+
+    args = parser.parse_args(argv)
+    cache = ObjectCache(args.cache_dir)
+
+    if args.clear:
+        cache.clear()
+    if args.cleanup:
+        cache.cleanup(parse_size(args.cleanup))
+    if args.zero_stats:
+        zero_stats(args.cache_dir)
+
+    if args.show_stats or not (args.clear or args.cleanup or args.zero_stats):
+        print_stats(args.cache_dir, cache.total_size())
+
+
+if __name__ == '__main__':
+    main()
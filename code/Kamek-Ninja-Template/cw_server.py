@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2026 RoadrunnerWMC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import argparse
+import json
+import os
+from pathlib import Path
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+from typing import BinaryIO, List, Optional, Tuple
+
+
+# Wire protocol: every message is a frame consisting of a one-byte
+# frame type, a big-endian u32 payload length, and the payload.
+#
+# The client sends a single REQUEST frame (JSON), and the server replies
+# with any number of STDOUT/STDERR frames followed by one EXIT frame
+# (big-endian s32 exit code). A REFUSED frame (UTF-8 reason string)
+# tells the client to run the compiler itself instead.
+FRAME_HEADER = struct.Struct('>cI')
+FRAME_REQUEST = b'R'
+FRAME_STDOUT = b'O'
+FRAME_STDERR = b'E'
+FRAME_EXIT = b'X'
+FRAME_REFUSED = b'N'
+
+EXIT_CODE = struct.Struct('>i')
+
+ALLOWED_EXE_NAMES = {'mwcceppc.exe', 'mwasmeppc.exe'}
+
+
+def send_frame(sock: socket.socket, frame_type: bytes, payload: bytes) -> None:
+    """
+    Send one frame over a socket
+    """
+    sock.sendall(FRAME_HEADER.pack(frame_type, len(payload)) + payload)
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytes:
+    """
+    Receive exactly `size` bytes from a socket
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed unexpectedly')
+        data += chunk
+    return bytes(data)
+
+
+def recv_frame(sock: socket.socket) -> Tuple[bytes, bytes]:
+    """
+    Receive one frame from a socket, and return (frame type, payload)
+    """
+    frame_type, size = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+    return frame_type, recv_exactly(sock, size)
+
+
+def run_remotely(socket_path: Path, cw_exe: Path, cw_args: List[str]) -> Optional[int]:
+    """
+    Ask the compiler server at `socket_path` to run CodeWarrior, and
+    forward its output to our own stdout and stderr. Returns the exit
+    code, or None if the server isn't available (or refuses, or goes
+    away before sending any output), in which case the caller should
+    just run the compiler itself.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    request = {
+        'exe': str(cw_exe.absolute()),
+        'args': cw_args,
+        'cwd': os.getcwd(),
+        'wineprefix': os.environ.get('WINEPREFIX'),
+    }
+
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(str(socket_path))
+    except OSError:
+        return None
+
+    forwarded_output = False
+    with sock:
+        try:
+            send_frame(sock, FRAME_REQUEST, json.dumps(request).encode('utf-8'))
+
+            while True:
+                frame_type, payload = recv_frame(sock)
+                if frame_type == FRAME_STDOUT:
+                    forwarded_output = True
+                    sys.stdout.buffer.write(payload)
+                    sys.stdout.buffer.flush()
+                elif frame_type == FRAME_STDERR:
+                    forwarded_output = True
+                    sys.stderr.buffer.write(payload)
+                    sys.stderr.buffer.flush()
+                elif frame_type == FRAME_EXIT:
+                    return EXIT_CODE.unpack(payload)[0]
+                elif frame_type == FRAME_REFUSED:
+                    return None
+                else:
+                    raise ValueError(f'Unexpected frame type from compiler server: {frame_type!r}')
+
+        except (OSError, struct.error) as e:
+            # (ConnectionError is a subclass of OSError.) If nothing has
+            # been printed yet, it's safe to just compile locally instead
+            # -- otherwise, that would repeat the output we already
+            # forwarded, so report a failure
+            if not forwarded_output:
+                return None
+            print(f'ERROR: lost connection to the compiler server: {e}', file=sys.stderr)
+            return 1
+
+
+class CompilerRequestHandler(socketserver.BaseRequestHandler):
+    """
+    Handles one connection (one compiler invocation)
+    """
+    server: 'CompilerServer'
+
+    def handle(self) -> None:
+        sock = self.request
+
+        try:
+            frame_type, payload = recv_frame(sock)
+            if frame_type != FRAME_REQUEST:
+                raise ValueError(f'expected a request frame, got {frame_type!r}')
+            request = json.loads(payload)
+        except (ConnectionError, ValueError) as e:
+            print(f'WARNING: bad request: {e}', file=sys.stderr)
+            return
+
+        reason = self.server.check_request(request)
+        if reason is not None:
+            send_frame(sock, FRAME_REFUSED, reason.encode('utf-8'))
+            return
+
+        cmd = [request['exe'], *request['args']]
+        if self.server.use_wine:
+            cmd.insert(0, 'wine')
+
+        # Limit how many compilers run at once
+        with self.server.workers:
+            proc = subprocess.Popen(cmd,
+                cwd=request['cwd'],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+
+            send_lock = threading.Lock()
+            disconnected = threading.Event()
+            def forward(stream: BinaryIO, frame_type: bytes) -> None:
+                try:
+                    for chunk in iter(lambda: stream.read1(0x10000), b''):
+                        with send_lock:
+                            send_frame(sock, frame_type, chunk)
+                except OSError:
+                    # The client went away (e.g. Ninja was interrupted).
+                    # Nobody wants the output anymore, and the compiler
+                    # mustn't keep writing to the output file behind the
+                    # next build's back, so stop it.
+                    disconnected.set()
+                    proc.kill()
+
+            stderr_thread = threading.Thread(target=forward, args=(proc.stderr, FRAME_STDERR))
+            stderr_thread.start()
+            forward(proc.stdout, FRAME_STDOUT)
+            stderr_thread.join()
+
+            # (The worker slot is only released once the compiler has
+            # actually exited)
+            returncode = proc.wait()
+
+        if disconnected.is_set():
+            print('WARNING: client disconnected; compiler stopped', file=sys.stderr)
+            return
+
+        try:
+            send_frame(sock, FRAME_EXIT, EXIT_CODE.pack(returncode))
+        except OSError:
+            pass
+
+
+class CompilerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Server that runs CodeWarrior on behalf of cw_wrapper.py, using a
+    shared, already-running wineserver
+    """
+    daemon_threads = True
+
+    workers: threading.BoundedSemaphore
+    use_wine: bool
+
+    def __init__(self, socket_path: Path, jobs: int, use_wine: bool = True):
+        self.workers = threading.BoundedSemaphore(jobs)
+        self.use_wine = use_wine
+
+        socket_path.unlink(missing_ok=True)
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(str(socket_path), CompilerRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def check_request(self, request: dict) -> Optional[str]:
+        """
+        Check if a request is something we're willing to run. Returns
+        None if it is, or the reason why not.
+        """
+        if Path(request.get('exe', '')).name.lower() not in ALLOWED_EXE_NAMES:
+            return 'not a CodeWarrior executable'
+        if not isinstance(request.get('args'), list) or not isinstance(request.get('cwd'), str):
+            return 'malformed request'
+        if request.get('wineprefix') != os.environ.get('WINEPREFIX'):
+            return 'different WINEPREFIX'
+        return None
+
+
+def start_wineserver() -> None:
+    """
+    Start a persistent wineserver (or make the existing one persistent),
+    so it doesn't shut down between compiler runs
+    """
+    subprocess.run(['wineserver', '--persistent'], check=True)
+
+
+def main(argv=None) -> None:
+    """
+    Main function
+    """
+    parser = argparse.ArgumentParser(
+        description='Keep a warm wineserver running, and run CodeWarrior on behalf of'
+                    ' cw_wrapper.py instances that connect to the specified socket.')
+
+    parser.add_argument('socket', type=Path,
+        help='path of the Unix socket to listen on (the same one given to configure.py\'s --cw-server)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help='maximum number of compilers to run at once (default: number of CPUs)')
+
+    args = parser.parse_args(argv)
+
+    if not hasattr(socket, 'AF_UNIX'):
+        raise ValueError("This platform doesn't support Unix sockets")
+
+    use_wine = (sys.platform != 'win32')
+    if use_wine:
+        start_wineserver()
+
+    with CompilerServer(args.socket, max(1, args.jobs), use_wine) as server:
+        print(f'Listening on {args.socket} ({args.jobs} workers)')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            args.socket.unlink(missing_ok=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -22,10 +22,20 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import argparse
+import contextlib
+import json
+import os
 from pathlib import Path
+import re
 import sys
 import subprocess
-from typing import Any
+import tempfile
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import cw_cache
+import cw_server
 
 
 # Note 1: "-I" is special-cased.
@@ -34,6 +44,15 @@ from typing import Any
 ARGS_INDICATING_MAKEFILES = {'-Mfile', '-MMfile', '-MDfile', '-MMDfile'}
 ARGS_INDICATING_PATHS = {'-i', '-include', '-ir', *ARGS_INDICATING_MAKEFILES, '-o', '-precompile', '-prefix'}
 
+PATH_CACHE_FILE_NAME = 'cw_wrapper_paths.json'
+PATH_CACHE_VERSION = 1
+
+TIMINGS_ENV_VAR = 'CW_WRAPPER_TIMINGS'
+TIMINGS_LOG_FILE_NAME = 'cw_wrapper_timings.jsonl'
+GAME_VERSION_DEFINE_PREFIX = 'IS_GAME_VERSION_'
+
+GUEST_DRIVE_PATH = re.compile(r'([A-Za-z]):[\\/](.*)', re.DOTALL)
+
 
 def is_windows():
     return sys.platform == 'win32'
@@ -54,132 +73,635 @@ def makefile_unescape(thing: str) -> str:
     return str(thing).replace('\\ ', ' ').replace('\\\\', '\\')
 
 
-def host_to_guest(path: Path) -> str:
+def get_wine_prefix() -> Path:
     """
-    Convert a host path to a string CodeWarrior will be happy with
+    Return the path to the Wine prefix that "wine" will use
     """
-    if is_windows():
-        return str(path.resolve())
+    if os.environ.get('WINEPREFIX'):
+        return Path(os.environ['WINEPREFIX'])
     else:
-        return subprocess.check_output(
-            ['winepath', '-w', str(path)],
-            encoding='utf-8',
+        return Path.home() / '.wine'
+
+
+def read_wine_drives(prefix: Path) -> Dict[str, str]:
+    """
+    Read the drive letter mappings (e.g. {"z": "/"}) from the
+    "dosdevices" folder of a Wine prefix
+    """
+    dosdevices = prefix / 'dosdevices'
+
+    drives = {}
+    try:
+        entries = list(os.scandir(dosdevices))
+    except OSError:
+        return drives
+
+    for entry in entries:
+        # Drives are symlinks named like "c:". (There are also entries
+        # like "c::" for the raw devices, which we don't care about.)
+        if len(entry.name) != 2 or entry.name[1] != ':' or not entry.is_symlink():
+            continue
+        target = os.path.realpath(dosdevices / entry.name)
+        if os.path.isdir(target):
+            drives[entry.name[0].lower()] = target
+
+    return drives
+
+
+class WinePathTranslator:
+    """
+    Translates paths between the host and the Wine guest.
+
+    Most paths can be translated directly, using the drive mappings in
+    the Wine prefix (the Z: drive is normally mapped to "/"). Anything
+    that can't be handled that way is passed to winepath -- in a single
+    batched call, rather than one per path -- and the results are
+    remembered in an optional cache file so that later runs don't have
+    to ask again.
+    """
+    cache_file: Optional[Path]
+    prefix: Path
+    drives: Dict[str, str]
+    to_guest_cache: Dict[str, str]
+    to_host_cache: Dict[str, str]
+    cache_dirty: bool
+
+    def __init__(self, cache_file: Optional[Path] = None):
+        super().__init__()
+        self.cache_file = cache_file
+        self.to_guest_cache = {}
+        self.to_host_cache = {}
+        self.cache_dirty = False
+
+        if is_windows():
+            self.prefix = None
+            self.drives = {}
+        else:
+            self.prefix = get_wine_prefix()
+            self.drives = read_wine_drives(self.prefix)
+            self.load_cache()
+
+    def load_cache(self) -> None:
+        """
+        Load previously saved winepath results, if they're still valid
+        for the current Wine prefix
+        """
+        if self.cache_file is None:
+            return
+
+        try:
+            j = json.loads(self.cache_file.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return
+
+        # If the prefix or its drive mappings changed, the cached
+        # results may be wrong, so just start over
+        if j.get('version') != PATH_CACHE_VERSION \
+                or j.get('prefix') != str(self.prefix) \
+                or j.get('drives') != self.drives:
+            return
+
+        self.to_guest_cache = j.get('to_guest', {})
+        self.to_host_cache = j.get('to_host', {})
+
+    def save_cache(self) -> None:
+        """
+        Save the winepath results cache, if anything new was added to it
+        """
+        if self.cache_file is None or not self.cache_dirty:
+            return
+
+        j = {
+            'version': PATH_CACHE_VERSION,
+            'prefix': str(self.prefix),
+            'drives': self.drives,
+            'to_guest': self.to_guest_cache,
+            'to_host': self.to_host_cache,
+        }
+
+        # Several instances of the wrapper may be running at once, so
+        # write to a temporary file and then atomically move it into
+        # place. (If two processes race, one set of new entries may be
+        # lost, but that just means winepath gets asked again later.)
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=self.cache_file.name, dir=self.cache_file.parent)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(j, f)
+            os.replace(temp_path, self.cache_file)
+        except OSError:
+            Path(temp_path).unlink(missing_ok=True)
+
+        self.cache_dirty = False
+
+    def compute_guest_path(self, path: Path) -> Optional[str]:
+        """
+        Try to convert a host path to a guest path using the drive
+        mappings. Returns None if no drive contains the path.
+        """
+        path_str = os.path.abspath(path)
+
+        best_letter = best_target = None
+        for letter, target in self.drives.items():
+            if path_str == target or path_str.startswith(target.rstrip('/') + '/'):
+                if best_target is None or len(target) > len(best_target):
+                    best_letter, best_target = letter, target
+
+        if best_letter is None:
+            return None
+
+        rest = path_str[len(best_target):].strip('/')
+        return f'{best_letter.upper()}:\\' + rest.replace('/', '\\')
+
+    def compute_host_path(self, path_str: str) -> Optional[Path]:
+        """
+        Try to convert a guest path to a host path using the drive
+        mappings. Returns None if it can't be done reliably.
+        """
+        match = GUEST_DRIVE_PATH.fullmatch(path_str)
+        if match is None:
+            return None
+
+        target = self.drives.get(match[1].lower())
+        if target is None:
+            return None
+
+        parts = [p for p in re.split(r'[\\/]', match[2]) if p]
+        host_path = Path(target, *parts)
+
+        # Wine looks up files case-insensitively, so the guest path may
+        # not match the real filename's case. winepath knows how to deal
+        # with that, so leave those to it.
+        if not host_path.exists():
+            return None
+
+        return host_path
+
+    def run_winepath(self, mode: str, paths: List[str]) -> List[str]:
+        """
+        Run winepath once for any number of paths ("-w" mode for host
+        -> guest, "-u" for guest -> host)
+        """
+        proc = subprocess.run(
+            ['winepath', mode, *paths],
+            stdout=subprocess.PIPE,
             stderr=subprocess.DEVNULL,
-        ).rstrip('\n')
+            encoding='utf-8',
+        )
+        output = proc.stdout.splitlines()
+
+        if proc.returncode == 0 and len(output) == len(paths):
+            return output
+
+        if len(paths) == 1:
+            raise ValueError(f"winepath couldn't convert {paths[0]!r}")
+
+        # If winepath chokes on one of the paths, there's no telling
+        # which output line goes with which input path, so fall back to
+        # doing them one at a time
+        return [self.run_winepath(mode, [p])[0] for p in paths]
+
+    def hosts_to_guests(self, paths: Iterable[Path]) -> List[str]:
+        """
+        Convert any number of host paths to strings CodeWarrior will be
+        happy with
+        """
+        paths = list(paths)
+        if is_windows():
+            return [str(p.resolve()) for p in paths]
+
+        results = []
+        missing = {}
+        for i, path in enumerate(paths):
+            guest = self.to_guest_cache.get(str(path)) or self.compute_guest_path(path)
+            if guest is None:
+                missing.setdefault(str(path), []).append(i)
+            results.append(guest)
+
+        if missing:
+            for path_str, guest in zip(missing, self.run_winepath('-w', list(missing))):
+                self.to_guest_cache[path_str] = guest
+                for i in missing[path_str]:
+                    results[i] = guest
+            self.cache_dirty = True
+
+        return results
+
+    def guests_to_hosts(self, path_strs: Iterable[str]) -> List[Path]:
+        """
+        Convert any number of path strings from CodeWarrior to paths for
+        the host system
+        """
+        path_strs = list(path_strs)
+        if is_windows():
+            return [Path(p) for p in path_strs]
+
+        results = []
+        missing = {}
+        for i, path_str in enumerate(path_strs):
+            if path_str in self.to_host_cache:
+                host = Path(self.to_host_cache[path_str])
+            else:
+                host = self.compute_host_path(path_str)
+            if host is None:
+                missing.setdefault(path_str, []).append(i)
+            results.append(host)
+
+        if missing:
+            for path_str, host in zip(missing, self.run_winepath('-u', list(missing))):
+                self.to_host_cache[path_str] = host
+                for i in missing[path_str]:
+                    results[i] = Path(host)
+            self.cache_dirty = True
+
+        return results
+
+    def host_to_guest(self, path: Path) -> str:
+        """
+        Convert a host path to a string CodeWarrior will be happy with
+        """
+        return self.hosts_to_guests([path])[0]
+
+    def guest_to_host(self, path_str: str) -> Path:
+        """
+        Convert a path string from CodeWarrior to a path for the host
+        system
+        """
+        return self.guests_to_hosts([path_str])[0]
+
+
+_default_translator = None
+def get_default_translator() -> WinePathTranslator:
+    """
+    Get a shared WinePathTranslator with no cache file
+    """
+    global _default_translator
+    if _default_translator is None:
+        _default_translator = WinePathTranslator()
+    return _default_translator
+
+
+def host_to_guest(path: Path) -> str:
+    """
+    Convert a host path to a string CodeWarrior will be happy with
+    """
+    return get_default_translator().host_to_guest(path)
 
 
 def guest_to_host(path_str: str) -> Path:
     """
     Convert a path string from CodeWarrior to a path for the host system
     """
-    if is_windows():
-        return Path(path_str)
-    else:
-        return Path(subprocess.check_output(
-            ['winepath', '-u', path_str],
-            encoding='utf-8',
-            stderr=subprocess.DEVNULL,
-        ).rstrip('\n'))
+    return get_default_translator().guest_to_host(path_str)
 
 
-def fix_makefile(text: str, filename: str) -> str:
+def parse_makefile(text: str, filename: str) -> List[Optional[Tuple[Optional[str], str, bool]]]:
     """
-    Convert all Windows paths to Unix paths within a
-    CodeWarrior-generated Makefile
+    Parse a CodeWarrior-generated Makefile. Each line is returned as
+    (target, dependency, ends_with_slash), where target is None for
+    continuation lines, or as None for blank lines.
     """
-    new_lines = []
+    parsed_lines = []
 
     for i, line in enumerate(text.splitlines()):
         if not line:
             # Blank line
-            new_lines.append('')
+            parsed_lines.append(None)
+            continue
 
-        elif line.count(': ') == 1:
+        if line.count(': ') == 1:
             split_point = line.index(': ')
+            target = makefile_unescape(line[:split_point])
+            line = line[split_point + 2 :]
 
-            ends_with_slash = line.endswith(' \\')
-            if ends_with_slash:
-                line = line[:-2]
-            line = line.rstrip()
+        elif line.startswith('\t'):
+            # Continuation of a rule ("\tsome_header.h \\")
+            target = None
+            line = line[1:]
 
-            o_file_guest = makefile_unescape(line[:split_point])
-            cpp_file_guest = makefile_unescape(line[split_point + 2 :])
+        else:
+            raise ValueError(f"Couldn't parse line {i+1} of {filename}: {line!r}")
 
-            o_file_host = guest_to_host(o_file_guest).resolve()
-            cpp_file_host = guest_to_host(cpp_file_guest).resolve()
+        ends_with_slash = line.endswith(' \\')
+        if ends_with_slash:
+            line = line[:-2]
+        dependency = makefile_unescape(line.rstrip())
 
-            SPACE_BACKSLASH = ' \\'
-            new_lines.append(f'{makefile_escape(o_file_host)}: {makefile_escape(cpp_file_host)}{SPACE_BACKSLASH if ends_with_slash else ""}')
+        parsed_lines.append((target, dependency, ends_with_slash))
 
-        elif line.startswith('\t'):
-            # Continuation of a rule ("\tsome_header.h \\")
-            line = line[1:]
+    return parsed_lines
 
-            ends_with_slash = line.endswith(' \\')
-            if ends_with_slash:
-                line = line[:-2]
-            line = line.rstrip()
 
-            h_file_guest = makefile_unescape(line)
-            h_file_host = guest_to_host(h_file_guest).resolve()
-            SPACE_BACKSLASH = ' \\'
-            new_lines.append(f'\t{makefile_escape(h_file_host)}{SPACE_BACKSLASH if ends_with_slash else ""}')
+def read_makefile_dependencies(text: str, filename: str) -> List[str]:
+    """
+    Get the list of all dependencies listed in a Makefile
+    """
+    return [line[1] for line in parse_makefile(text, filename) if line is not None]
+
 
+def make_makefile(target: Any, dependencies: List[Any]) -> str:
+    """
+    Create a Makefile (in the same format fix_makefile() produces)
+    declaring a single target with the specified dependencies
+    """
+    SPACE_BACKSLASH = ' \\'
+    lines = []
+    for i, dependency in enumerate(dependencies):
+        line = makefile_escape(dependency)
+        if i == 0:
+            line = f'{makefile_escape(target)}: {line}'
         else:
-            raise ValueError(f"Couldn't parse line {i+1} of {filename}: {line!r}")
+            line = f'\t{line}'
+        if i < len(dependencies) - 1:
+            line += SPACE_BACKSLASH
+        lines.append(line)
+    return '\n'.join(lines)
 
-    return '\n'.join(new_lines)
 
+def fix_makefile(text: str, filename: str, translator: Optional[WinePathTranslator] = None) -> str:
+    """
+    Convert all Windows paths to Unix paths within a
+    CodeWarrior-generated Makefile
+    """
+    if translator is None:
+        translator = get_default_translator()
+
+    # First pass: parse every line, and collect the guest paths
+    parsed_lines = parse_makefile(text, filename)
+    guest_paths = {}  # used as an ordered set
+    for parsed_line in parsed_lines:
+        if parsed_line is not None:
+            target, dependency, _ = parsed_line
+            if target is not None:
+                guest_paths[target] = None
+            guest_paths[dependency] = None
+
+    # Translate all the paths at once
+    host_paths = {}
+    for guest_path, host_path in zip(guest_paths, translator.guests_to_hosts(guest_paths)):
+        host_paths[guest_path] = makefile_escape(host_path.resolve())
+
+    # Second pass: put the Makefile back together
+    new_lines = []
+    SPACE_BACKSLASH = ' \\'
+    for parsed_line in parsed_lines:
+        if parsed_line is None:
+            new_lines.append('')
+            continue
 
-def main(argv=None):
-    if argv is None:
-        argv = sys.argv
+        target, dependency, ends_with_slash = parsed_line
+        line = host_paths[dependency]
+        if target is None:
+            line = f'\t{line}'
+        else:
+            line = f'{host_paths[target]}: {line}'
+        if ends_with_slash:
+            line += SPACE_BACKSLASH
 
-    if len(argv) < 2:
-        print(f'usage: {argv[0]} /path/to/(mwcceppc.exe or mwasmeppc.exe) [arguments to CodeWarrior, using host filepaths]...')
-        return
+        new_lines.append(line)
 
-    # Ignore this Python script's own filename
-    argv.pop(0)
+    return '\n'.join(new_lines)
 
-    # First argument is the path to CodeWarrior
-    cw_exe = Path(argv.pop(0))
 
-    # Next, we scan for any arguments we recognize, and translate any
-    # paths
-    makefile_paths = []
-    for i, arg in enumerate(argv):
-        prev_arg = argv[i - 1] if i > 0 else None
+def read_previous_makefile(path: Path) -> Optional[Tuple[str, os.stat_result]]:
+    """
+    Read a Makefile's contents and timestamps before CodeWarrior
+    overwrites it, for fix_makefile_file(). Returns None if it doesn't
+    exist yet.
+    """
+    try:
+        return path.read_text(encoding='utf-8'), path.stat()
+    except (OSError, ValueError):
+        return None
 
-        # Arguments that precede paths, e.g. "-i", "-MDfile", ...
-        if prev_arg in ARGS_INDICATING_PATHS:
-            if prev_arg in ARGS_INDICATING_MAKEFILES:
-                makefile_paths.append(Path(arg))
 
-            argv[i] = host_to_guest(Path(arg))
+def fix_makefile_file(path: Path, translator: Optional[WinePathTranslator] = None,
+        previous: Optional[Tuple[str, os.stat_result]] = None) -> None:
+    """
+    Run fix_makefile() on a Makefile in-place. If the result is the same
+    as what the file contained before CodeWarrior ran (`previous`, from
+    read_previous_makefile()), its old timestamps are restored too, so
+    that it looks unchanged.
+    """
+    makefile_txt = path.read_text(encoding='utf-8')
+    new_makefile_txt = fix_makefile(makefile_txt, path.name, translator)
+    if new_makefile_txt != makefile_txt:
+        path.write_text(new_makefile_txt, encoding='utf-8')
 
-        # I hate this, but I don't know how else to detect the .cpp, .c,
-        # .S, etc. input file argument(s)
-        elif Path(arg).is_file():
-            argv[i] = host_to_guest(Path(arg))
+    if previous is not None and new_makefile_txt == previous[0]:
+        previous_stat = previous[1]
+        os.utime(path, ns=(previous_stat.st_atime_ns, previous_stat.st_mtime_ns))
 
-        # And a special case for "-I/path/to/include/dir"
-        elif arg.startswith('-I') and arg != '-I-':
-            argv[i] = '-I' + host_to_guest(Path(arg[2:]))
 
-    # Time to invoke CodeWarrior!
-    cmd = [cw_exe, *argv]
-    if not is_windows():
-        cmd.insert(0, 'wine')
-    proc = subprocess.run(cmd)
-    if proc.returncode != 0:
-        exit(proc.returncode)
+def create_arg_parser() -> argparse.ArgumentParser:
+    """
+    Create an ArgumentParser
+    """
+    parser = argparse.ArgumentParser(
+        description='Run CodeWarrior, translating host paths to guest paths in its arguments,'
+                    ' and guest paths to host paths in any Makefiles it generates.')
+
+    parser.add_argument('--build-dir', type=Path, metavar='BUILD',
+        help='directory to keep the wrapper\'s persistent caches in (normally Ninja\'s "$builddir")')
+    parser.add_argument('--cache-dir', type=Path, metavar='DIR',
+        help='reuse compiled objects from (and add them to) the object cache in this directory (see cw_cache.py)')
+    parser.add_argument('--cache-max-size', metavar='SIZE', default=str(cw_cache.DEFAULT_MAX_SIZE),
+        help='maximum object cache size, e.g. "500M" or "2G" (default: 1G)')
+    parser.add_argument('--server', type=Path, metavar='SOCKET',
+        help='run CodeWarrior through the cw_server.py instance listening on this socket, if it\'s running')
+    parser.add_argument('cw_exe', type=Path, metavar='CODEWARRIOR_EXE',
+        help='path to mwcceppc.exe or mwasmeppc.exe')
+    parser.add_argument('cw_args', nargs=argparse.REMAINDER, metavar='...',
+        help='arguments to CodeWarrior, using host filepaths')
+
+    return parser
+
+
+class InvocationTimings:
+    """
+    Collects timing information about one run of the wrapper, and
+    appends it to a log file as a single line of JSON. If no log file is
+    specified, this does nothing.
+    """
+    log_file: Optional[Path]
+    record: Dict[str, Any]
+    phases: Dict[str, float]
+    start_time: float
+
+    def __init__(self, log_file: Optional[Path], cw_exe: Path, cw_args: List[str]):
+        super().__init__()
+        self.log_file = log_file
+        self.phases = {}
+        self.start_time = time.perf_counter()
+
+        version_define = None
+        for arg in cw_args:
+            if arg.startswith('-D' + GAME_VERSION_DEFINE_PREFIX):
+                version_define = arg[2:]
+
+        output = None
+        if '-o' in cw_args[:-1]:
+            output = cw_args[cw_args.index('-o') + 1]
+
+        self.record = {
+            'timestamp': time.time(),
+            'compiler': cw_exe.name,
+            'tu': None,
+            'output': output,
+            'version_define': version_define,
+            'cache': None,
+            'server': False,
+        }
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Context manager to time one phase of the run
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def write(self, exit_code: int) -> None:
+        """
+        Append the record to the log file
+        """
+        if self.log_file is None:
+            return
+
+        record = dict(self.record)
+        record['exit_code'] = exit_code
+        record['phases'] = self.phases
+        record['total'] = time.perf_counter() - self.start_time
+
+        # A single write() of one line in append mode is atomic enough
+        # for concurrent wrapper processes not to interleave
+        self.log_file.parent.mkdir(parents=True, exist_ok=True)
+        with self.log_file.open('a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+def run(args: argparse.Namespace, timings: InvocationTimings) -> int:
+    """
+    Do everything the wrapper does (see create_arg_parser()), and
+    return the exit code
+    """
+    cw_exe = args.cw_exe
+    argv = list(args.cw_args)
+
+    if args.build_dir is None:
+        translator = WinePathTranslator()
+    else:
+        translator = WinePathTranslator(args.build_dir / PATH_CACHE_FILE_NAME)
+
+    # If the object cache is enabled and has a copy of the output
+    # already, we can skip everything else
+    cache_job = None
+    if args.cache_dir is not None:
+        with timings.phase('cache_lookup'):
+            cache = cw_cache.ObjectCache(args.cache_dir, cw_cache.parse_size(args.cache_max_size))
+            cache_job = cache.prepare(cw_exe, argv)
+            if cache_job is not None:
+                dependencies = cache_job.restore()
+                if dependencies is not None:
+                    cache_job.depfile.write_text(
+                        make_makefile(cache_job.output_file.resolve(), dependencies),
+                        encoding='utf-8')
+                    timings.record['tu'] = str(cache_job.source_file)
+                    timings.record['cache'] = 'hit'
+                    return 0
+                timings.record['cache'] = 'miss'
+
+    # Next, we scan for any arguments we recognize, and collect any
+    # paths that need to be translated. They're all translated together
+    # afterwards, so that winepath (if needed at all) only runs once.
+    with timings.phase('translate'):
+        makefile_paths = []
+        to_translate = []  # [(index, prefix, path), ...]
+        for i, arg in enumerate(argv):
+            prev_arg = argv[i - 1] if i > 0 else None
+
+            # Arguments that precede paths, e.g. "-i", "-MDfile", ...
+            if prev_arg in ARGS_INDICATING_PATHS:
+                if prev_arg in ARGS_INDICATING_MAKEFILES:
+                    makefile_paths.append(Path(arg))
+
+                to_translate.append((i, '', Path(arg)))
+
+            # I hate this, but I don't know how else to detect the .cpp, .c,
+            # .S, etc. input file argument(s)
+            elif Path(arg).is_file():
+                to_translate.append((i, '', Path(arg)))
+                timings.record['tu'] = arg
+
+            # And a special case for "-I/path/to/include/dir"
+            elif arg.startswith('-I') and arg != '-I-':
+                to_translate.append((i, '-I', Path(arg[2:])))
+
+        guest_paths = translator.hosts_to_guests(path for _, _, path in to_translate)
+        for (i, prefix, _), guest_path in zip(to_translate, guest_paths):
+            argv[i] = prefix + guest_path
+
+    # CodeWarrior will overwrite the Makefiles (with guest paths), so
+    # remember what they were before, to check if they really changed
+    previous_makefiles = [read_previous_makefile(path) for path in makefile_paths]
+
+    # Time to invoke CodeWarrior! If a compiler server was specified,
+    # try that first, and fall back to running it ourselves if it's not
+    # available.
+    with timings.phase('compile'):
+        returncode = None
+        if args.server is not None:
+            returncode = cw_server.run_remotely(args.server, cw_exe, argv)
+            timings.record['server'] = (returncode is not None)
+
+        if returncode is None:
+            cmd = [cw_exe, *argv]
+            if not is_windows():
+                cmd.insert(0, 'wine')
+            returncode = subprocess.run(cmd).returncode
+
+    if returncode != 0:
+        translator.save_cache()
+        return returncode
 
     # And now fix up any Makefiles it may have generated
-    for path in makefile_paths:
-        makefile_txt = path.read_text(encoding='utf-8')
-        makefile_txt = fix_makefile(makefile_txt, path.name)
-        path.write_text(makefile_txt, encoding='utf-8')
+    with timings.phase('depfile'):
+        for path, previous in zip(makefile_paths, previous_makefiles):
+            fix_makefile_file(path, translator, previous)
+
+        translator.save_cache()
+
+    if cache_job is not None:
+        with timings.phase('cache_store'):
+            dependencies = read_makefile_dependencies(
+                cache_job.depfile.read_text(encoding='utf-8'), cache_job.depfile.name)
+            cache_job.store(dependencies)
+
+    return 0
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    # Ignore this Python script's own filename
+    args = create_arg_parser().parse_args(argv[1:])
+
+    # Timing records are only written if the environment variable is set
+    # and we know where the build directory is
+    log_file = None
+    if os.environ.get(TIMINGS_ENV_VAR, '0') not in {'', '0'} and args.build_dir is not None:
+        log_file = args.build_dir / TIMINGS_LOG_FILE_NAME
+
+    timings = InvocationTimings(log_file, args.cw_exe, args.cw_args)
+    returncode = run(args, timings)
+    timings.write(returncode)
+
+    if returncode != 0:
+        exit(returncode)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2026 RoadrunnerWMC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import argparse
+import hashlib
+import json
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+import cw_cache
+
+
+# Kamek replaces this in output filenames with each version name
+KAMEK_VERSION_PLACEHOLDER = '$KV$'
+
+STATE_VERSION = 1
+
+
+class LinkManifest:
+    """
+    Describes everything needed to link all game versions: which .o
+    files go into each version, and where the outputs go
+    """
+    kamek_exe: Path
+    address_map: Optional[Path]
+    externals: Optional[Path]
+    output_dir: Path
+    # {version: [.o file, ...]}
+    versions: Dict[str, List[Path]]
+
+    @classmethod
+    def load(cls, path: Path) -> 'LinkManifest':
+        j = json.loads(path.read_text(encoding='utf-8'))
+        self = cls()
+        self.kamek_exe = Path(j['kamek'])
+        self.address_map = Path(j['address_map']) if j.get('address_map') else None
+        self.externals = Path(j['externals']) if j.get('externals') else None
+        self.output_dir = Path(j['output_dir'])
+        self.versions = {v: [Path(o) for o in objs] for v, objs in j['versions'].items()}
+        return self
+
+    def output_file(self, version: str) -> Path:
+        return self.output_dir / f'{version}.bin'
+
+
+def make_manifest_json(
+        kamek_exe: Path,
+        address_map: Optional[Path],
+        externals: Optional[Path],
+        output_dir: Path,
+        versions: Dict[str, List[Path]]) -> str:
+    """
+    Create the contents of a manifest file for LinkManifest.load()
+    """
+    return json.dumps({
+        'kamek': str(kamek_exe),
+        'address_map': str(address_map) if address_map else None,
+        'externals': str(externals) if externals else None,
+        'output_dir': str(output_dir),
+        'versions': {v: [str(o) for o in objs] for v, objs in versions.items()},
+    }, indent=4)
+
+
+def compute_input_hashes(manifest: LinkManifest) -> Dict[str, str]:
+    """
+    Hash everything that affects each version's output. Every input
+    file is only read once, no matter how many versions use it.
+    """
+    file_hashes = {}
+    def hash_of(path: Optional[Path]) -> str:
+        if path is None:
+            return ''
+        if path not in file_hashes:
+            file_hashes[path] = cw_cache.hash_file(path)
+        return file_hashes[path]
+
+    kamek_st = manifest.kamek_exe.stat()
+    shared = f'{manifest.kamek_exe}:{kamek_st.st_size}:{kamek_st.st_mtime_ns}'
+    shared += f':{hash_of(manifest.address_map)}:{hash_of(manifest.externals)}'
+
+    hashes = {}
+    for version, objs in manifest.versions.items():
+        h = hashlib.sha256(shared.encode('utf-8'))
+        for obj in objs:
+            h.update(f'\0{obj}={hash_of(obj)}'.encode('utf-8'))
+        hashes[version] = h.hexdigest()
+    return hashes
+
+
+def make_kamek_command(manifest: LinkManifest, objs: List[Path], versions: List[str], out_dir: Path) -> List[str]:
+    """
+    Create a Kamek command line that links several versions at once
+    (they must all use the same .o files)
+    """
+    cmd = [str(manifest.kamek_exe), *(str(o) for o in objs), '-quiet', '-dynamic']
+    if manifest.address_map is not None:
+        cmd.append(f'-versions={manifest.address_map}')
+    if manifest.externals is not None:
+        cmd.append(f'-externals={manifest.externals}')
+    cmd.append(f'-output-kamek={out_dir / (KAMEK_VERSION_PLACEHOLDER + ".bin")}')
+    for version in versions:
+        cmd.append(f'-select-version={version}')
+    return cmd
+
+
+def link(manifest: LinkManifest, state_file: Path) -> int:
+    """
+    Relink every version whose inputs changed since the last successful
+    link. Versions that use exactly the same .o files are linked with a
+    single Kamek run, and all of the Kamek runs happen in parallel.
+    Output files are only rewritten if their contents changed. Returns
+    an exit code.
+    """
+    try:
+        state = json.loads(state_file.read_text(encoding='utf-8'))
+        if state.get('version') != STATE_VERSION:
+            state = None
+    except (OSError, ValueError):
+        state = None
+    old_hashes = state['hashes'] if state else {}
+
+    new_hashes = compute_input_hashes(manifest)
+
+    # {(.o files): [versions]}
+    to_link = {}
+    for version, objs in manifest.versions.items():
+        if old_hashes.get(version) == new_hashes[version] and manifest.output_file(version).is_file():
+            continue
+        to_link.setdefault(tuple(objs), []).append(version)
+
+    if not to_link:
+        return 0
+
+    manifest.output_dir.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=manifest.output_dir, prefix='.kamek_link_') as temp_dir:
+        procs = []
+        for i, (objs, versions) in enumerate(to_link.items()):
+            out_dir = Path(temp_dir) / str(i)
+            out_dir.mkdir()
+            cmd = make_kamek_command(manifest, list(objs), versions, out_dir)
+            procs.append((versions, out_dir, subprocess.Popen(cmd)))
+
+        failed = False
+        for versions, out_dir, proc in procs:
+            if proc.wait() != 0:
+                print(f'Kamek failed for {", ".join(versions)}', file=sys.stderr)
+                failed = True
+                continue
+
+            for version in versions:
+                new_data = (out_dir / f'{version}.bin').read_bytes()
+                output_file = manifest.output_file(version)
+                try:
+                    unchanged = (output_file.read_bytes() == new_data)
+                except OSError:
+                    unchanged = False
+                if not unchanged:
+                    cw_cache.atomic_write_bytes(output_file, new_data)
+                old_hashes[version] = new_hashes[version]
+
+    # Save progress even if some versions failed, so that the ones
+    # that succeeded don't need to be linked again
+    cw_cache.atomic_write_bytes(state_file, json.dumps({
+        'version': STATE_VERSION,
+        'hashes': old_hashes,
+    }).encode('utf-8'))
+
+    return 1 if failed else 0
+
+
+def main(argv=None) -> None:
+    """
+    Main function
+    """
+    parser = argparse.ArgumentParser(
+        description='Link all game versions of a Kamek project at once, skipping the ones whose inputs are unchanged.')
+
+    parser.add_argument('manifest', type=Path,
+        help='link manifest generated by configure.py')
+    parser.add_argument('state_file', type=Path,
+        help='file to remember input hashes in, between runs')
+
+    args = parser.parse_args(argv)
+
+    sys.exit(link(LinkManifest.load(args.manifest), args.state_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2026 RoadrunnerWMC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+import os
+from pathlib import Path
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import build_groups
+import cw_cache
+
+
+MACRO_USAGE_VERSION = 1
+
+include_line = re.compile(r'\s*#\s*include\s*(?:"([^"]+)"|<([^>]+)>)')
+
+
+class MacroUsageScanner:
+    """
+    Finds which macros with particular prefixes each source file
+    references, either itself or through any header it includes
+    (directly or indirectly). This is deliberately conservative: every
+    #include is followed, regardless of preprocessor conditionals.
+
+    Per-file scan results are cached in a JSON file, and files are only
+    re-scanned if their mtime or size changed.
+    """
+    include_dirs: List[Path]
+    prefixes: Tuple[str, ...]
+    cache_file: Optional[Path]
+    # {"/abs/path": {"mtime": ..., "size": ..., "macros": [...], "includes": [["name", is_local], ...]}}
+    files: Dict[str, dict]
+    # Files that were looked at during this run (cached or not)
+    scanned_files: Set[Path]
+    dirty: bool
+
+    def __init__(self, include_dirs: List[Path], prefixes: Iterable[str], cache_file: Optional[Path] = None):
+        super().__init__()
+        self.include_dirs = include_dirs
+        self.prefixes = tuple(prefixes)
+        self.cache_file = cache_file
+        self.files = {}
+        self.scanned_files = set()
+        self.dirty = False
+
+        if cache_file is not None:
+            try:
+                j = json.loads(cache_file.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                j = {}
+            if j.get('version') == MACRO_USAGE_VERSION and j.get('prefixes') == list(self.prefixes):
+                self.files = j['files']
+
+    def save(self) -> None:
+        """
+        Save the cache file, if anything changed
+        """
+        if self.cache_file is None or not self.dirty:
+            return
+
+        cw_cache.atomic_write_bytes(self.cache_file, json.dumps({
+            'version': MACRO_USAGE_VERSION,
+            'prefixes': list(self.prefixes),
+            'files': self.files,
+        }).encode('utf-8'))
+        self.dirty = False
+
+    def scan_file(self, path: Path) -> dict:
+        """
+        Get the macros and #includes in a single file
+        """
+        key = str(path)
+        st = path.stat()
+        self.scanned_files.add(path)
+
+        entry = self.files.get(key)
+        if entry is not None and entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            return entry
+
+        macros = set()
+        includes = []
+        for line in build_groups.split_logical_lines(path.read_text(encoding='utf-8', errors='replace')):
+            match = include_line.match(line)
+            if match:
+                includes.append([match[1] or match[2], match[1] is not None])
+            for name in build_groups.identifier.findall(line):
+                if name.startswith(self.prefixes):
+                    macros.add(name)
+
+        entry = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'macros': sorted(macros), 'includes': includes}
+        self.files[key] = entry
+        self.dirty = True
+        return entry
+
+    def find_include(self, current_file: Path, name: str, is_local: bool) -> Optional[Path]:
+        """
+        Find the file an #include refers to, or return None if it
+        can't be found
+        """
+        search_dirs = self.include_dirs
+        if is_local:
+            search_dirs = [current_file.parent, *search_dirs]
+        for d in search_dirs:
+            path = d / name
+            if path.is_file():
+                return path
+        return None
+
+    def macros_used_by(self, source_file: Path) -> Set[str]:
+        """
+        Find all macros (with the prefixes we care about) referenced by
+        a source file and everything it includes
+        """
+        macros = set()
+        seen = set()
+        pending = [source_file]
+        while pending:
+            path = pending.pop()
+            real = os.path.realpath(path)
+            if real in seen:
+                continue
+            seen.add(real)
+
+            entry = self.scan_file(path)
+            macros.update(entry['macros'])
+            for name, is_local in entry['includes']:
+                include_path = self.find_include(path, name, is_local)
+                if include_path is not None:
+                    pending.append(include_path)
+
+        return macros
+
+    def is_scoped(self, flag: str) -> bool:
+        """
+        Check if a compiler flag is a -D define that should only be
+        passed to the files that use it
+        """
+        return flag.startswith('-D') and flag[2:].startswith(self.prefixes)
+
+    def flags_for(self, source_files: Iterable[Path], flags: List[str]) -> List[str]:
+        """
+        Filter a list of scoped -D flags down to the ones that are
+        relevant to any of the specified source files
+        """
+        macros = set()
+        for source_file in source_files:
+            macros |= self.macros_used_by(source_file)
+        return [f for f in flags if f[2:].split('=', 1)[0] in macros]
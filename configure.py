@@ -23,13 +23,18 @@
 # SOFTWARE.
 
 import argparse
+import importlib.util
+import json
 from pathlib import Path
-import subprocess
+import re
 import sys
-from typing import Any
+import types
+from typing import Any, Iterator
 
 import db as db_lib
-from nsmbw_constants import LANG_FOLDER_NAMES
+import game_fingerprint
+import nsmbw_constants
+from nsmbw_constants import LANG_FOLDER_NAMES, VERSIONS
 
 
 PROJECT_SAFE_NAME = 'nsmbw_updated'
@@ -38,6 +43,9 @@ PROJECT_DISPLAY_NAME = 'NSMBW Updated'
 BUILD_DIR = Path('_build')
 OUTPUT_DIR = Path('bin')
 
+GAME_FINGERPRINT_CACHE = BUILD_DIR / 'game_fingerprints.json'
+CONFIGURE_ARGS_FILE = BUILD_DIR / 'configure_args.json'
+
 RIIVO_DISC_ROOT = OUTPUT_DIR / PROJECT_SAFE_NAME
 RIIVO_CONFIG_DIR = OUTPUT_DIR / 'riivolution'
 
@@ -54,30 +62,28 @@ RIIVO_XML = RIIVO_CONFIG_DIR / f'{PROJECT_SAFE_NAME}.xml'
 ########################################################################
 
 
-def detect_game_version(root: Path) -> str | None:
+def in_preset_dir(path: Path, preset: str | None) -> Path:
+    """
+    Move an output path (within OUTPUT_DIR) into the subdirectory for
+    the specified preset, if any
+    """
+    if preset is None:
+        return path
+    return OUTPUT_DIR / preset / path.relative_to(OUTPUT_DIR)
+
+
+def write_file_if_changed(path: Path, contents: str) -> None:
     """
-    Detect the game version at the specified path.
+    Write a text file, but leave it alone if it already has exactly
+    these contents, so that Ninja doesn't consider it to be modified
     """
-    # TODO: P3 and J3 can't be detected from just the disc root...
-
-    if (root / 'COPYDATE_CODE_2009-10-03_232911').is_file():
-        return 'P1'
-    elif (root / 'COPYDATE_CODE_2009-10-03_232303').is_file():
-        return 'E1'
-    elif (root / 'COPYDATE_CODE_2009-10-03_231655').is_file():
-        return 'J1'
-    elif (root / 'COPYDATE_CODE_2010-01-05_152101').is_file():
-        return 'P2'
-    elif (root / 'COPYDATE_CODE_2010-01-05_143554').is_file():
-        return 'E2'
-    elif (root / 'COPYDATE_CODE_2010-01-05_160530').is_file():
-        return 'J2'
-    elif (root / 'COPYDATE_CODE_2010-03-12_153510').is_file():
-        return 'K'
-    elif (root / 'COPYDATE_CODE_2010-03-15_160349').is_file():
-        return 'W'
-    elif (root / 'COPYDATE_CODE_2016-05-03_111248').is_file():
-        return 'C'
+    try:
+        if path.read_text(encoding='utf-8') == contents:
+            return
+    except OSError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(contents, encoding='utf-8')
 
 
 def ninja_escape(thing: Any) -> str:
@@ -93,73 +99,28 @@ def ninja_escape(thing: Any) -> str:
 ########################################################################
 
 
-class Config:
+class BugfixSelection:
     """
-    Class that represents configuration options provided by the user
+    Class that represents a choice of which bugfixes to build
     """
-    db: db_lib.Database
-    kamek_dir: Path
-    cw_dir: Path
-    game_roots: dict[str, Path]
-
     bugfixes_default: bool
     bugfixes_default_by_tag: list[tuple[db_lib.DatabaseEntryTag, bool]]
     bugfixes_individual: dict[str, bool | str]
 
-    @staticmethod
-    def set_up_arg_parser(db: db_lib.Database, parser: argparse.ArgumentParser) -> None:
-        """
-        Add arguments to the ArgumentParser
-        """
-        env_group = parser.add_argument_group('Specifying the environment')
-        env_group.add_argument('--game-root', metavar='DIR', type=Path, action='append',
-            help='the path to an extracted game root (with "Effect", "Env", "HomeButton2", etc. subdirectories).'
-            ' You can specify this multiple times for different game versions, and the resulting Riivolution patch will include assets for all of them.')
-        env_group.add_argument('--kamek', type=Path, required=True,
-            help='Kamek folder, containing the Kamek binary ("Kamek.exe" or "Kamek") and the k_stdlib directory')
-        env_group.add_argument('--cw', type=Path, metavar='CODEWARRIOR', required=True,
-            help='CodeWarrior folder, containing mwcceppc.exe, mwasmeppc.exe, and license.dat, at minimum')
-
-        bugs_group = parser.add_argument_group('Bugfix selection')
-        bugs_group.add_argument('--default', choices=('on', 'off'), default='on',
-            help='whether all bugfixes should be enabled or disabled by default')
-
-        tag_names = (f.name() for f in db_lib.DatabaseEntryTag if f)
-        tags_metavar = f'{{{",".join(tag_names)}}}'
-        bugs_group.add_argument('--tag-default', nargs=2, action='append',
-            metavar=(tags_metavar, '{on,off}'),
-            help='whether all bugfixes with a particular tag should be enabled or disabled by default')
-
-        bug_names = sorted(db.entries)
-        bug_names = bug_names[:3] + ['...'] + bug_names[-3:]
-        bugs_metavar = f'{{{",".join(bug_names)}}}'
-        bugs_group.add_argument('--bug', nargs=2, action='append',
-            metavar=(bugs_metavar, '{(on|some_bug_specific_option),off}'),
-            help='choose an option for a specific bugfix, or disable it')
-
     @classmethod
-    def from_args(cls, db: db_lib.Database, args: argparse.Namespace) -> None:
+    def from_choices(cls, db: db_lib.Database, default: str,
+            tag_defaults: list[tuple[str, str]] | None,
+            bugs: list[tuple[str, str]] | None) -> 'BugfixSelection':
         """
-        Construct an instance from the CLI arguments
+        Construct an instance from choice strings in the same format as
+        the --default, --tag-default and --bug CLI arguments
         """
-        game_roots = {}
-        if args.game_root:
-            for game_root in args.game_root:
-                version = detect_game_version(game_root)
-                if version is None:
-                    raise ValueError(f"Couldn't identify the game version at {game_root}. Are you sure that's a path to NSMBW?")
-                else:
-                    print(f'Found {version} NSMBW at {game_root}')
-                    game_roots[version] = game_root
-        else:
-            print('WARNING: No game roots specified -- patched assets will not be built!')
-
-        bugfixes_default = (args.default.lower() == 'on')
+        bugfixes_default = (default.lower() == 'on')
 
         # We intentionally preserve the order of the tag defaults
         bugfixes_default_by_tag = []
-        if args.tag_default:
-            for instance in args.tag_default:
+        if tag_defaults:
+            for instance in tag_defaults:
                 tag_str, choice_str = instance
 
                 tag = db_lib.DatabaseEntryTag.from_name(tag_str.upper())
@@ -173,8 +134,8 @@ class Config:
                 bugfixes_default_by_tag.append((tag, choice))
 
         bugfixes_individual = {}
-        if args.bug:
-            for instance in args.bug:
+        if bugs:
+            for instance in bugs:
                 bug_id, choice_str = instance
 
                 entry = db.entries.get(bug_id.upper())
@@ -198,28 +159,26 @@ class Config:
                 bugfixes_individual[bug_id] = choice
 
         self = cls()
-        self.db = db
-        self.kamek_dir = args.kamek.resolve()
-        self.cw_dir = args.cw.resolve()
-        self.game_roots = {k: v.resolve() for k, v in game_roots.items()}
         self.bugfixes_default = bugfixes_default
         self.bugfixes_default_by_tag = bugfixes_default_by_tag
         self.bugfixes_individual = bugfixes_individual
         return self
 
-    def get_selected_bugfixes(self) -> dict[str, bool | str]:
+    def get_selected_bugfixes(self, db: db_lib.Database) -> dict[str, bool | str]:
         """
-        Flatten the info from the CLI args into a single dict that lists
-        all bugfixes to be applied.
+        Flatten the selection into a single dict that lists all
+        bugfixes to be applied.
         """
         state = {}
 
         if self.bugfixes_default:
-            for id, entry in self.db.entries.items():
+            for id, entry in db.entries.items():
                 state[id] = entry.get_default_active_option()
 
         for tag, choice in self.bugfixes_default_by_tag:
-            for id, entry in self.db.entries.items():
+            for id, entry in db.entries.items():
+                if tag not in entry.tags:
+                    continue
                 if choice:
                     state[id] = entry.get_default_active_option()
                 else:
@@ -233,6 +192,228 @@ class Config:
 
         return state
 
+    def get_bug_flags(self, db: db_lib.Database) -> set[str]:
+        """
+        Get the set of preprocessor flag names (without the "NSMBWUP_"
+        prefix) that tell the code which bugfixes to leave out, or which
+        options to use
+        """
+        # The goal here is to detect the following cases:
+        # - Bug is unselected: add "BUGNAME_OFF" flag
+        # - Bug is selected (True): the default behavior, no flag needed
+        # - Bug is selected (some other str): add "BUGNAME_CHOICENAME" flag
+        selected_bugfixes = self.get_selected_bugfixes(db)
+        bug_flags = set()
+        for id in db.entries.keys():
+            choice = selected_bugfixes.get(id, False)
+            if isinstance(choice, bool):
+                if not choice:
+                    bug_flags.add(f'{id}_OFF')
+            else:
+                bug_flags.add(f'{id}_{choice.upper()}')
+        return bug_flags
+
+    def get_bugs_arg(self, db: db_lib.Database, categories: str | None = None, version: str | None = None) -> str:
+        """
+        Get the list of selected bugfixes in the format credits.py
+        expects. If `categories` is specified, only bugs in those
+        categories (the first letter of the ID) are included, and if
+        `version` is, only bugs that are present in that game version.
+        """
+        bug_items = []
+        for k, v in self.get_selected_bugfixes(db).items():
+            if categories is not None and k[0] not in categories:
+                continue
+            if version is not None and not db.entries[k].applies_to(version):
+                continue
+            if isinstance(v, str):
+                bug_items.append(f'{k}={v}')
+            else:
+                bug_items.append(k)
+        return ' '.join(sorted(bug_items))
+
+
+def load_presets(db: db_lib.Database, path: Path) -> dict[str, BugfixSelection]:
+    """
+    Load a presets file, which maps preset names to bugfix selections
+    like {"default": "on", "tag_defaults": {"S": "off"}, "bugs": {"C00600": "off"}}
+    (all keys optional)
+    """
+    with path.open(encoding='utf-8') as f:
+        j = json.load(f)
+
+    if not isinstance(j, dict) or not j:
+        raise ValueError(f'{path.name}: expected an object with at least one preset')
+
+    presets = {}
+    for name, info in j.items():
+        if not re.fullmatch(r'[A-Za-z0-9_.-]+', name) or name.startswith('.'):
+            raise ValueError(f'{path.name}: illegal preset name {name!r} (only letters, numbers, "_", "." and "-" are allowed)')
+
+        unknown_keys = set(info) - {'default', 'tag_defaults', 'bugs'}
+        if unknown_keys:
+            raise ValueError(f'{path.name}: unknown keys for preset {name!r}: {", ".join(sorted(unknown_keys))}')
+
+        presets[name] = BugfixSelection.from_choices(db,
+            info.get('default', 'on'),
+            list(info.get('tag_defaults', {}).items()),
+            list(info.get('bugs', {}).items()))
+
+    return presets
+
+
+class Config:
+    """
+    Class that represents configuration options provided by the user
+    """
+    db: db_lib.Database
+    kamek_dir: Path
+    cw_dir: Path
+    cw_server: Path | None
+    object_cache_dir: Path | None
+    artifact_cache_dir: Path | None
+    credits_jobs: int | None
+    unity: int | None
+    pch: bool
+    link_mode: str | None
+    game_roots: dict[str, Path]
+    fingerprints: game_fingerprint.FingerprintCache
+
+    bugfixes: BugfixSelection
+    presets: dict[str, BugfixSelection] | None
+
+    # Files and directories that the Ninja file depends on (filled in
+    # while creating it)
+    input_files: set[Path]
+
+    @staticmethod
+    def set_up_arg_parser(db: db_lib.Database, parser: argparse.ArgumentParser) -> None:
+        """
+        Add arguments to the ArgumentParser
+        """
+        env_group = parser.add_argument_group('Specifying the environment')
+        env_group.add_argument('--game-root', metavar='DIR', type=Path, action='append',
+            help='the path to an extracted game root (with "Effect", "Env", "HomeButton2", etc. subdirectories).'
+            ' You can specify this multiple times for different game versions, and the resulting Riivolution patch will include assets for all of them.')
+        env_group.add_argument('--game-root-as', nargs=2, metavar=('VERSION', 'DIR'), action='append',
+            help='like --game-root, but for a game root whose version can\'t be detected automatically (which is remembered for later runs)')
+        env_group.add_argument('--kamek', type=Path, required=True,
+            help='Kamek folder, containing the Kamek binary ("Kamek.exe" or "Kamek") and the k_stdlib directory')
+        env_group.add_argument('--cw', type=Path, metavar='CODEWARRIOR', required=True,
+            help='CodeWarrior folder, containing mwcceppc.exe, mwasmeppc.exe, and license.dat, at minimum')
+        env_group.add_argument('--cw-server', type=Path, metavar='SOCKET',
+            help='run CodeWarrior through a cw_server.py instance listening on this Unix socket, when it\'s running'
+            ' (see code/Kamek-Ninja-Template/cw_server.py)')
+        env_group.add_argument('--object-cache', type=Path, metavar='DIR',
+            help='cache compiled objects in this directory, so identical compiles (e.g. when switching between bugfix selections) are skipped'
+            ' (see code/Kamek-Ninja-Template/cw_cache.py)')
+        env_group.add_argument('--artifact-cache', type=Path, metavar='DIR',
+            help='cache Kamekfiles, loader.bin and patched assets in this directory (which can be shared between machines),'
+            ' so steps whose inputs are all unchanged are skipped (see code/Kamek-Ninja-Template/artifact_cache.py)')
+        env_group.add_argument('--credits-jobs', type=int, metavar='N',
+            help='number of worker processes to patch staffroll.bin files with (default: number of CPUs)')
+        env_group.add_argument('--unity', type=int, metavar='N',
+            help='compile the code as at most N combined ("unity") files per set of game versions, which is much faster for clean builds'
+            ' (see code/Kamek-Ninja-Template/readme_docs.md)')
+        env_group.add_argument('--pch', action='store_true',
+            help='precompile the headers that every source file includes, instead of parsing them again for each file')
+        env_group.add_argument('--link-mode', choices=('per-version', 'single'),
+            help='run Kamek once per game version ("per-version", the default), or link all versions with a single build step'
+            ' that only relinks versions whose inputs changed ("single")')
+
+        bugs_group = parser.add_argument_group('Bugfix selection')
+        # (No argparse default, so that it can be detected when --default
+        # is combined with --presets)
+        bugs_group.add_argument('--default', choices=('on', 'off'),
+            help='whether all bugfixes should be enabled or disabled by default (default: on)')
+
+        tag_names = (f.name() for f in db_lib.DatabaseEntryTag if f)
+        tags_metavar = f'{{{",".join(tag_names)}}}'
+        bugs_group.add_argument('--tag-default', nargs=2, action='append',
+            metavar=(tags_metavar, '{on,off}'),
+            help='whether all bugfixes with a particular tag should be enabled or disabled by default')
+
+        bug_names = sorted(db.entries)
+        bug_names = bug_names[:3] + ['...'] + bug_names[-3:]
+        bugs_metavar = f'{{{",".join(bug_names)}}}'
+        bugs_group.add_argument('--bug', nargs=2, action='append',
+            metavar=(bugs_metavar, '{(on|some_bug_specific_option),off}'),
+            help='choose an option for a specific bugfix, or disable it')
+        bugs_group.add_argument('--presets', type=Path, metavar='FILE',
+            help='instead of the above, build every bugfix selection ("preset") listed in this .json file,'
+            ' each into its own subdirectory of the output directory (see readme_building.md)')
+
+    @classmethod
+    def from_args(cls, db: db_lib.Database, args: argparse.Namespace) -> None:
+        """
+        Construct an instance from the CLI arguments
+        """
+        fingerprints = game_fingerprint.FingerprintCache(GAME_FINGERPRINT_CACHE)
+
+        game_roots = {}
+        if args.game_root or args.game_root_as:
+            for game_root in args.game_root or []:
+                version = fingerprints.identify(game_root)
+                if version is None:
+                    raise ValueError(f"Couldn't identify the game version at {game_root}. Are you sure that's a path to NSMBW?"
+                        ' (If so, you can specify its version with --game-root-as.)')
+                else:
+                    print(f'Found {version} NSMBW at {game_root}')
+                    game_roots[version] = game_root
+
+            for version, game_root in args.game_root_as or []:
+                version = version.upper()
+                if version not in VERSIONS:
+                    raise ValueError(f'Unknown game version: {version!r}')
+                fingerprints.remember(Path(game_root), version)
+                print(f'Using {game_root} as {version} NSMBW')
+                game_roots[version] = Path(game_root)
+        else:
+            print('WARNING: No game roots specified -- patched assets will not be built!')
+
+        self = cls()
+        self.db = db
+        self.kamek_dir = args.kamek.resolve()
+        self.cw_dir = args.cw.resolve()
+        self.cw_server = args.cw_server.resolve() if args.cw_server else None
+        self.object_cache_dir = args.object_cache.resolve() if args.object_cache else None
+        self.artifact_cache_dir = args.artifact_cache.resolve() if args.artifact_cache else None
+        self.credits_jobs = args.credits_jobs
+        self.unity = args.unity
+        self.pch = args.pch
+        self.link_mode = args.link_mode
+        self.game_roots = {k: v.resolve() for k, v in game_roots.items()}
+        self.fingerprints = fingerprints
+        self.bugfixes = BugfixSelection.from_choices(db, args.default or 'on', args.tag_default, args.bug)
+        self.presets = None
+        if args.presets is not None:
+            if args.default is not None or args.tag_default or args.bug:
+                raise ValueError('--presets can\'t be combined with --default, --tag-default or --bug')
+            self.presets = load_presets(db, args.presets)
+
+        self.input_files = {
+            Path(__file__),
+            Path(db_lib.__file__),
+            db_lib.DEFAULT_DB_PATH,
+            Path(game_fingerprint.__file__),
+            Path(nsmbw_constants.__file__),
+        }
+        if args.presets is not None:
+            self.input_files.add(args.presets)
+
+        return self
+
+    def iter_bugfix_selections(self) -> Iterator[tuple[str | None, BugfixSelection]]:
+        """
+        Iterate over (preset name, bugfix selection) pairs for
+        everything that should be built. The preset name is None if
+        presets aren't being used.
+        """
+        if self.presets is None:
+            yield None, self.bugfixes
+        else:
+            yield from self.presets.items()
+
     @property
     def xml_template_path(self) -> Path:
         # This is an intermediate output path, so the exact choice here
@@ -265,6 +446,26 @@ class Config:
         addr_str = build_nsmbw_sh[static_idx + 8 : static_idx + 18]
         return int(addr_str, 16)
 
+    def with_artifact_cache(self, command: str, inputs: list[str], manifests: list[str] | None = None) -> str:
+        """
+        Wrap a Ninja rule command with the artifact cache, if enabled.
+        `inputs` must list every file the command reads (as Ninja
+        strings), and the rule's outputs must be exactly $out.
+        `manifests` lists inputs that are JSON files containing paths,
+        which are normalized before being hashed.
+        """
+        if self.artifact_cache_dir is None:
+            return command
+
+        quote = '"' if sys.platform == 'win32' else "'"
+        # (Ninja runs commands from the project directory)
+        launcher = (f"{quote}$py{quote} {ninja_escape(CODE_ARTIFACT_CACHE)}"
+            f" --cache-dir {quote}{ninja_escape(self.artifact_cache_dir)}{quote}"
+            f" --base-dir . --inputs {' '.join(inputs)} --outputs $out")
+        if manifests:
+            launcher += f" --manifests {' '.join(manifests)}"
+        return f'{launcher} -- {command}'
+
 
 ########################################################################
 ################################# Code #################################
@@ -276,6 +477,25 @@ CODE_NINJA_FILE = CODE_ROOT_DIR / 'build.ninja'
 CODE_TEMPLATE_REPO_DIR = CODE_ROOT_DIR / 'Kamek-Ninja-Template'
 CODE_CONFIGURE_SCRIPT = CODE_TEMPLATE_REPO_DIR / 'configure.py'
 CODE_CW_WRAPPER = CODE_TEMPLATE_REPO_DIR / 'cw_wrapper.py'
+CODE_ARTIFACT_CACHE = CODE_TEMPLATE_REPO_DIR / 'artifact_cache.py'
+# Headers included by (nearly) every source file, which are worth
+# precompiling
+CODE_PCH_HEADERS = ['kamek.h', 'k_sdk/types.h', 'nsmbwup_common.h', 'nsmbwup_user_config.h']
+
+
+def load_code_template() -> types.ModuleType:
+    """
+    Import the code template's configure.py as a module
+    """
+    # It imports its sibling modules (address_map, etc.) by name
+    template_dir = str(CODE_TEMPLATE_REPO_DIR.resolve())
+    if template_dir not in sys.path:
+        sys.path.append(template_dir)
+
+    spec = importlib.util.spec_from_file_location('kamek_ninja_template_configure', CODE_CONFIGURE_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
 
 
 def make_code_rules(config: Config) -> str:
@@ -289,30 +509,47 @@ def make_code_rules(config: Config) -> str:
     # Project code files: built using the project template; we don't
     # actually touch CodeWarrior or Kamek ourselves
 
-    # The goal here is to detect the following cases:
-    # - Bug is unselected: add "BUGNAME_OFF" flag
-    # - Bug is selected (True): the default behavior, no flag needed
-    # - Bug is selected (some other str): add "BUGNAME_CHOICENAME" flag
-    selected_bugfixes = config.get_selected_bugfixes()
-    bug_flags = set()
-    for id in config.db.entries.keys():
-        choice = selected_bugfixes.get(id, False)
-        if isinstance(choice, bool):
-            if not choice:
-                bug_flags.add(f'{id}_OFF')
-        else:
-            bug_flags.add(f'{id}_{choice.upper()}')
-
-    # Run the code template's separate configure.py script
-    proc = subprocess.run([sys.executable, str(CODE_CONFIGURE_SCRIPT),
-        '--kamek', str(config.kamek_dir),
-        '--cw', str(config.cw_dir),
-        '--project-dir', str(CODE_ROOT_DIR),
-        '--output-dir', str(RIIVO_DISC_CODE),
-        *[f'-DNSMBWUP_{bf}' for bf in sorted(bug_flags)],
-    ])
-    if proc.returncode != 0:
-        exit(proc.returncode)
+    # Run the code template's configure.py, in-process
+    template = load_code_template()
+
+    extra_cflags = []
+    variants = None
+    if config.presets is None:
+        bug_flags = config.bugfixes.get_bug_flags(config.db)
+        extra_cflags = [f'-DNSMBWUP_{bf}' for bf in sorted(bug_flags)]
+    else:
+        # Build each preset as a separate variant. The template only
+        # compiles files once if they come out the same in multiple
+        # presets.
+        variants = []
+        for preset, selection in config.iter_bugfix_selections():
+            variants.append(template.Variant(preset,
+                in_preset_dir(RIIVO_DISC_CODE, preset).resolve(),
+                [f'-DNSMBWUP_{bf}' for bf in sorted(selection.get_bug_flags(config.db))]))
+
+    # Bugs that aren't present in a game version at all can be turned off
+    # for its static builds, regardless of the selection
+    version_cflags = {}
+    for version in VERSIONS:
+        version_cflags[version] = [f'-DNSMBWUP_{id}_OFF' for id, entry in config.db.entries.items() if not entry.applies_to(version)]
+
+    code_config = template.Config.create(config.kamek_dir, config.cw_dir,
+        project_dir=CODE_ROOT_DIR,
+        output_dir=RIIVO_DISC_CODE,
+        extra_cflags=extra_cflags,
+        cw_server=config.cw_server,
+        object_cache_dir=config.object_cache_dir,
+        artifact_cache_dir=config.artifact_cache_dir,
+        unity=config.unity,
+        pch_headers=CODE_PCH_HEADERS if config.pch else None,
+        link_mode=config.link_mode or template.LINK_MODES[0],
+        # Only pass each bugfix's flag to the files that check it, so
+        # that toggling one doesn't rebuild everything
+        scoped_define_prefixes=['NSMBWUP_'],
+        variants=variants,
+        version_cflags=version_cflags)
+    template.configure(code_config)
+    config.input_files |= code_config.input_files
 
     # Now we can just include the build.ninja it just created, as a
     # "subninja".
@@ -332,7 +569,12 @@ def make_code_rules(config: Config) -> str:
     quote = '"' if sys.platform == 'win32' else "'"
 
     cc = CODE_CW_WRAPPER
-    cc = f"{ninja_escape(sys.executable)} {quote}{ninja_escape(cc)}{quote} {quote}$mwcceppc{quote}"
+    cc = f"{ninja_escape(sys.executable)} {quote}{ninja_escape(cc)}{quote} --build-dir {quote}$builddir{quote}"
+    if config.cw_server is not None:
+        cc += f" --server {quote}{ninja_escape(config.cw_server)}{quote}"
+    if config.object_cache_dir is not None:
+        cc += f" --cache-dir {quote}{ninja_escape(config.object_cache_dir)}{quote}"
+    cc += f" {quote}$mwcceppc{quote}"
 
     lines.append(f"""
 mwcceppc = {ninja_escape(config.mwcceppc_exe)}
@@ -364,6 +606,7 @@ rule mwcc
 """.strip('\n'))
 
     cpp_files = set(config.loader_dir.glob('*.cpp'))
+    config.input_files |= {config.loader_dir, config.loader_dir / 'build_nsmbw.sh'}
 
     # Add "mwcc" edges for all .cpp -> .o files
     for cpp_file in cpp_files:
@@ -376,25 +619,35 @@ rule mwcc
         lines.append(f'  out_shortname = {ninja_escape(o_file.name)}')
         lines.append(f'  in_shortname = {ninja_escape(cpp_file.name)}')
 
+    kmstatic_command = config.with_artifact_cache(
+        f'{quote}$kamek{quote} $in -static=$baseaddr -input-riiv=$inxml -output-riiv=$outxml -output-code=$outbin -valuefile=$outbin_disc -quiet',
+        ['$in', '$inxml', f'{quote}$kamek{quote}'])
+
     lines.append(f"""
 rule kmstatic
-  command = {quote}$kamek{quote} $in -static=$baseaddr -input-riiv=$inxml -output-riiv=$outxml -output-code=$outbin -valuefile=$outbin_disc -quiet
+  command = {kmstatic_command}
   description = {ninja_escape(config.kamek_exe.name)} -> $outxml_filename + $outbin_filename
 """.strip('\n'))
 
-    # Add a "kmstatic" edge for loader.bin
-    lines.append(f'build $outdir/{ninja_escape(RIIVO_XML.relative_to(OUTPUT_DIR))} {ninja_escape(RIIVO_DISC_CODE_LOADER)}: kmstatic')
-    for cpp_file in cpp_files:
-        o_file = cpp_file.with_suffix('.o')
-        lines[-1] += f' {ninja_escape(o_file)}'
-    lines.append(f'  inxml = {ninja_escape(config.xml_template_path)}')
-    lines.append(f'  outxml = $outdir/{ninja_escape(RIIVO_XML.relative_to(OUTPUT_DIR))}')
-    lines.append(f'  outxml_filename = {ninja_escape(RIIVO_XML.name)}')
-    lines.append(f'  outbin = {ninja_escape(RIIVO_DISC_CODE_LOADER)}')
-    lines.append(f'  outbin_filename = {ninja_escape(RIIVO_DISC_CODE_LOADER.name)}')
-    lines.append(f'  outbin_disc = {ninja_escape(RIIVO_DISC_CODE_LOADER.relative_to(RIIVO_DISC_ROOT).as_posix())}')
-    lines.append(f'  baseaddr = $loaderaddr')
-    
+    # Add a "kmstatic" edge for loader.bin (for each preset -- the
+    # loader doesn't depend on the bugfix selection, so the .o files are
+    # shared)
+    for preset, _ in config.iter_bugfix_selections():
+        riivo_xml = in_preset_dir(RIIVO_XML, preset)
+        loader_bin = in_preset_dir(RIIVO_DISC_CODE_LOADER, preset)
+
+        lines.append(f'build $outdir/{ninja_escape(riivo_xml.relative_to(OUTPUT_DIR))} {ninja_escape(loader_bin)}: kmstatic')
+        for cpp_file in cpp_files:
+            o_file = cpp_file.with_suffix('.o')
+            lines[-1] += f' {ninja_escape(o_file)}'
+        lines.append(f'  inxml = {ninja_escape(config.xml_template_path)}')
+        lines.append(f'  outxml = $outdir/{ninja_escape(riivo_xml.relative_to(OUTPUT_DIR))}')
+        lines.append(f'  outxml_filename = {ninja_escape(riivo_xml.name)}')
+        lines.append(f'  outbin = {ninja_escape(loader_bin)}')
+        lines.append(f'  outbin_filename = {ninja_escape(loader_bin.name)}')
+        lines.append(f'  outbin_disc = {ninja_escape(RIIVO_DISC_CODE_LOADER.relative_to(RIIVO_DISC_ROOT).as_posix())}')
+        lines.append(f'  baseaddr = $loaderaddr')
+
     return '\n'.join(lines)
 
 
@@ -404,6 +657,17 @@ rule kmstatic
 
 
 CREDITS_PY = Path('credits/credits.py')
+# Everything that credits.py runs (including the FIXES registry), so
+# that editing any of it rebuilds the credits
+CREDITS_TOOL_FILES = [
+    CREDITS_PY,
+    CREDITS_PY.parent / 'staffroll_patch.py',
+    CREDITS_PY.parent / 'nsmbw-staffroll-tool' / 'staffroll_lib.py',
+]
+CREDITS_JOBS_FILE = BUILD_DIR / 'credits_jobs.json'
+# Bugs in the region-specific folders (see readme_bug_organization.md)
+# are the only ones that can affect staffroll.bin
+CREDITS_BUG_CATEGORIES = 'P'
 
 
 def make_credits_rules(config: Config) -> str:
@@ -415,12 +679,25 @@ def make_credits_rules(config: Config) -> str:
 
     quote = '"' if sys.platform == 'win32' else "'"
 
+    credits_command = f'{quote}$py{quote} {ninja_escape(CREDITS_PY)} --batch $jobsfile'
+    if config.credits_jobs is not None:
+        credits_command += f' --jobs {config.credits_jobs}'
+    credits_command = config.with_artifact_cache(credits_command,
+        ['$in', *(ninja_escape(f) for f in CREDITS_TOOL_FILES)],
+        ['$jobsfile'])
+
     lines = [f"""
 rule credits
-  command = {quote}$py{quote} {CREDITS_PY} $in $out $bugs
+  command = {credits_command}
   description = Editing credits...
 """.strip('\n')]
 
+    # Staffroll files are often byte-identical across languages and
+    # versions, so each job is keyed by the input file's contents and
+    # the bugs that can affect it, and runs only once, writing its
+    # output to every place it's needed.
+    # {(input hash, bugs): (input path, [output paths])}
+    jobs = {}
     already_covered_staffrolls = set()
 
     for version, root in config.game_roots.items():
@@ -433,22 +710,58 @@ rule credits
             staffroll_fp = possible_parent / 'staffroll' / 'staffroll.bin'
             if staffroll_fp.is_file():
                 staffrolls.append(staffroll_fp)
+        config.input_files.add(lang_folder)
 
         if not staffrolls:
             raise ValueError(f"Couldn't find a single staffroll.bin in {lang_folder}...")
 
-        # Add build edges
         for staffroll in staffrolls:
             staffroll_relative = staffroll.relative_to(root)
 
             if staffroll_relative in already_covered_staffrolls:
                 continue
 
-            target_dir = f'$outdir/{ninja_escape((RIIVO_DISC_ROOT / staffroll_relative).relative_to(OUTPUT_DIR))}'
-            lines.append(f'build {target_dir}: credits {ninja_escape(staffroll)}')
+            staffroll_hash = config.fingerprints.file_hash(staffroll)
+            for preset, selection in config.iter_bugfix_selections():
+                target = in_preset_dir(RIIVO_DISC_ROOT / staffroll_relative, preset)
+
+                # If none of the selected bugs are present in this
+                # version, the original file can be used as-is. There's
+                # no build edge for it in that case, so remove any
+                # patched copy left behind by an earlier configuration
+                # (the Riivolution XML would pick it up otherwise).
+                bugs = selection.get_bugs_arg(config.db, CREDITS_BUG_CATEGORIES, version)
+                if not bugs:
+                    target.unlink(missing_ok=True)
+                    continue
+
+                jobs.setdefault((staffroll_hash, bugs), (staffroll, []))[1].append(target)
 
             already_covered_staffrolls.add(staffroll_relative)
 
+    if not jobs:
+        return '\n'.join(lines)
+
+    # All of the jobs are run by a single credits.py process (with a
+    # pool of workers), to avoid starting Python over and over again
+    write_file_if_changed(CREDITS_JOBS_FILE, json.dumps([
+        {'input': str(staffroll), 'outputs': [str(t) for t in targets], 'bugs': bugs.split()}
+        for (_, bugs), (staffroll, targets) in jobs.items()
+    ], indent=4))
+
+    all_staffrolls = []
+    all_targets = []
+    for staffroll, targets in jobs.values():
+        if staffroll not in all_staffrolls:
+            all_staffrolls.append(staffroll)
+        all_targets.extend(targets)
+
+    lines.append(f'build {" ".join(f"$outdir/{ninja_escape(t.relative_to(OUTPUT_DIR))}" for t in all_targets)}: credits'
+        + ''.join(f' {ninja_escape(s)}' for s in all_staffrolls)
+        + f' {ninja_escape(CREDITS_JOBS_FILE)}'
+        + ' |' + ''.join(f' {ninja_escape(f)}' for f in CREDITS_TOOL_FILES))
+    lines.append(f'  jobsfile = {ninja_escape(CREDITS_JOBS_FILE)}')
+
     return '\n'.join(lines)
 
 
@@ -482,16 +795,49 @@ build {ninja_escape(config.xml_template_path)}: riixml
 NINJA_FILE = Path('build.ninja')
 
 
+def make_regeneration_rules(config: Config) -> str:
+    """
+    Create Ninja rules to re-run this script with the same arguments
+    whenever any of its inputs change
+    """
+    quote = '"' if sys.platform == 'win32' else "'"
+
+    inputs = set()
+    for path in config.input_files:
+        try:
+            inputs.add(str(path.resolve().relative_to(Path.cwd())))
+        except ValueError:
+            inputs.add(str(path.resolve()))
+    inputs = sorted(inputs)
+
+    lines = [f"""
+rule configure
+  command = {quote}$py{quote} {ninja_escape(Path(__file__).name)} --regenerate
+  description = Re-running {ninja_escape(Path(__file__).name)}...
+  generator = 1
+""".strip('\n')]
+
+    lines.append(f'build {ninja_escape(NINJA_FILE)} {ninja_escape(CODE_NINJA_FILE)}: configure | '
+        + ' '.join(ninja_escape(i) for i in inputs))
+    lines.append('')
+
+    # If an input is deleted, this makes Ninja re-run configure.py
+    # instead of stopping with an error
+    for i in inputs:
+        lines.append(f'build {ninja_escape(i)}: phony')
+
+    return '\n'.join(lines)
+
+
 def make_ninja_file(config: Config) -> str:
     """
     Make the overall Ninja file
     """
-    bug_items = []
-    for k, v in config.get_selected_bugfixes().items():
-        if isinstance(v, str):
-            bug_items.append(f'{k}={v}')
-        else:
-            bug_items.append(k)
+    # (The regeneration rules have to be made last, since they depend on
+    # everything the others looked at)
+    riixml_rules = make_riivolution_xml_template_rules(config)
+    code_rules = make_code_rules(config)
+    credits_rules = make_credits_rules(config)
 
     txt = f"""
 # NOTE: This file is generated by {Path(__file__).name}.
@@ -502,11 +848,10 @@ py = {sys.executable}
 builddir = {BUILD_DIR}
 outdir = {OUTPUT_DIR}
 
-bugs = {' '.join(sorted(bug_items))}
-
-{make_riivolution_xml_template_rules(config)}
-{make_code_rules(config)}
-{make_credits_rules(config)}
+{riixml_rules}
+{code_rules}
+{credits_rules}
+{make_regeneration_rules(config)}
 """.strip('\n')
 
     while '\n\n\n' in txt:
@@ -524,12 +869,30 @@ def main(argv: list[str] | None = None) -> None:
 
     parser = argparse.ArgumentParser(
         description=f'Configure {PROJECT_DISPLAY_NAME} to prepare for building.')
+    parser.add_argument('--regenerate', action='store_true',
+        help=f'run again with the same arguments as last time (saved in {CONFIGURE_ARGS_FILE}).'
+        ' build.ninja does this automatically whenever any of the files it was generated from change.')
     Config.set_up_arg_parser(db, parser)
 
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if '--regenerate' in argv:
+        if len(argv) != 1:
+            raise ValueError("--regenerate can't be combined with other arguments")
+        try:
+            argv = json.loads(CONFIGURE_ARGS_FILE.read_text(encoding='utf-8'))['argv']
+        except (OSError, ValueError, KeyError):
+            raise ValueError(f"Couldn't read {CONFIGURE_ARGS_FILE} -- please run {Path(__file__).name} with the full set of arguments again")
+
     args = parser.parse_args(argv)
     config = Config.from_args(db, args)
 
     NINJA_FILE.write_text(make_ninja_file(config), encoding='utf-8')
+    config.fingerprints.save()
+
+    CONFIGURE_ARGS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    CONFIGURE_ARGS_FILE.write_text(json.dumps({'argv': argv}, indent=4), encoding='utf-8')
 
 
 if __name__ == '__main__':
@@ -24,44 +24,137 @@
 
 
 import argparse
+import concurrent.futures
+import functools
+import json
+import os
 from pathlib import Path
-import subprocess
-import sys
-import tempfile
-from typing import Set
+import shutil
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
 
+import staffroll_patch
 
-def fix_caety_sagoian(txt: str, bugs: Set[str]) -> str:
+
+# Fixes for bugs in staffroll.bin: {bug ID: [(pattern, replacement), ...]}.
+# Patterns and replacements are written in the text format, with
+# formatting tags only at the beginning and end (see staffroll_patch.py).
+# Which game versions each bug is present in is recorded in db.txt, and
+# configure.py only passes the bugs that apply to each file.
+FIXES = {
+    # Voice actress Caety Sagoian's name is misspelled as "Catey
+    # Sagoian" in P1, E1, J1, P2, E2, J2, P3, J3, and C. This is fixed
+    # in K and W.
+    'P00000': [('Catey Sagoian', 'Caety Sagoian')],
+
+    # The "SOUND EFFECTS" section is mis-titled as "SOUND EFFECT" in the
+    # C release. The C staffroll is otherwise identical to the J
+    # version, indicating that the devs grabbed a very slightly outdated
+    # version of the v1 credits file for this release.
+    'P00100': [('<bold>SOUND EFFECT</bold>', '<bold>SOUND EFFECTS</bold>')],
+}
+
+
+@functools.lru_cache
+def compile_fixes(bugs: FrozenSet[str]) -> Tuple[List[str], staffroll_patch.PatchSet]:
     """
-    Voice actress Caety Sagoian's name is misspelled as "Catey Sagoian"
-    in P1, E1, J1, P2, E2, J2, P3, J3, and C. This is fixed in K and W.
+    Compile the fixes for a set of bugs into a single PatchSet, which
+    applies all of them in one pass. Also returns the bug ID for each
+    patch in it.
     """
-    if 'P00000' in bugs:
-        return txt.replace('Catey Sagoian', 'Caety Sagoian')
-    else:
-        return txt
+    bug_ids = []
+    patches = []
+    for bug_id, fixes in FIXES.items():
+        if bug_id in bugs:
+            for fix in fixes:
+                bug_ids.append(bug_id)
+                patches.append(fix)
+    return bug_ids, staffroll_patch.PatchSet(patches)
 
 
-def fix_sound_effects(txt: str, bugs: Set[str]) -> str:
+def patch_staffroll(data: bytes, bugs: Set[str]) -> Tuple[Optional[bytes], Dict[str, int]]:
     """
-    The "SOUND EFFECTS" section is mis-titled as "SOUND EFFECT" in the
-    C release. The C staffroll is otherwise identical to the J version,
-    indicating that the devs grabbed a very slightly outdated version of
-    the v1 credits file for this release.
+    Apply fixes to the contents of a staffroll.bin. Returns the new
+    contents (or None if nothing needed to be changed), and the number
+    of replacements made for each bug.
     """
-    if 'P00100' in bugs:
-        return txt.replace('<bold>SOUND EFFECT</bold>', '<bold>SOUND EFFECTS</bold>')
-    else:
-        return txt
+    bug_ids, patch_set = compile_fixes(frozenset(bugs))
+    if not bug_ids:
+        return None, {}
+
+    staffroll = staffroll_patch.StaffrollBuffer(data)
+    counts = {}
+    for bug_id, count in zip(bug_ids, staffroll.apply(patch_set)):
+        counts[bug_id] = counts.get(bug_id, 0) + count
+
+    if staffroll.data == data:
+        return None, counts
+
+    return bytes(staffroll.data), counts
+
+
+def run_job(input_file: Path, output_files: List[Path], bugs: Set[str], verbose: bool = False) -> None:
+    """
+    Patch one staffroll.bin, and write the result to every output path
+    (or delete them all if no modifications are made)
+    """
+    new_data, counts = patch_staffroll(input_file.read_bytes(), bugs)
+
+    if verbose:
+        matched = ', '.join(f'{bug_id} ({count}x)' for bug_id, count in counts.items() if count)
+        print(f'{input_file}: {matched or "no fixes matched"}')
+
+    if new_data is None:
+        for output_file in output_files:
+            output_file.unlink(missing_ok=True)
+        return
+
+    # Write the file once, and hardlink it everywhere else it's needed
+    # (or copy it, if the filesystem doesn't allow that). Everything goes
+    # through a temp file and os.replace(), so that outputs that were
+    # linked together by a previous build aren't overwritten in place.
+    first_output = output_files[0]
+    for output_file in output_files:
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = output_file.with_name(output_file.name + '.tmp')
+        temp_path.unlink(missing_ok=True)
+
+        if output_file == first_output:
+            temp_path.write_bytes(new_data)
+        else:
+            try:
+                os.link(first_output, temp_path)
+            except OSError:
+                shutil.copyfile(first_output, temp_path)
+
+        os.replace(temp_path, output_file)
 
 
-def fix_staffroll_txt(txt: str, bugs: Set[str]) -> str:
+def run_batch(jobs_file: Path, num_workers: Optional[int] = None, verbose: bool = False) -> None:
     """
-    Apply fixes to the text-file representation of staffroll.bin.
+    Run every job listed in a .json file like
+    [{"input": "...", "outputs": ["...", ...], "bugs": ["...", ...]}, ...],
+    with a pool of worker processes
     """
-    txt = fix_caety_sagoian(txt, bugs)
-    txt = fix_sound_effects(txt, bugs)
-    return txt
+    jobs = []
+    for job in json.loads(jobs_file.read_text(encoding='utf-8')):
+        jobs.append((Path(job['input']), [Path(o) for o in job['outputs']], set(job['bugs']), verbose))
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(jobs))
+
+    # Starting worker processes isn't free, so don't bother if there's
+    # nothing to run in parallel
+    if num_workers <= 1:
+        for job in jobs:
+            run_job(*job)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+        futures = [executor.submit(run_job, *job) for job in jobs]
+        for future in futures:
+            # (Re-raises any exception from the worker)
+            future.result()
 
 
 def main(argv=None) -> None:
@@ -71,47 +164,31 @@ def main(argv=None) -> None:
     parser = argparse.ArgumentParser(
         description='Apply bugfixes to the credits file (staffroll.bin).')
 
-    parser.add_argument('input_file', type=Path,
+    parser.add_argument('input_file', type=Path, nargs='?',
         help='input staffroll.bin')
-    parser.add_argument('output_file', type=Path,
+    parser.add_argument('output_file', type=Path, nargs='?',
         help='output staffroll.bin (will be *deleted* instead of written if no modifications are made)')
     parser.add_argument('bugs', nargs='*',
         help='set of bugs to fix')
+    parser.add_argument('--batch', type=Path, metavar='JOBS_FILE',
+        help='instead of the above, patch every staffroll.bin listed in this .json file'
+        ' (a list of {"input": ..., "outputs": [...], "bugs": [...]} objects)')
+    parser.add_argument('--jobs', '-j', type=int, metavar='N',
+        help='number of worker processes to use with --batch (default: number of CPUs)')
+    parser.add_argument('--verbose', '-v', action='store_true',
+        help='print which fixes matched in each file')
 
     args = parser.parse_args(argv)
 
-    here = Path(__file__).parent
-    staffroll_tool = here / 'nsmbw-staffroll-tool' / 'staffroll.py'
+    if args.batch is not None:
+        if args.input_file is not None:
+            parser.error('--batch can\'t be combined with input/output files')
+        run_batch(args.batch, args.jobs, args.verbose)
 
-    with tempfile.TemporaryDirectory() as tempdir:
-        temp_dir = Path(tempdir)
-        temp_file = temp_dir / 'staffroll.bin'
-
-        # Convert .bin -> .txt
-        subprocess.run([
-            sys.executable,
-            str(staffroll_tool),
-            str(args.input_file),
-            str(temp_file),
-            '--type=bin'])
-
-        # Edit the .txt
-        staffroll_txt = temp_file.read_text(encoding='utf-8')
-        staffroll_txt_2 = fix_staffroll_txt(staffroll_txt, set(args.bugs))
-
-        if staffroll_txt == staffroll_txt_2:
-            args.output_file.unlink(missing_ok=True)
-
-        else:
-            temp_file.write_text(staffroll_txt_2, encoding='utf-8')
-
-            # Convert .txt -> .bin
-            subprocess.run([
-                sys.executable,
-                str(staffroll_tool),
-                str(temp_file),
-                str(args.output_file),
-                '--type=txt'])
+    else:
+        if args.output_file is None:
+            parser.error('an input file and output file are required (or --batch)')
+        run_job(args.input_file, [args.output_file], set(args.bugs), args.verbose)
 
 
 if __name__ == '__main__':
@@ -15,9 +15,12 @@
 # You should have received a copy of the GNU General Public License
 # along with Staffroll Tool.  If not, see <https://www.gnu.org/licenses/>.
 
+import array
+import codecs
 import enum
-import io
+import re
 import struct
+import sys
 
 
 class Contents(enum.IntEnum):
@@ -55,6 +58,68 @@ class Tag(enum.Enum):
 END_TAGS = set([Tag.END_BOLD, Tag.END_FORCE_COIN, Tag.END_NO_COIN, Tag.END_UNBREAKABLE])
 
 
+# Byte translation tables used by decodeCharFields() to pick apart
+# every character's fields at once. A character's formatting is
+# summarized as a one-byte "key": 0x20 for copyright symbols, or else
+# 0x10 for bold, ORed with the "block contents" value.
+COPYRIGHT_KEY = 0x20
+KEY_FLAGS_TABLE = bytes(COPYRIGHT_KEY if b & 0x20 else b & 0x10 for b in range(256))
+KEY_CONTENTS_TABLE = bytes(min(max(Contents), b & 0xF) for b in range(256))
+KEY_NORMALIZE_TABLE = bytes(COPYRIGHT_KEY if b & COPYRIGHT_KEY else b for b in range(256))
+CODEPOINT_HIGH_TABLE = bytes((b & 0xF) << 4 for b in range(256))
+CODEPOINT_LOW_TABLE = bytes(b >> 4 for b in range(256))
+CODEPOINT_DECODING_TABLE = ''.join(chr(b + 32) for b in range(256))
+
+# Matches runs of identical bytes
+RUN_REGEX = re.compile(rb'(.)\1*', re.DOTALL)
+
+# array.array('I') data containing codepoints can be decoded as UTF-32
+# in the machine's native byte order
+CODEPOINTS_ENCODING = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+
+# Characters with codepoints below 32 can't be represented in
+# staffroll.bin
+UNREPRESENTABLE_CHARS_REGEX = re.compile('[\x00-\x1f]')
+
+
+def decodeWords(data):
+    """
+    Convert big-endian binary data to an array of 32-bit values
+    """
+    words = array.array('I')
+    words.frombytes(data)
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return words
+
+
+def decodeCharFields(data):
+    """
+    Split big-endian char data values into each character's formatting
+    key (as a bytes object) and the text (as a str). The fields are
+    picked out of the individual bytes of the data, for all characters
+    at once.
+    """
+    num_chars = len(data) // 4
+
+    def combine(a, b):
+        """
+        Bitwise-OR two equal-length bytes objects together
+        """
+        return (int.from_bytes(a, 'big') | int.from_bytes(b, 'big')).to_bytes(num_chars, 'big')
+
+    keys = combine(
+        data[0::4].translate(KEY_FLAGS_TABLE),
+        data[3::4].translate(KEY_CONTENTS_TABLE),
+    ).translate(KEY_NORMALIZE_TABLE)
+
+    text, _ = codecs.charmap_decode(combine(
+        data[2::4].translate(CODEPOINT_HIGH_TABLE),
+        data[3::4].translate(CODEPOINT_LOW_TABLE),
+    ), 'strict', CODEPOINT_DECODING_TABLE)
+
+    return keys, text
+
 
 class StaffrollLine:
     """
@@ -77,6 +142,35 @@ class StaffrollLine:
         if hdr == 0xFFFFFFFF:
             return None
 
+        num_chars, = struct.unpack_from('>I', f.read(4))
+        char_data = f.read(4 * num_chars)
+        if len(char_data) != 4 * num_chars:
+            raise ValueError('Unexpected end of staffroll.bin data')
+
+        return cls.fromCharData(hdr, char_data)
+
+
+    @classmethod
+    def fromCharData(cls, indent, char_data):
+        """
+        Create a line from its indentation value and its char data
+        (big-endian 32-bit values, one per character, containing the
+        codepoint as well as formatting metadata)
+        """
+        return cls.fromCharFields(indent, *decodeCharFields(char_data))
+
+
+    @classmethod
+    def fromCharFields(cls, indent, keys, text):
+        """
+        Create a line from its indentation value and its characters'
+        formatting keys and text, as returned by decodeCharFields()
+        """
+        # Rather than checking every character's formatting one at a
+        # time, split the line into runs of characters with the same
+        # formatting (or copyright symbols), and handle each run as a
+        # whole.
+
         # We're going to build up the parts list. We need to keep track
         # of the current text formatting state at all times, so we can
         # recognize changes and insert tags appropriately.
@@ -84,80 +178,95 @@ class StaffrollLine:
         bold = False
         contents = Contents.RANDOM
 
-        # current_str is a list of character codepoints
+        # current_str is a list of strs
         current_str = []
         def flush_current_str():
             """
-            Convert current_str to an actual str, put it in the parts
+            Convert current_str to a single str, put it in the parts
             list, and clear it
             """
-            nonlocal current_str
             if current_str:
-                parts.append(''.join(chr(c) for c in current_str))
+                parts.append(''.join(current_str))
                 current_str.clear()
 
-        num_chars, = struct.unpack_from('>I', f.read(4))
-        for j in range(num_chars):
-            # This contains the codepoint as well as formatting metadata
-            char_data, = struct.unpack_from('>I', f.read(4))
-
-            if char_data & 0x20000000:
-                parts.append(Tag.COPYRIGHT)
-
-            else:
-                new_bold     = char_data & 0x10000000
-                new_contents = Contents(min(max(Contents), char_data & 0xF))
-
-                # Insert a tag if anything changed
-                if new_bold and not bold:
-                    flush_current_str()
-                    parts.append(Tag.BEGIN_BOLD)
-                elif bold and not new_bold:
-                    flush_current_str()
-                    parts.append(Tag.END_BOLD)
-
-                if new_contents != contents:
-                    flush_current_str()
-
-                    # End previous contents tag
-                    if contents == Contents.FORCE_COIN:
-                        parts.append(Tag.END_FORCE_COIN)
-                    elif contents == Contents.NO_COIN:
-                        parts.append(Tag.END_NO_COIN)
-                    elif contents == Contents.UNBREAKABLE:
-                        parts.append(Tag.END_UNBREAKABLE)
-
-                    # Begin new contents tag
-                    if new_contents == Contents.FORCE_COIN:
-                        parts.append(Tag.BEGIN_FORCE_COIN)
-                    elif new_contents == Contents.NO_COIN:
-                        parts.append(Tag.BEGIN_NO_COIN)
-                    elif new_contents == Contents.UNBREAKABLE:
-                        parts.append(Tag.BEGIN_UNBREAKABLE)
-
-                # Add the codepoint to the list
-                current_str.append(((char_data >> 4) & 0xFF) + 32)
-
-                # Keep track of the new character formatting options for
-                # next time
-                bold, contents = new_bold, new_contents
+        for run in RUN_REGEX.finditer(keys):
+            start, end = run.span()
+            key = keys[start]
+
+            if key == COPYRIGHT_KEY:
+                # (Note that this intentionally doesn't flush
+                # current_str, for consistency with the original
+                # character-by-character implementation)
+                parts.extend([Tag.COPYRIGHT] * (end - start))
+                continue
+
+            new_bold     = bool(key & 0x10)
+            new_contents = Contents(key & 0xF)
+
+            # Insert a tag if anything changed
+            if new_bold and not bold:
+                flush_current_str()
+                parts.append(Tag.BEGIN_BOLD)
+            elif bold and not new_bold:
+                flush_current_str()
+                parts.append(Tag.END_BOLD)
+
+            if new_contents != contents:
+                flush_current_str()
+
+                # End previous contents tag
+                if contents == Contents.FORCE_COIN:
+                    parts.append(Tag.END_FORCE_COIN)
+                elif contents == Contents.NO_COIN:
+                    parts.append(Tag.END_NO_COIN)
+                elif contents == Contents.UNBREAKABLE:
+                    parts.append(Tag.END_UNBREAKABLE)
+
+                # Begin new contents tag
+                if new_contents == Contents.FORCE_COIN:
+                    parts.append(Tag.BEGIN_FORCE_COIN)
+                elif new_contents == Contents.NO_COIN:
+                    parts.append(Tag.BEGIN_NO_COIN)
+                elif new_contents == Contents.UNBREAKABLE:
+                    parts.append(Tag.BEGIN_UNBREAKABLE)
+
+            # Add the run's text
+            current_str.append(text[start:end])
+
+            # Keep track of the new character formatting options for
+            # next time
+            bold, contents = new_bold, new_contents
 
         # Flush any remaining text data
         flush_current_str()
 
-        return cls(hdr, parts)
+        return cls(indent, parts)
 
 
     def saveToBinFile(self, f):
         """
         Write this line to the provided binary file object
         """
+        f.write(self.toBinData())
+
+
+    def toBinData(self):
+        """
+        Convert this line to binary data, as an array.array of 32-bit
+        values already in big-endian byte order
+        """
         self.delete_unrepresentable_chars()
 
         if self.indent < 0:
             print(f'WARNING: Line "{str(self)}" has negative offset (auto-clamping to 0)')
 
-        f.write(struct.pack('>II', max(0, self.indent), self.num_chars_and_copyrights))
+        # The line header is followed by one value per character, so
+        # the whole line can be allocated up front and filled in
+        num_chars = self.num_chars_and_copyrights
+        words = array.array('I', [0]) * (2 + num_chars)
+        words[0] = max(0, self.indent)
+        words[1] = num_chars
+        pos = 2
 
         # Need to keep track of these so we know what metadata to set on
         # each character
@@ -165,8 +274,17 @@ class StaffrollLine:
         contents = Contents.RANDOM
 
         for part in self.parts:
-            if part == Tag.COPYRIGHT:
-                f.write(b'\x20\0\0\0')
+            if isinstance(part, str):
+                flags = contents
+                if bold: flags |= 0x10000000
+
+                codepoints = array.array('I')
+                codepoints.frombytes(part.encode(CODEPOINTS_ENCODING))
+                words[pos : pos + len(codepoints)] = array.array('I', [((c - 32) << 4) | flags for c in codepoints])
+                pos += len(codepoints)
+            elif part == Tag.COPYRIGHT:
+                words[pos] = 0x20000000
+                pos += 1
             elif part == Tag.BEGIN_BOLD:
                 bold = True
             elif part == Tag.END_BOLD:
@@ -177,15 +295,12 @@ class StaffrollLine:
                 contents = Contents.NO_COIN
             elif part == Tag.BEGIN_UNBREAKABLE:
                 contents = Contents.UNBREAKABLE
-            elif isinstance(part, Tag) and part.is_end:
+            elif part.is_end:
                 contents = Contents.RANDOM
-            else: # string instance
-                for c in part:
-                    cval = (ord(c) - 32) << 4
-                    if bold: cval |= 0x10000000
-                    cval |= contents
 
-                    f.write(struct.pack('>I', cval))
+        if sys.byteorder == 'little':
+            words.byteswap()
+        return words
 
 
     @classmethod
@@ -369,7 +484,7 @@ class StaffrollLine:
         """
         for i, p in enumerate(self.parts):
             if isinstance(p, str):
-                self.parts[i] = ''.join(c for c in p if ord(c) >= 32)
+                self.parts[i] = UNREPRESENTABLE_CHARS_REGEX.sub('', p)
 
 
     @property
@@ -421,34 +536,60 @@ def readStaffrollBin(data):
     StaffrollLine objects and None's
     """
 
-    f = io.BytesIO(data)
+    # Decode the whole file's worth of 32-bit values at once (any
+    # trailing partial value is never needed)
+    words = decodeWords(data[:len(data) // 4 * 4])
+
+    # Likewise, decode the fields of every character in the file at
+    # once. (This treats the line headers as characters, too, but those
+    # values are never used.)
+    keys, text = decodeCharFields(data[:len(data) // 4 * 4])
+
+    if not words:
+        raise ValueError('Unexpected end of staffroll.bin data')
 
     lines = []
-    num_lines, = struct.unpack_from('>I', f.read(4))
+    num_lines = words[0]
+    pos = 1
     for i in range(num_lines):
-        lines.append(StaffrollLine.fromBinFile(f))
+        if pos >= len(words):
+            raise ValueError('Unexpected end of staffroll.bin data')
+        hdr = words[pos]
+
+        # FFFFFFFF indicates a blank line
+        if hdr == 0xFFFFFFFF:
+            lines.append(None)
+            pos += 1
+            continue
+
+        if pos + 1 >= len(words):
+            raise ValueError('Unexpected end of staffroll.bin data')
+        num_chars = words[pos + 1]
+        if pos + 2 + num_chars > len(words):
+            raise ValueError('Unexpected end of staffroll.bin data')
+
+        start, end = pos + 2, pos + 2 + num_chars
+        lines.append(StaffrollLine.fromCharFields(hdr, keys[start:end], text[start:end]))
+        pos += 2 + num_chars
 
     return lines
 
 
 def saveStaffrollBin(lines):
     """
-    Convert a list of StaffrollLine objects and None's to a bytes object
+    Convert a list of StaffrollLine objects and None's to a bytearray
     containing staffroll.bin
     """
 
-    f = io.BytesIO()
-
-    f.write(struct.pack('>I', len(lines)))
+    data = bytearray(struct.pack('>I', len(lines)))
 
     for line in lines:
         if line is None:
-            f.write(b'\xFF\xFF\xFF\xFF')
+            data += b'\xFF\xFF\xFF\xFF'
         else:
-            line.saveToBinFile(f)
+            data += line.toBinData()
 
-    f.seek(0)
-    return f.read()
+    return data
 
 
 def readStaffrollTxt(s):
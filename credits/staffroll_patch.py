@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2026 RoadrunnerWMC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+import bisect
+from pathlib import Path
+import re
+import struct
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+sys.path.append(str(Path(__file__).parent / 'nsmbw-staffroll-tool'))
+import staffroll_lib
+from staffroll_lib import Contents, Tag
+
+
+WORD = struct.Struct('>I')
+BLANK_LINE = 0xFFFFFFFF
+
+COPYRIGHT_FLAG = 0x20000000
+BOLD_FLAG = 0x10000000
+CONTENTS_MASK = 0xF
+
+BEGIN_CONTENTS_TAGS = {
+    Contents.FORCE_COIN: Tag.BEGIN_FORCE_COIN,
+    Contents.NO_COIN: Tag.BEGIN_NO_COIN,
+    Contents.UNBREAKABLE: Tag.BEGIN_UNBREAKABLE,
+}
+END_CONTENTS_TAGS = {
+    Contents.FORCE_COIN: Tag.END_FORCE_COIN,
+    Contents.NO_COIN: Tag.END_NO_COIN,
+    Contents.UNBREAKABLE: Tag.END_UNBREAKABLE,
+}
+
+# (bold, contents)
+CharState = Tuple[bool, Contents]
+LINE_START_STATE = (False, Contents.RANDOM)
+
+# Values above 3 in the "block contents" nybble act like 3
+CONTENTS_BY_NYBBLE = [Contents(min(max(Contents), i)) for i in range(CONTENTS_MASK + 1)]
+
+
+def decode_state(char_data: int) -> CharState:
+    """
+    Get the formatting state of a (non-copyright) character word, the
+    same way staffroll_lib does
+    """
+    return bool(char_data & BOLD_FLAG), CONTENTS_BY_NYBBLE[char_data & CONTENTS_MASK]
+
+
+def check_representable(text: str) -> None:
+    """
+    Raise ValueError if any of the characters can't be encoded in
+    staffroll.bin
+    """
+    for c in text:
+        if not 32 <= ord(c) < 32 + 0x100:
+            raise ValueError(f'Character {c!r} can\'t be represented in staffroll.bin')
+
+
+def encode_chars(text: str, state: CharState) -> bytes:
+    """
+    Encode characters as char_data words with the given formatting
+    """
+    check_representable(text)
+    bold, contents = state
+    flags = (BOLD_FLAG if bold else 0) | contents
+    return struct.pack(f'>{len(text)}I', *(((ord(c) - 32) << 4) | flags for c in text))
+
+
+def char_regex(c: str) -> bytes:
+    """
+    Create a regex that matches the char_data word for a character,
+    with any formatting (but not as a copyright symbol). The formatting
+    itself is checked separately, with decode_state().
+    """
+    value = ord(c) - 32
+    low = (value & 0xF) << 4
+    return (b'[\x00\x10]\x00' + re.escape(bytes([value >> 4]))
+        + b'[' + re.escape(bytes([low])) + b'-' + re.escape(bytes([low | CONTENTS_MASK])) + b']')
+
+
+def transition_tags(old: CharState, new: CharState) -> List[Tag]:
+    """
+    The tags that appear in the text format between two adjacent
+    characters with these formatting states (in the order
+    staffroll_lib.StaffrollLine.fromBinFile() puts them)
+    """
+    tags = []
+    if new[0] and not old[0]:
+        tags.append(Tag.BEGIN_BOLD)
+    elif old[0] and not new[0]:
+        tags.append(Tag.END_BOLD)
+    if new[1] != old[1]:
+        if old[1] in END_CONTENTS_TAGS:
+            tags.append(END_CONTENTS_TAGS[old[1]])
+        if new[1] in BEGIN_CONTENTS_TAGS:
+            tags.append(BEGIN_CONTENTS_TAGS[new[1]])
+    return tags
+
+
+def closing_tags(state: CharState) -> List[Tag]:
+    """
+    The tags that appear in the text format at the end of a line whose
+    last character has this formatting state (in the order
+    staffroll_lib.StaffrollLine.saveAsText() puts them)
+    """
+    tags = []
+    if state[0]:
+        tags.append(Tag.END_BOLD)
+    if state[1] in END_CONTENTS_TAGS:
+        tags.append(END_CONTENTS_TAGS[state[1]])
+    return tags
+
+
+TAG_PATTERN = re.compile('|'.join(re.escape(t.value) for t in Tag), re.IGNORECASE)
+TAGS_BY_NAME = {t.value: t for t in Tag}
+
+
+class Pattern:
+    """
+    A search string in the staffroll text format (e.g.
+    "<bold>SOUND EFFECT</bold>"), compiled for searching staffroll.bin
+    directly. Formatting tags are only allowed at the beginning (opening
+    tags) and end (closing tags), and, like in the text format, require
+    the formatting to actually change there.
+    """
+    text: str
+    leading_tags: List[Tag]
+    trailing_tags: List[Tag]
+    # Possible formatting states of the matched characters
+    states: Set[CharState]
+
+    def __init__(self, pattern: str):
+        super().__init__()
+
+        tokens = []
+        pos = 0
+        for m in TAG_PATTERN.finditer(pattern):
+            if m.start() > pos:
+                tokens.append(pattern[pos:m.start()])
+            tokens.append(TAGS_BY_NAME[m.group().lower()])
+            pos = m.end()
+        if pos < len(pattern):
+            tokens.append(pattern[pos:])
+
+        self.leading_tags = []
+        while tokens and isinstance(tokens[0], Tag):
+            self.leading_tags.append(tokens.pop(0))
+        self.trailing_tags = []
+        while tokens and isinstance(tokens[-1], Tag):
+            self.trailing_tags.insert(0, tokens.pop())
+
+        if len(tokens) != 1:
+            raise ValueError(f'Pattern {pattern!r} must contain text, with tags only at the beginning and end')
+        self.text = tokens[0]
+        check_representable(self.text)
+
+        if Tag.COPYRIGHT in self.leading_tags + self.trailing_tags:
+            raise ValueError(f'Pattern {pattern!r} can\'t contain {Tag.COPYRIGHT}')
+        if any(t.is_end for t in self.leading_tags) or not all(t.is_end for t in self.trailing_tags):
+            raise ValueError(f'Pattern {pattern!r} must only have opening tags at the beginning and closing tags at the end')
+
+        # Figure out which formatting states the tags allow
+        bolds = [False, True]
+        if Tag.BEGIN_BOLD in self.leading_tags or Tag.END_BOLD in self.trailing_tags:
+            bolds = [True]
+
+        contents_options = set()
+        for c, tag in BEGIN_CONTENTS_TAGS.items():
+            if tag in self.leading_tags:
+                contents_options.add(c)
+        for c, tag in END_CONTENTS_TAGS.items():
+            if tag in self.trailing_tags:
+                contents_options.add(c)
+        if len(contents_options) > 1:
+            raise ValueError(f'Pattern {pattern!r} has conflicting tags')
+        contents_list = sorted(contents_options) or list(Contents)
+
+        self.states = {(bold, contents) for bold in bolds for contents in contents_list}
+
+    def match_state(self, words: Tuple[int, ...]) -> Optional[CharState]:
+        """
+        Check if some char_data words spell out the pattern's text, all
+        with the same formatting, which the pattern allows. If so,
+        return that formatting state.
+        """
+        state = None
+        for c, word in zip(self.text, words):
+            if word & COPYRIGHT_FLAG or ((word >> 4) & 0xFF) + 32 != ord(c):
+                return None
+            word_state = decode_state(word)
+            if state is None:
+                state = word_state
+            elif word_state != state:
+                return None
+        if state not in self.states:
+            return None
+        return state
+
+    def check_boundaries(self, before: Optional[CharState], state: CharState, after: Optional[CharState], at_line_end: bool) -> bool:
+        """
+        Check if the tags around a match would be what the pattern
+        requires, in the text format. `before` is the state of the
+        nearest preceding non-copyright character (or None at the
+        start of the line), and `after` is the state of the following
+        character (or None if it's a copyright symbol or the end of the
+        line).
+        """
+        if self.leading_tags:
+            tags = transition_tags(before or LINE_START_STATE, state)
+            if tags[len(tags) - len(self.leading_tags):] != self.leading_tags:
+                return False
+
+        if self.trailing_tags:
+            if at_line_end:
+                tags = closing_tags(state)
+            elif after is None:
+                return False
+            else:
+                tags = transition_tags(state, after)
+            if tags[:len(self.trailing_tags)] != self.trailing_tags:
+                return False
+
+        return True
+
+
+def trie_regex(texts: Iterable[str]) -> bytes:
+    """
+    Create a regex that matches the start of the encoded characters of
+    any of the texts (see char_regex()). The alternatives are factored
+    into a trie, since Python's regex engine would otherwise try each
+    one separately at every position.
+    """
+    trie = {}
+    for text in texts:
+        node = trie
+        for c in text:
+            node = node.setdefault(c, {})
+        # Only the position matters, so anything longer is redundant
+        node.clear()
+        node[None] = {}
+
+    def build(node: dict) -> bytes:
+        parts = []
+        while len(node) == 1 and None not in node:
+            (c, node), = node.items()
+            parts.append(char_regex(c))
+        if None not in node and node:
+            parts.append(b'(?:' + b'|'.join(char_regex(c) + build(child) for c, child in sorted(node.items())) + b')')
+        return b''.join(parts)
+
+    return build(trie)
+
+
+class PatchSet:
+    """
+    A set of (pattern, replacement) pairs, compiled into a single regex
+    so that all of them can be applied in one pass over the file. Where
+    several patterns match at the same place, the first one wins.
+    """
+    patches: List[Tuple[Pattern, str]]
+    regex: 're.Pattern[bytes]'
+    # {first character of a pattern: [patch index]}, in patch order
+    alternatives: Dict[str, List[int]]
+
+    def __init__(self, patches: Iterable[Tuple[str, str]]):
+        super().__init__()
+        self.patches = []
+        self.alternatives = {}
+        for i, (pattern_str, replacement) in enumerate(patches):
+            pattern = Pattern(pattern_str)
+            new_pattern = Pattern(replacement)
+            if (new_pattern.leading_tags, new_pattern.trailing_tags) != (pattern.leading_tags, pattern.trailing_tags):
+                raise ValueError(f'Replacement {replacement!r} must have the same tags as the pattern {pattern_str!r}')
+            self.patches.append((pattern, new_pattern.text))
+            self.alternatives.setdefault(pattern.text[0], []).append(i)
+
+        if self.patches:
+            self.regex = re.compile(trie_regex(pattern.text for pattern, _ in self.patches))
+        else:
+            # Never matches anything
+            self.regex = re.compile(b'(?!)')
+
+
+class StaffrollBuffer:
+    """
+    staffroll.bin data that can be searched and patched in place,
+    without converting it to and from the text format
+    """
+    data: bytearray
+    # [(line header offset, first char offset, number of chars)] for
+    # non-blank lines
+    lines: List[Tuple[int, int, int]]
+    _char_offsets: List[int]
+
+    def __init__(self, data: bytes):
+        super().__init__()
+        self.data = bytearray(data)
+        self._index_lines()
+
+    def _index_lines(self) -> None:
+        """
+        Find where each line is in the data
+        """
+        self.lines = []
+        num_lines, = WORD.unpack_from(self.data, 0)
+        pos = 4
+        for _ in range(num_lines):
+            hdr, = WORD.unpack_from(self.data, pos)
+            if hdr == BLANK_LINE:
+                pos += 4
+                continue
+            num_chars, = WORD.unpack_from(self.data, pos + 4)
+            self.lines.append((pos, pos + 8, num_chars))
+            pos += 8 + 4 * num_chars
+        self._char_offsets = [line[1] for line in self.lines]
+
+    def _char_state(self, offset: int) -> Optional[CharState]:
+        """
+        Get the formatting state of the character at this offset, or
+        None if it's a copyright symbol
+        """
+        char_data, = WORD.unpack_from(self.data, offset)
+        if char_data & COPYRIGHT_FLAG:
+            return None
+        return decode_state(char_data)
+
+    def _check_match(self, pattern: Pattern, offset: int, length: int, state: CharState) -> Optional[int]:
+        """
+        Check if a needle found at this offset is really a match for the
+        pattern, and return its line index if so
+        """
+        # Make sure it's entirely within one line's characters
+        line_idx = bisect.bisect_right(self._char_offsets, offset) - 1
+        if line_idx < 0:
+            return None
+        _, chars_start, num_chars = self.lines[line_idx]
+        chars_end = chars_start + 4 * num_chars
+        if offset + length > chars_end:
+            return None
+
+        before = None
+        for prev in range(offset - 4, chars_start - 4, -4):
+            before = self._char_state(prev)
+            if before is not None:
+                break
+        at_line_end = (offset + length == chars_end)
+        after = None if at_line_end else self._char_state(offset + length)
+
+        if pattern.check_boundaries(before, state, after, at_line_end):
+            return line_idx
+        return None
+
+    def find(self, patch_set: PatchSet) -> Iterator[Tuple[int, int, int, CharState]]:
+        """
+        Find all non-overlapping matches of any of the patterns in a
+        patch set, in order. Yields (patch index, line index, offset,
+        state) tuples.
+        """
+        pos = 4
+        while True:
+            m = patch_set.regex.search(self.data, pos)
+            if m is None:
+                return
+
+            offset = m.start()
+            if offset % 4:
+                pos = offset + 1
+                continue
+
+            # Check which patterns actually match here, in order
+            first_char = chr(((self.data[offset + 2] << 4) | (self.data[offset + 3] >> 4)) + 32)
+            for patch_idx in patch_set.alternatives[first_char]:
+                pattern = patch_set.patches[patch_idx][0]
+                length = 4 * len(pattern.text)
+                if offset + length > len(self.data):
+                    continue
+                state = pattern.match_state(struct.unpack_from(f'>{len(pattern.text)}I', self.data, offset))
+                if state is None:
+                    continue
+                line_idx = self._check_match(pattern, offset, length, state)
+                if line_idx is not None:
+                    yield patch_idx, line_idx, offset, state
+                    pos = offset + length
+                    break
+            else:
+                pos = offset + 4
+
+    def apply(self, patch_set: PatchSet) -> List[int]:
+        """
+        Replace every match of every pattern in the patch set with its
+        replacement text, with the same formatting, in one pass. Returns
+        the number of replacements made for each patch.
+
+        Matches are found the same way as in the text format: a
+        character whose "block contents" value is above 3 counts as
+        <unbreakable>, like in staffroll_lib. If the length changes,
+        lines whose indentation was centered automatically are
+        re-centered.
+
+        For files that staffroll_lib converts to text and back
+        unchanged, the result is exactly the same as if the file had
+        been converted to text, edited and converted back. (Other files
+        can differ: staffroll_lib moves copyright symbols in front of
+        the text they interrupt, and canonicalizes every character's
+        formatting, whereas this leaves everything except the replaced
+        characters alone.)
+        """
+        counts = [0] * len(patch_set.patches)
+
+        # {line index: [(offset, old length, new encoded chars)]}
+        by_line = {}
+        for patch_idx, line_idx, offset, state in self.find(patch_set):
+            pattern, new_text = patch_set.patches[patch_idx]
+            by_line.setdefault(line_idx, []).append(
+                (offset, len(pattern.text) * 4, encode_chars(new_text, state)))
+            counts[patch_idx] += 1
+
+        # Lines where nothing changes length can be patched in place
+        resized_lines = []
+        with memoryview(self.data) as view:
+            for line_idx, replacements in sorted(by_line.items()):
+                if any(old_length != len(new_chars) for _, old_length, new_chars in replacements):
+                    resized_lines.append(line_idx)
+                    continue
+                for offset, old_length, new_chars in replacements:
+                    view[offset:offset + old_length] = new_chars
+
+        if not resized_lines:
+            return counts
+
+        # Otherwise, re-encode those lines, and reassemble the file
+        # around them all at once
+        with memoryview(self.data) as view:
+            pieces = []
+            pos = 0
+            for line_idx in resized_lines:
+                hdr_offset, chars_start, num_chars = self.lines[line_idx]
+                chars_end = chars_start + 4 * num_chars
+                indent, = WORD.unpack_from(self.data, hdr_offset)
+
+                line_pieces = []
+                line_pos = chars_start
+                for offset, old_length, new_chars in by_line[line_idx]:
+                    line_pieces.append(view[line_pos:offset])
+                    line_pieces.append(new_chars)
+                    line_pos = offset + old_length
+                line_pieces.append(view[line_pos:chars_end])
+                new_line_chars = b''.join(line_pieces)
+
+                if indent == auto_indent(view[chars_start:chars_end]):
+                    indent = auto_indent(new_line_chars)
+
+                pieces.append(view[pos:hdr_offset])
+                pieces.append(struct.pack('>II', indent, len(new_line_chars) // 4))
+                pieces.append(new_line_chars)
+                pos = chars_end
+            pieces.append(view[pos:])
+
+            new_data = bytearray(b''.join(pieces))
+
+        self.data = new_data
+        self._index_lines()
+
+        return counts
+
+    def replace(self, pattern: str, replacement: str) -> int:
+        """
+        Replace every match of a single pattern (see apply()). Returns
+        the number of replacements made.
+        """
+        return self.apply(PatchSet([(pattern, replacement)]))[0]
+
+
+def auto_indent(chars: bytes) -> int:
+    """
+    Calculate staffroll_lib.StaffrollLine.auto_indent for a line's
+    encoded characters
+    """
+    num_chars = sum(1 for c, in WORD.iter_unpack(chars) if not c & COPYRIGHT_FLAG)
+    return staffroll_lib.StaffrollLine(0, [' ' * num_chars]).auto_indent
@@ -173,6 +173,17 @@ class DatabaseEntry:
         else:
             return self.options[0]
 
+    def applies_to(self, version: str) -> bool:
+        """
+        Check if this bug is present in the specified game version,
+        according to fixed-in and only-in
+        """
+        if self.fixed_in is not None and version in self.fixed_in:
+            return False
+        if self.only_in is not None and version not in self.only_in:
+            return False
+        return True
+
 
 class Database:
     """
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+
+# MIT License
+#
+# Copyright (c) 2026 RoadrunnerWMC
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import argparse
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+from pathlib import Path
+import struct
+import tempfile
+from typing import Iterator
+
+
+FINGERPRINT_CACHE_VERSION = 1
+
+# How much of a memory-mapped file to hash at a time
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Offsets/sizes of the section tables in a DOL header
+DOL_HEADER_SIZE = 0x100
+DOL_NUM_SECTIONS = 7 + 11
+
+# Same checks as _nsmbwup_check_game_version() in
+# code/src/nsmbwup_common.cpp: the instruction at 0x800cf6cc is
+# different in every version except K and W, which are told apart by a
+# byte at 0x8000423a
+VERSION_PROBE_ADDR = 0x800cf6cc
+VERSION_PROBE_VALUES = {
+    0x40820030: 'P1',
+    0x40820038: 'P2',
+    0x48000465: 'E1',
+    0x2c030000: 'E2',
+    0x480000b4: 'J1',
+    0x4082000c: 'J2',
+    0x38a00001: None,  # K or W
+    0x4182000c: 'C',
+}
+KW_PROBE_ADDR = 0x8000423a
+KW_PROBE_VALUES = {
+    0xc8: 'K',
+    0xac: 'W',
+}
+
+# P3 and J3 run the same code as P2 and J2 at the probed addresses, but
+# are later disc revisions. The revision number is stored in the disc
+# header (sys/boot.bin).
+DISC_HEADER_REVISION_OFFSET = 7
+LATER_REVISIONS = {
+    ('P2', 2): 'P3',
+    ('J2', 2): 'J3',
+}
+
+# Fallback for game roots without a sys/ directory
+COPYDATE_FILE_NAMES = {
+    'COPYDATE_CODE_2009-10-03_232911': 'P1',
+    'COPYDATE_CODE_2009-10-03_232303': 'E1',
+    'COPYDATE_CODE_2009-10-03_231655': 'J1',
+    'COPYDATE_CODE_2010-01-05_152101': 'P2',
+    'COPYDATE_CODE_2010-01-05_143554': 'E2',
+    'COPYDATE_CODE_2010-01-05_160530': 'J2',
+    'COPYDATE_CODE_2010-03-12_153510': 'K',
+    'COPYDATE_CODE_2010-03-15_160349': 'W',
+    'COPYDATE_CODE_2016-05-03_111248': 'C',
+}
+
+
+@contextlib.contextmanager
+def map_file(path: Path) -> Iterator[mmap.mmap | bytes]:
+    """
+    Memory-map a file for reading
+    """
+    with path.open('rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # (mmap doesn't accept empty files)
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            yield m
+
+
+def hash_data(data: mmap.mmap | bytes) -> str:
+    """
+    Compute the SHA-1 of a (memory-mapped) file's contents, a chunk at a
+    time
+    """
+    h = hashlib.sha1()
+    view = memoryview(data)
+    try:
+        for i in range(0, len(view), HASH_CHUNK_SIZE):
+            h.update(view[i : i + HASH_CHUNK_SIZE])
+    finally:
+        view.release()
+    return h.hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    """
+    Compute the SHA-1 of a file, by memory-mapping it and hashing it a
+    chunk at a time
+    """
+    with map_file(path) as data:
+        return hash_data(data)
+
+
+def find_sys_dir(root: Path) -> Path | None:
+    """
+    Find the "sys" directory (with main.dol and boot.bin) that belongs
+    to a game root. Depending on the extraction tool, it's either inside
+    the game root or next to it.
+    """
+    for candidate in [root / 'sys', root.parent / 'sys']:
+        if (candidate / 'main.dol').is_file():
+            return candidate
+    return None
+
+
+def read_dol_address(dol: mmap.mmap | bytes, address: int, size: int) -> bytes | None:
+    """
+    Read `size` bytes from a DOL file at the address they'd be loaded
+    to, or return None if that address isn't in any section
+    """
+    if len(dol) < DOL_HEADER_SIZE:
+        return None
+
+    offsets = struct.unpack_from(f'>{DOL_NUM_SECTIONS}I', dol, 0x00)
+    addresses = struct.unpack_from(f'>{DOL_NUM_SECTIONS}I', dol, 0x48)
+    sizes = struct.unpack_from(f'>{DOL_NUM_SECTIONS}I', dol, 0x90)
+
+    for offset, start, section_size in zip(offsets, addresses, sizes):
+        if start <= address and address + size <= start + section_size:
+            file_offset = offset + address - start
+            if file_offset + size <= len(dol):
+                return dol[file_offset : file_offset + size]
+    return None
+
+
+def identify_from_dol(dol: mmap.mmap | bytes, disc_header: bytes | None) -> str | None:
+    """
+    Identify the game version from the contents of main.dol (and the
+    disc header, if available), or return None if it isn't recognized
+    """
+    data = read_dol_address(dol, VERSION_PROBE_ADDR, 4)
+    if data is None:
+        return None
+    value, = struct.unpack('>I', data)
+    if value not in VERSION_PROBE_VALUES:
+        return None
+
+    version = VERSION_PROBE_VALUES[value]
+    if version is None:
+        data = read_dol_address(dol, KW_PROBE_ADDR, 1)
+        if data is None:
+            return None
+        version = KW_PROBE_VALUES.get(data[0])
+
+    if disc_header is not None and len(disc_header) > DISC_HEADER_REVISION_OFFSET:
+        revision = disc_header[DISC_HEADER_REVISION_OFFSET]
+        version = LATER_REVISIONS.get((version, revision), version)
+
+    return version
+
+
+def identify_from_copydate(root: Path) -> str | None:
+    """
+    Identify the game version from the COPYDATE_CODE_* file in the game
+    root. This can't tell P3 and J3 apart from P2 and J2.
+    """
+    for name, version in COPYDATE_FILE_NAMES.items():
+        if (root / name).is_file():
+            return version
+    return None
+
+
+def find_copydate_file_name(root: Path) -> str | None:
+    """
+    Get the name of the COPYDATE_CODE_* file in the game root, if any
+    (including unrecognized ones)
+    """
+    for path in sorted(root.glob('COPYDATE_CODE_*')):
+        return path.name
+    return None
+
+
+class FingerprintCache:
+    """
+    Identifies game roots by the hashes of their main.dol and boot.bin,
+    and remembers both the hashes (keyed on path, size and mtime) and
+    the versions they were identified as, so repeated runs don't need to
+    re-read anything. Game roots without a sys/ directory are identified
+    by their path and COPYDATE_CODE_* file name instead.
+    """
+    cache_file: Path | None
+    # {absolute path: {"size": ..., "mtime_ns": ..., "sha1": ...}}
+    files: dict[str, dict]
+    # {fingerprint: version}
+    versions: dict[str, str]
+    dirty: bool
+
+    def __init__(self, cache_file: Path | None = None):
+        super().__init__()
+        self.cache_file = cache_file
+        self.files = {}
+        self.versions = {}
+        self.dirty = False
+
+        if cache_file is not None:
+            try:
+                j = json.loads(cache_file.read_text(encoding='utf-8'))
+                if j.get('version') == FINGERPRINT_CACHE_VERSION:
+                    self.files = j['files']
+                    self.versions = j['versions']
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def save(self) -> None:
+        """
+        Write the cache back to disk, if anything changed
+        """
+        if self.cache_file is None or not self.dirty:
+            return
+
+        data = json.dumps({
+            'version': FINGERPRINT_CACHE_VERSION,
+            'files': self.files,
+            'versions': self.versions,
+        }, indent=1)
+
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=self.cache_file.name, dir=self.cache_file.parent)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(temp_path, self.cache_file)
+        except OSError:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+        self.dirty = False
+
+    def file_hash(self, path: Path, data: mmap.mmap | bytes | None = None) -> str:
+        """
+        Get the SHA-1 of a file, reusing the cached value if the file's
+        size and mtime haven't changed. If the file is already mapped,
+        its contents can be passed as `data`.
+        """
+        path = path.resolve()
+        st = path.stat()
+        entry = self.files.get(str(path))
+        if entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return entry['sha1']
+
+        sha1 = hash_file(path) if data is None else hash_data(data)
+        self.files[str(path)] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': sha1}
+        self.dirty = True
+        return sha1
+
+    def fingerprint(self, root: Path, dol_data: mmap.mmap | bytes | None = None) -> str:
+        """
+        Get the fingerprint of a game root: based on the hashes of
+        main.dol and boot.bin, or, if it has no sys/ directory, its
+        absolute path and COPYDATE_CODE_* file name. If main.dol is
+        already mapped, its contents can be passed as `dol_data`.
+        """
+        sys_dir = find_sys_dir(root)
+        if sys_dir is None:
+            return f'{root.resolve()}:{find_copydate_file_name(root)}'
+
+        parts = [self.file_hash(sys_dir / 'main.dol', dol_data)]
+        if (sys_dir / 'boot.bin').is_file():
+            parts.append(self.file_hash(sys_dir / 'boot.bin'))
+        return '-'.join(parts)
+
+    def identify(self, root: Path) -> str | None:
+        """
+        Identify the game version at the specified path, or return None
+        if it isn't recognized
+        """
+        sys_dir = find_sys_dir(root)
+        if sys_dir is None:
+            version = self.versions.get(self.fingerprint(root))
+            if version is not None:
+                return version
+            return identify_from_copydate(root)
+
+        # main.dol is mapped once, and both hashed (if its hash isn't
+        # cached already) and probed through that same mapping
+        with map_file(sys_dir / 'main.dol') as dol_data:
+            fingerprint = self.fingerprint(root, dol_data)
+            version = self.versions.get(fingerprint)
+            if version is not None:
+                return version
+
+            disc_header = None
+            if (sys_dir / 'boot.bin').is_file():
+                disc_header = (sys_dir / 'boot.bin').read_bytes()
+            version = identify_from_dol(dol_data, disc_header)
+
+        if version is None:
+            version = identify_from_copydate(root)
+        if version is not None:
+            self.versions[fingerprint] = version
+            self.dirty = True
+        return version
+
+    def remember(self, root: Path, version: str) -> None:
+        """
+        Record that the game root at the specified path is the specified
+        version, so that it's identified as such from now on
+        """
+        fingerprint = self.fingerprint(root)
+        if self.versions.get(fingerprint) != version:
+            self.versions[fingerprint] = version
+            self.dirty = True
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    Main function
+    """
+    parser = argparse.ArgumentParser(
+        description='Identify the game versions of extracted NSMBW game roots.')
+
+    parser.add_argument('game_root', type=Path, nargs='+',
+        help='extracted game root (with "Effect", "Env", "HomeButton2", etc. subdirectories)')
+    parser.add_argument('--cache', type=Path,
+        help='cache file to read and update')
+
+    args = parser.parse_args(argv)
+
+    cache = FingerprintCache(args.cache)
+    for root in args.game_root:
+        version = cache.identify(root)
+        print(f'{root}: {version or "unknown"} (fingerprint: {cache.fingerprint(root)})')
+    cache.save()
+
+
+if __name__ == '__main__':
+    main()